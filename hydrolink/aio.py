@@ -0,0 +1,298 @@
+"""Asyncio interface for HydroLinking many points.
+
+Allows HydroLinking to be embedded in asyncio applications.  Service calls for each point
+(waterbody query, flowline query, waterbody flowline query and the NHDPlusV2 nonnetwork
+flowline query) are awaited as coroutines with a single limit on the number of requests in
+flight, so many points are HydroLinked without a thread per point.  Evaluation and selection
+of flowlines use the same methods as nhd_hr.HighResPoint and nhd_mr.MedResPoint, and run in
+threads (as do backends answering queries directly, e.g. local.LocalNHD) so they do not block
+requests in flight.  Only a limited number of points are HydroLinked at a time, see hydrolink_iter.
+
+Requires aiohttp, which is not installed with HydroLink (pip install aiohttp).
+
+Example
+----------
+hydrolinks = await aio.hydrolink_many(rows, nhd_version='nhdplusv2', concurrency=20)
+
+async for hydrolink in aio.hydrolink_iter(rows, concurrency=20):
+    hydrolink.write_hydrolink(writer=writer)
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import asyncio
+import collections
+import functools
+from hydrolink import backends
+from hydrolink import batch
+from hydrolink import flowline_index
+from hydrolink import nhd_mr
+from hydrolink import session as hl_session
+from hydrolink import throttle as hl_throttle
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# failures retried when the backend has a throttle.Throttle
+RETRY_ERRORS = (hl_throttle.RetryableError, asyncio.TimeoutError)
+if aiohttp is not None:
+    RETRY_ERRORS += (aiohttp.ClientConnectionError,)
+
+############################################################################################
+############################################################################################
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run blocking or CPU bound func in the default executor, so the event loop keeps serving requests in flight."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def build_client_session(concurrency=10, timeout=60):
+    """Build aiohttp session with keep-alive connections for HydroLink service calls.
+
+    Parameters
+    ----------
+    concurrency: int, default 10
+        Maximum number of open connections
+    timeout: float, default 60
+        Total timeout in seconds for each request
+
+    Returns
+    ----------
+    session: aiohttp.ClientSession
+
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for hydrolink.aio, install with pip install aiohttp')
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def fetch_json(session, url, semaphore, backend=None):
+    """Request url and return JSON, waiting on semaphore to limit requests in flight.
+
+    Parameters
+    ----------
+    session: aiohttp.ClientSession
+        Session used for requests
+    url: str
+        Query built in build_nhd_query
+    semaphore: asyncio.Semaphore
+        Limits the number of requests in flight
+    backend: backends.QueryBackend, optional
+        Backend of the HydroLink object.  Cached responses of a backends.CachedBackend are returned
+        without a request, flowline queries covered by a flowline_index.FlowlineIndex are answered from the
+        index, remaining pages of truncated responses of a backends.PagedBackend are
+        requested concurrently, backends.RestBackend queries are requested with session (at the
+        backend base_url when set) and other backends (e.g. local.LocalNHD) answer the query in a thread.
+
+    """
+    if isinstance(backend, backends.CachedBackend):
+        results = await run_in_thread(backend.cache.get, url)
+        if results is None:
+            results = await fetch_json(session, url, semaphore, backend.backend)
+            await run_in_thread(backend.cache.set, url, results)
+        return results
+    if isinstance(backend, flowline_index.FlowlineIndex):
+        results = await run_in_thread(backend.lookup, url)
+        if results is None:
+            results = await fetch_json(session, url, semaphore, backend.backend)
+            await run_in_thread(backend.add, url, results)
+        return results
+    if isinstance(backend, backends.PagedBackend):
+        first_page = await fetch_json(session, url, semaphore, backend.backend)
+        if not backends.is_truncated(first_page):
+            return first_page
+        count = await fetch_json(session, backends.count_url(url), semaphore, backend.backend)
+        pages = backend.page_urls(url, first_page, count.get('count'))
+        pages = await asyncio.gather(*[fetch_json(session, u, semaphore, backend.backend) for offset, u in pages])
+        return backends.merge_pages([first_page] + list(pages), count=count.get('count'))
+    if backend is not None and not isinstance(backend, backends.RestBackend):
+        return await run_in_thread(backend.request_json, url)
+
+    request_url = backend.service_url(url) if backend is not None else url
+    # with a throttle.Throttle failed requests are retried with backoff, rate limits are left to semaphore
+    throttle = backend.throttle if backend is not None else None
+    attempts = throttle.retries + 1 if throttle is not None else 1
+    for attempt in range(attempts):
+        try:
+            async with semaphore:
+                async with session.get(request_url) as response:
+                    if throttle is not None and getattr(response, 'status', 200) in hl_throttle.RETRY_STATUS:
+                        raise hl_throttle.RetryableError(f'status code {response.status}')
+                    # ArcGIS services do not always return an application/json content type
+                    return await response.json(content_type=None)
+        except RETRY_ERRORS:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(throttle.backoff_seconds(attempt))
+
+
+def requires_session(backend):
+    """Check if queries of backend are requested with an aiohttp session."""
+    if isinstance(backend, (backends.CachedBackend, backends.PagedBackend, flowline_index.FlowlineIndex)):
+        return requires_session(backend.backend)
+    return isinstance(backend, backends.RestBackend)
+
+
+async def hydrolink_point(hydrolink, session, semaphore, method='name_match', hydro_type='flowline', similarity_cutoff=0.6):
+    """HydroLink a single point, awaiting service calls.
+
+    Follows the same steps as hydrolink_method, without writing output.
+
+    Parameters
+    ----------
+    hydrolink: nhd_hr.HighResPoint or nhd_mr.MedResPoint
+        Object to HydroLink
+    session: aiohttp.ClientSession
+        Session used for service calls
+    semaphore: asyncio.Semaphore
+        Limits the number of requests in flight across all points
+    method: {'name_match', 'closest'}, default 'name_match'
+        Method for HydroLinking data, see nhd_hr.HighResPoint.hydrolink_method
+    hydro_type: {'waterbody', 'flowline'}, default 'flowline'
+        Type of features to HydroLink, see nhd_hr.HighResPoint.hydrolink_method
+    similarity_cutoff: float
+        Values between 0.6 and 1.0, see nhd_hr.HighResPoint.hydrolink_method
+
+    Returns
+    ----------
+    hydrolink: nhd_hr.HighResPoint or nhd_mr.MedResPoint
+        HydroLinked object, use write_hydrolink to write output
+
+    """
+    if hydrolink.status == 1:
+        hydrolink.build_nhd_query()
+
+    if hydrolink.status == 1 and hydro_type == 'waterbody' and hydrolink.waterbody_query is not None:
+        try:
+            hydrolink.set_waterbody(await fetch_json(session, hydrolink.waterbody_query, semaphore, hydrolink.backend))
+        except Exception:
+            hydrolink.message = f'is_in_waterbody failed for: {hydrolink.source_id}. possibly service call issue'
+            hydrolink.error_handling()
+
+    if hydrolink.status == 1:
+        try:
+            if isinstance(hydrolink, nhd_mr.MedResPoint) and hydrolink.combines_nonnetwork():
+                hydrolink.build_nhd_query(query=['nonnetwork_flow'])
+                flowlines_json = nhd_mr.combine_flowlines(*await asyncio.gather(
+                    fetch_json(session, hydrolink.flowline_query, semaphore, hydrolink.backend),
+                    fetch_json(session, hydrolink.nonnetwork_flowline_query, semaphore, hydrolink.backend)))
+            else:
+                flowlines_json = await fetch_json(session, hydrolink.flowline_query, semaphore, hydrolink.backend)
+                # NHDPlusV2 falls back to nonnetwork flowlines when no network flowlines are returned
+                if isinstance(hydrolink, nhd_mr.MedResPoint) and hydrolink.requires_nonnetwork_query(flowlines_json):
+                    hydrolink.build_nhd_query(query=['nonnetwork_flow'])
+                    flowlines_json = await fetch_json(session, hydrolink.nonnetwork_flowline_query, semaphore, hydrolink.backend)
+            await run_in_thread(hydrolink.set_flowlines, flowlines_json)
+        except Exception:
+            hydrolink.message = f'query_flowlines failed for id: {hydrolink.source_id}. Request failed.'
+            hydrolink.error_handling()
+
+    return await run_in_thread(batch.evaluate_flowlines, hydrolink, method=method, similarity_cutoff=similarity_cutoff)
+
+
+async def hydrolink_iter(rows, nhd_version='nhdhr', method='name_match', hydro_type='flowline', buffer_m=1000,
+                         similarity_cutoff=0.6, concurrency=10, session=None, cache=None, backend=None, combine_nonnetwork=False,
+                         distance_mode='albers', flowline_cache=None, max_pending=None):
+    """HydroLink rows of input data concurrently using asyncio, yielding HydroLinked objects in input order.
+
+    Rows are read and HydroLink objects built as points are started.  Only max_pending points are
+    started ahead of the object being yielded, so memory and scheduled tasks stay flat for large inputs.
+
+    Parameters
+    ----------
+    rows, nhd_version, method, hydro_type, buffer_m, similarity_cutoff, concurrency, session, cache, backend, combine_nonnetwork,
+    distance_mode, flowline_cache
+        See hydrolink_many
+    max_pending: int, optional
+        Maximum number of points started and not yet yielded, default is 4 times concurrency
+
+    Returns
+    ----------
+    async generator of HydroLinked objects in the same order as rows, use write_hydrolink to write output
+
+    """
+    if method not in ['name_match', 'closest'] or hydro_type not in ['waterbody', 'flowline']:
+        raise ValueError(f'method {method} or hydro_type {hydro_type} not supported')
+    if max_pending is None:
+        max_pending = concurrency * 4
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # objects keep a backend (and requests session) for synchronous use, share one rather than building one per point
+    backend = backends.build_backend(session=hl_session.get_session(), cache=cache, backend=backend)
+
+    close_session = session is None and requires_session(backend)
+    if close_session:
+        session = build_client_session(concurrency=concurrency)
+    pending = collections.deque()
+    try:
+        for row in rows:
+            hydrolink = batch.build_point(row, nhd_version=nhd_version, buffer_m=buffer_m, backend=backend, combine_nonnetwork=combine_nonnetwork,
+                                          distance_mode=distance_mode, flowline_cache=flowline_cache)
+            pending.append(asyncio.ensure_future(hydrolink_point(hydrolink, session, semaphore, method=method, hydro_type=hydro_type,
+                                                                 similarity_cutoff=similarity_cutoff)))
+            if len(pending) >= max_pending:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        if close_session:
+            await session.close()
+
+
+async def hydrolink_many(rows, nhd_version='nhdhr', method='name_match', hydro_type='flowline', buffer_m=1000,
+                         similarity_cutoff=0.6, concurrency=10, session=None, cache=None, backend=None, combine_nonnetwork=False,
+                         distance_mode='albers', flowline_cache=None, max_pending=None):
+    """HydroLink rows of input data concurrently using asyncio.
+
+    Parameters
+    ----------
+    rows: iterable
+        Rows of input data with attributes id, lat, lon, crs and stream (e.g. pandas.DataFrame.itertuples())
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+    method: {'name_match', 'closest'}, default 'name_match'
+        Method for HydroLinking data, see nhd_hr.HighResPoint.hydrolink_method
+    hydro_type: {'waterbody', 'flowline'}, default 'flowline'
+        Type of features to HydroLink, see nhd_hr.HighResPoint.hydrolink_method
+    buffer_m: int
+        Distance in meters. Used as buffer to search for canidate NHD features
+    similarity_cutoff: float
+        Values between 0.6 and 1.0, see nhd_hr.HighResPoint.hydrolink_method
+    concurrency: int, default 10
+        Maximum number of service requests in flight across all points
+    session: aiohttp.ClientSession, optional
+        Session used for service calls, default builds one with build_client_session and closes it when done
+    cache: cache.ResponseCache, optional
+        Cache of service responses shared by all points
+    backend: backends.QueryBackend, optional
+        Answers queries instead of NHD services, e.g. local.LocalNHD. Default requests NHD services.
+    combine_nonnetwork: bool, default False
+        NHDPlusV2 only, query network and nonnetwork flowlines concurrently, see nhd_mr.MedResPoint
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances, see utils.distances_meters
+    flowline_cache: cache.FlowlineCache, optional
+        Holds flowlines shared by all points as compact arrays, see nhd_hr.HighResPoint
+    max_pending: int, optional
+        Maximum number of points HydroLinked at a time, default is 4 times concurrency, see hydrolink_iter
+
+    Returns
+    ----------
+    hydrolinks: list
+        HydroLinked objects in the same order as rows, use write_hydrolink to write output.  Use
+        hydrolink_iter to write output as points are HydroLinked rather than holding all objects.
+
+    """
+    return [hydrolink async for hydrolink in hydrolink_iter(rows, nhd_version=nhd_version, method=method, hydro_type=hydro_type,
+                                                             buffer_m=buffer_m, similarity_cutoff=similarity_cutoff, concurrency=concurrency,
+                                                             session=session, cache=cache, backend=backend,
+                                                             combine_nonnetwork=combine_nonnetwork, distance_mode=distance_mode,
+                                                             flowline_cache=flowline_cache, max_pending=max_pending)]
@@ -0,0 +1,311 @@
+"""Backends that answer queries built in build_nhd_query.
+
+HydroLink classes request every query through a backend.  A backend takes a query url and
+returns the JSON response as a dictionary.  Backends include
+
+- RestBackend: requests NHD services (default), optionally at another host such as mock_server.MockArcGISServer
+- CachedBackend: answers queries from a cache.ResponseCache, requesting misses from another backend
+- PagedBackend: requests remaining pages of responses truncated by the service (exceededTransferLimit)
+- local.LocalNHD: answers queries from locally stored NHD data
+- FixtureBackend: answers queries from recorded responses held in memory (e.g. tests/flowlines_json.json)
+- flowline_index.FlowlineIndex: answers flowline queries of nearby points from flowlines already fetched
+
+Custom backends subclass QueryBackend and implement request_json.
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urlunsplit
+from hydrolink import cache as hl_cache
+from hydrolink import session as hl_session
+
+############################################################################################
+############################################################################################
+
+
+def build_backend(session=None, cache=None, backend=None):
+    """Return backend used by HydroLink classes for the supplied arguments.
+
+    Parameters
+    ----------
+    session: requests.Session, optional
+        Session used to request NHD services, default is the shared session
+    cache: cache.ResponseCache, optional
+        Cache of responses
+    backend: QueryBackend, optional
+        Backend answering queries, default is RestBackend using session
+
+    Returns
+    ----------
+    backend: QueryBackend
+        backend, with RestBackend wrapped in PagedBackend and wrapped in CachedBackend when cache is supplied
+
+    """
+    if backend is None:
+        backend = RestBackend(session=session)
+    if isinstance(backend, RestBackend):
+        backend = PagedBackend(backend)
+    if cache is not None:
+        backend = CachedBackend(backend, cache)
+    return backend
+
+
+class QueryBackend:
+    """Interface for answering queries built in build_nhd_query."""
+
+    def request_json(self, url):
+        """Answer query url, returning JSON shaped like the ArcGIS REST response as a dictionary."""
+        raise NotImplementedError
+
+
+class RestBackend(QueryBackend):
+    """Requests queries from NHD services."""
+
+    def __init__(self, session=None, base_url=None, throttle=None):
+        """Initiate backend.
+
+        Parameters
+        ----------
+        session: requests.Session, optional
+            Session used for requests, default is the shared session from session.get_session
+        base_url: str, optional
+            Scheme and host that replace those of each query, e.g. 'http://127.0.0.1:8000' to request
+            a mock_server.MockArcGISServer. Default requests the NHD services in the query.
+        throttle: throttle.Throttle, optional
+            Limits rate and concurrency of requests per host and retries failed requests.
+            Default makes each request once without limits.
+
+        """
+        self.session = session if session is not None else hl_session.get_session()
+        self.base_url = base_url
+        self.throttle = throttle
+
+    def service_url(self, url):
+        """Return url that is requested for query url."""
+        if self.base_url is None:
+            return url
+        base = urlsplit(self.base_url)
+        parts = urlsplit(url)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ''))
+
+    def request_json(self, url):
+        """Request query url and return JSON."""
+        if self.throttle is not None:
+            return self.throttle.request_json(self.service_url(url), self.session)
+        return hl_session.request_json(self.service_url(url), self.session)
+
+
+class CachedBackend(QueryBackend):
+    """Answers queries from a response cache, requesting misses from another backend."""
+
+    def __init__(self, backend, cache):
+        """Initiate backend.
+
+        Parameters
+        ----------
+        backend: QueryBackend
+            Backend requested when a query is not cached
+        cache: cache.ResponseCache
+            Cache of responses
+
+        """
+        self.backend = backend
+        self.cache = cache
+
+    def request_json(self, url):
+        """Return cached JSON for query url, requesting and caching it when not cached."""
+        results = self.cache.get(url)
+        if results is None:
+            results = self.backend.request_json(url)
+            self.cache.set(url, results)
+        return results
+
+
+def count_url(url):
+    """Return query url requesting only the number of features matching url."""
+    return f'{url}&returnCountOnly=true'
+
+
+def page_url(url, offset, page_size):
+    """Return query url requesting page_size features starting at offset."""
+    return f'{url}&resultOffset={offset}&resultRecordCount={page_size}'
+
+
+class PagedBackend(QueryBackend):
+    """Requests all pages of responses truncated by the service.
+
+    ArcGIS services return at most a maximum record count of features per request and flag
+    truncated responses with exceededTransferLimit, e.g. flowlines within a 2000 meter buffer
+    in dense networks or flowlines of large waterbodies.  When the first response is truncated the
+    number of matching features is requested and remaining pages (resultOffset and
+    resultRecordCount, with the page size of the first response) are requested concurrently.
+    """
+
+    def __init__(self, backend, workers=4, max_pages=100):
+        """Initiate backend.
+
+        Parameters
+        ----------
+        backend: QueryBackend
+            Backend requesting each page, e.g. RestBackend
+        workers: int, default 4
+            Number of pages requested concurrently
+        max_pages: int, default 100
+            Maximum number of pages requested for a query
+
+        """
+        self.backend = backend
+        self.workers = workers
+        self.max_pages = max_pages
+
+    def page_urls(self, url, first_page, count):
+        """Return offsets and urls of pages after first_page for a query matching count features.
+
+        At most max_pages pages are requested, merge_pages flags responses left incomplete.
+        """
+        if count is None:
+            raise ValueError(f'feature count not returned for truncated query: {url}')
+        page_size = len(first_page['features'])
+        offsets = range(page_size, min(count, self.max_pages * page_size), page_size)
+        return [(offset, page_url(url, offset, page_size)) for offset in offsets]
+
+    def remaining_pages(self, url, first_page):
+        """Return number of features matching url and offsets and urls of pages after first_page, (None, []) if first_page is complete."""
+        if not is_truncated(first_page):
+            return None, []
+        count = self.backend.request_json(count_url(url)).get('count')
+        return count, self.page_urls(url, first_page, count)
+
+    def request_pages(self, pages):
+        """Yield (offset, page) of pages (offsets and urls) as they arrive, requested concurrently."""
+        if len(pages) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(pages))) as executor:
+            futures = {executor.submit(self.backend.request_json, u): offset for offset, u in pages}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def iter_pages(self, url):
+        """Yield (offset, page) of each page of query url, remaining pages as they arrive."""
+        first_page = self.backend.request_json(url)
+        yield 0, first_page
+        count, pages = self.remaining_pages(url, first_page)
+        yield from self.request_pages(pages)
+
+    def request_json(self, url):
+        """Return JSON of query url with features of all pages, in the order returned by the service.
+
+        Responses with more features than max_pages pages keep exceededTransferLimit, see merge_pages.
+        """
+        first_page = self.backend.request_json(url)
+        count, pages = self.remaining_pages(url, first_page)
+        pages = dict(self.request_pages(pages))
+        pages[0] = first_page
+        return merge_pages([pages[offset] for offset in sorted(pages)], count=count)
+
+
+def is_truncated(results):
+    """Check if response was truncated by the service (exceededTransferLimit)."""
+    return bool(results.get('exceededTransferLimit')) and len(results.get('features', [])) > 0
+
+
+def merge_pages(pages, count=None):
+    """Merge pages of a response into one response, raising ValueError if a page is an error response.
+
+    Parameters
+    ----------
+    pages: list
+        JSON of pages in order of offset, the first page is the response of the query
+    count: int, optional
+        Number of features matching the query.  Merged responses with fewer features (e.g. more pages
+        than PagedBackend.max_pages) keep exceededTransferLimit so they are not used as complete,
+        e.g. by flowline_index.FlowlineIndex.
+
+    Returns
+    ----------
+    results: dictionary
+
+    """
+    for page in pages:
+        if 'error' in page:
+            raise ValueError(f"page request failed: {page['error']}")
+    results = dict(pages[0])
+    if len(pages) > 1:
+        results['features'] = [feature for page in pages for feature in page.get('features', [])]
+        results.pop('exceededTransferLimit', None)
+    if count is not None and len(results.get('features', [])) < count:
+        results['exceededTransferLimit'] = True
+    return results
+
+
+class FixtureBackend(QueryBackend):
+    """Answers queries from recorded responses held in memory.
+
+    Responses are matched on the path and query of a url (the host is ignored) so they can be
+    recorded from NHD services and served by mock_server.MockArcGISServer.  Queries are first
+    matched on the complete normalized url, then on the MapServer layer (url without query), and
+    otherwise receive default_response.
+    """
+
+    def __init__(self, responses=None, default_response=None):
+        """Initiate backend.
+
+        Parameters
+        ----------
+        responses: dictionary, optional
+            Keys are query urls or MapServer layer urls (e.g. nhd_hr.HEM_FLOWLINE_URL), values are JSON dictionaries
+        default_response: dictionary, optional
+            Response for queries not in responses, default is {'features': []}
+
+        """
+        self.responses = {}
+        for url, results in (responses or {}).items():
+            self.add_response(url, results)
+        self.default_response = default_response if default_response is not None else {'features': []}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, url=None):
+        """Build backend from recorded JSON file, e.g. tests/flowlines_json.json.
+
+        Parameters
+        ----------
+        path: str
+            JSON file of a recorded response
+        url: str, optional
+            Query or MapServer layer url answered with the response, default answers all queries
+
+        """
+        with open(path) as f:
+            results = json.load(f)
+        if url is None:
+            return cls(default_response=results)
+        return cls(responses={url: results})
+
+    @staticmethod
+    def key(url):
+        """Return key of url used to match responses, the normalized url without scheme and host."""
+        parts = urlsplit(hl_cache.normalize_url(url))
+        return f'{parts.path}?{parts.query}'
+
+    def add_response(self, url, results):
+        """Add recorded response for query or MapServer layer url."""
+        self.responses[self.key(url)] = results
+
+    def request_json(self, url):
+        """Return recorded response for query url."""
+        with self._lock:
+            self.requests.append(url)
+        key = self.key(url)
+        if key in self.responses:
+            return self.responses[key]
+        layer_key = key.split('?')[0] + '?'
+        return self.responses.get(layer_key, self.default_response)
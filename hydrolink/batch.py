@@ -0,0 +1,561 @@
+"""Methods for HydroLinking many points in a single program.
+
+HydroLinking a point is dominated by time spent waiting on NHD services.  Methods in this module
+HydroLink rows of input data using a pool of worker threads so that requests for multiple points
+are in flight at the same time.  Results are always returned in the order of the input rows.
+
+For points that are close together hydrolink_rows_tiled groups points into spatial tiles and
+queries flowlines once per tile, evaluating each point against the flowlines shared by the tile.
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import collections
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from hydrolink import nhd_hr
+from hydrolink import nhd_mr
+from hydrolink import output
+from hydrolink import selection as hl_selection
+from hydrolink import session as hl_session
+from hydrolink import utils
+
+############################################################################################
+############################################################################################
+
+
+def prepare_rows(df):
+    """Reproject coordinates of input data to NAD83 and check they are within the United States.
+
+    Coordinates of all rows sharing a crs are reprojected in one call, rather than once per
+    HydroLink object, and checked against the bounding box of the United States (utils.US_BOUNDS)
+    as arrays, so rejected rows are known before any HydroLink objects are built or services requested.
+    Rows that can not be reprojected (e.g. missing coordinates, missing or unknown crs) are left unchanged
+    and rejected, see RejectedPoint and hydrolink_prepared_rows.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Input data with columns id, lat, lon, crs and stream, see hydrolinker.handle_data
+
+    Returns
+    ----------
+    df: pandas.DataFrame
+        Copy of df with lat and lon of reprojected rows in NAD83 (crs 4269), column in_nad83, False for rows
+        that could not be reprojected, and column in_us_bounds, False for rows that are not HydroLinked
+        because coordinates are outside the United States or could not be reprojected
+
+    """
+    df = df.copy()
+    lons = pd.to_numeric(df['lon'], errors='coerce').to_numpy(dtype=float, copy=True)
+    lats = pd.to_numeric(df['lat'], errors='coerce').to_numpy(dtype=float, copy=True)
+    # missing and text crs (e.g. 'epsg:4326') are not reprojected
+    crs = pd.to_numeric(df['crs'], errors='coerce').to_numpy(dtype=float)
+    nad83 = (crs == 4269) & np.isfinite(lons) & np.isfinite(lats)
+    for value in np.unique(crs[np.isfinite(crs) & ~nad83]):
+        rows = crs == value
+        try:
+            x, y = utils.coordinates_to_nad83(lons[rows], lats[rows], value)
+        except pyproj.exceptions.CRSError:
+            continue
+        transformed = np.isfinite(x) & np.isfinite(y)
+        index = np.flatnonzero(rows)[transformed]
+        lons[index] = x[transformed]
+        lats[index] = y[transformed]
+        nad83[index] = True
+
+    df.loc[nad83, 'lon'] = lons[nad83]
+    df.loc[nad83, 'lat'] = lats[nad83]
+    df.loc[nad83, 'crs'] = 4269
+    df['in_nad83'] = nad83
+    df['in_us_bounds'] = nad83 & utils.in_us_bounds(lons, lats)
+    return df
+
+
+class RejectedPoint:
+    """Row of input data rejected by prepare_rows, written as a failed HydroLink object without building one.
+
+    Messages are those of the HydroLink classes for the same row.
+    """
+
+    def __init__(self, row, nhd_version='nhdhr', buffer_m=1000):
+        """Initiate rejected point.
+
+        Parameters
+        ----------
+        row: namedtuple
+            Row of prepare_rows output with attributes id, lat, lon, stream, in_nad83 and in_us_bounds
+        nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+            Version of National Hydrography Dataset, selects the fields of output
+        buffer_m: int
+            Distance in meters. Used as buffer to search for canidate NHD features
+
+        """
+        self.source_id = str(row.id)
+        water_name = row.stream
+        self.water_name = str(water_name) if water_name and str(water_name) != 'nan' else None
+        self.init_lat = coordinate(row.lat)
+        self.init_lon = coordinate(row.lon)
+        self.buffer_m = int(buffer_m)
+        self.nhd_version = nhd_version
+        self.status = 0
+        if buffer_m > 2000:
+            self.message = ('Maximum buffer is 2000 meters, reduce buffer.')
+        elif not row.in_nad83:
+            self.message = f'Issues handling provided coordinate system or coordinates for {self.source_id}. Consider using a common crs like 4269 (NAD83) or 4326 (WGS84).'
+        else:
+            self.message = f'Coordinates for id: {self.source_id} are outside of the bounding box of the United States.'
+
+    def write_hydrolink(self, outfile_name=None, writer=None):
+        """Write failure output, see nhd_hr.HighResPoint.write_hydrolink."""
+        source_data = {'source id': self.source_id,
+                       'source water name': self.water_name,
+                       'source lat nad83': self.init_lat,
+                       'source lon nad83': self.init_lon,
+                       'source buffer meters': self.buffer_m,
+                       'hydrolink message': self.message}
+        if writer is not None:
+            writer.write(source_data)
+        else:
+            with output.CSVWriter(outfile_name, output.FIELD_NAMES[self.nhd_version], batch_size=1) as writer:
+                writer.write(source_data)
+
+
+def coordinate(value):
+    """Return coordinate as float, None when not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_point(row, nhd_version='nhdhr', buffer_m=1000, session=None, cache=None, backend=None, combine_nonnetwork=False, distance_mode='albers',
+                flowline_cache=None):
+    """Create HydroLink object for one row of input data.
+
+    Parameters
+    ----------
+    row: namedtuple
+        Row of input data with attributes id, lat, lon, crs and stream, see hydrolinker.handle_data
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+    buffer_m: int
+        Distance in meters. Used as buffer to search for canidate NHD features
+    session: requests.Session, optional
+        Session used for service calls
+    cache: cache.ResponseCache, optional
+        Cache of service responses
+    backend: backends.QueryBackend, optional
+        Answers queries instead of NHD services, e.g. local.LocalNHD
+    combine_nonnetwork: bool, default False
+        NHDPlusV2 only, query network and nonnetwork flowlines concurrently, see nhd_mr.MedResPoint
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances, see utils.distances_meters
+    flowline_cache: cache.FlowlineCache, optional
+        Holds flowlines shared across points as compact arrays, see nhd_hr.HighResPoint
+
+    Returns
+    ----------
+    hydrolink: nhd_hr.HighResPoint or nhd_mr.MedResPoint
+
+    """
+    kwargs = {}
+    if nhd_version == 'nhdhr':
+        point_class = nhd_hr.HighResPoint
+    elif nhd_version == 'nhdplusv2':
+        point_class = nhd_mr.MedResPoint
+        kwargs['combine_nonnetwork'] = combine_nonnetwork
+    else:
+        raise ValueError(f'nhd_version {nhd_version} not supported, options include nhdhr and nhdplusv2')
+
+    # coordinates and crs are checked by the HydroLink classes
+    hydrolink = point_class(row.id, row.lat, row.lon, input_crs=row.crs, water_name=str(row.stream),
+                            buffer_m=buffer_m, session=session, cache=cache, backend=backend, distance_mode=distance_mode,
+                            flowline_cache=flowline_cache, **kwargs)
+    return hydrolink
+
+
+def hydrolink_row(row, nhd_version='nhdhr', method='name_match', hydro_type='flowline', buffer_m=1000, similarity_cutoff=0.6, session=None, cache=None,
+                  backend=None, combine_nonnetwork=False, distance_mode='albers', flowline_cache=None):
+    """HydroLink one row of input data without writing output.
+
+    Returns
+    ----------
+    hydrolink: nhd_hr.HighResPoint or nhd_mr.MedResPoint
+        HydroLinked object, use write_hydrolink to write output. Failures are recorded in
+        hydrolink.status and hydrolink.message.
+
+    """
+    hydrolink = build_point(row, nhd_version=nhd_version, buffer_m=buffer_m, session=session, cache=cache, backend=backend,
+                            combine_nonnetwork=combine_nonnetwork, distance_mode=distance_mode, flowline_cache=flowline_cache)
+    hydrolink.hydrolink_method(method=method, hydro_type=hydro_type, outfile_name=None, similarity_cutoff=similarity_cutoff)
+    return hydrolink
+
+
+def evaluate_flowlines(hydrolink, method='name_match', similarity_cutoff=0.6):
+    """Evaluate flowlines already queried for a HydroLink object and select the HydroLink flowline.
+
+    Follows the last steps of hydrolink_method, used when flowlines are queried outside of hydrolink_method.
+    """
+    hydrolink.hydrolink_flowlines()
+    if method == 'name_match':
+        hydrolink.select_closest_flowline_w_name_match(similarity_cutoff=similarity_cutoff)
+    elif method == 'closest':
+        hydrolink.select_closest_flowline()
+    return hydrolink
+
+
+def select_hydrolinks(hydrolinks, nhd_version='nhdhr', method='name_match', similarity_cutoff=0.6):
+    """Select the HydroLink flowline of many HydroLink objects together after hydrolink_flowlines.
+
+    Candidates of all objects are selected in one table (selection.select_many), with the same
+    results as the select methods of each object.  Objects that failed (status 0) are skipped.
+    """
+    active = [h for h in hydrolinks if h.status == 1]
+    selections = hl_selection.select_many([h.flowlines_data for h in active], nhd_version=nhd_version, method=method,
+                                          similarity_cutoff=similarity_cutoff)
+    for hydrolink, selection in zip(active, selections):
+        hydrolink.set_selection(selection, method=method)
+    return hydrolinks
+
+
+def ordered_map(func, items, workers=1, max_pending=None):
+    """Apply func to each item using a pool of threads, yielding results in input order.
+
+    Only max_pending items are submitted ahead of the result being yielded so memory
+    stays flat for large inputs.
+
+    Parameters
+    ----------
+    func: callable
+        Function applied to each item
+    items: iterable
+        Items passed to func
+    workers: int, default 1
+        Number of worker threads. With 1 worker items are processed in the calling thread.
+    max_pending: int, optional
+        Maximum number of submitted items not yet yielded, default is 4 times workers
+
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    if max_pending is None:
+        max_pending = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def session_for_workers(workers=1):
+    """Return the shared session, or when workers exceeds the default pool size a session with one pooled connection per worker."""
+    if workers <= 10:
+        return hl_session.get_session()
+    host_config = {host: dict(config, pool_maxsize=max(config.get('pool_maxsize', 0), workers))
+                   for host, config in hl_session.HOST_CONFIG.items()}
+    return hl_session.build_session(pool_maxsize=workers, host_config=host_config)
+
+
+def hydrolink_rows(rows, nhd_version='nhdhr', method='name_match', hydro_type='flowline', buffer_m=1000, similarity_cutoff=0.6, workers=1, session=None,
+                   cache=None, backend=None, combine_nonnetwork=False, distance_mode='albers', flowline_cache=None):
+    """HydroLink rows of input data concurrently.
+
+    Parameters
+    ----------
+    rows: iterable
+        Rows of input data with attributes id, lat, lon, crs and stream (e.g. pandas.DataFrame.itertuples())
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+    method: {'name_match', 'closest'}, default 'name_match'
+        Method for HydroLinking data, see nhd_hr.HighResPoint.hydrolink_method
+    hydro_type: {'waterbody', 'flowline'}, default 'flowline'
+        Type of features to HydroLink, see nhd_hr.HighResPoint.hydrolink_method
+    buffer_m: int
+        Distance in meters. Used as buffer to search for canidate NHD features
+    similarity_cutoff: float
+        Values between 0.6 and 1.0, see nhd_hr.HighResPoint.hydrolink_method
+    workers: int, default 1
+        Number of points HydroLinked at the same time
+    session: requests.Session, optional
+        Session used for service calls. Default uses the shared session, or when workers exceeds
+        the default pool size a session with one pooled connection per worker.
+    cache: cache.ResponseCache, optional
+        Cache of service responses shared by all points
+    backend: backends.QueryBackend, optional
+        Answers queries instead of NHD services, e.g. local.LocalNHD
+    combine_nonnetwork: bool, default False
+        NHDPlusV2 only, query network and nonnetwork flowlines concurrently, see nhd_mr.MedResPoint
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances, see utils.distances_meters
+    flowline_cache: cache.FlowlineCache, optional
+        Holds flowlines shared by all points as compact arrays, see nhd_hr.HighResPoint
+
+    Returns
+    ----------
+    generator of HydroLinked objects in the same order as rows
+
+    """
+    if method not in ['name_match', 'closest'] or hydro_type not in ['waterbody', 'flowline']:
+        raise ValueError(f'method {method} or hydro_type {hydro_type} not supported')
+
+    if session is None:
+        session = session_for_workers(workers)
+
+    def hydrolink_one(row):
+        return hydrolink_row(row, nhd_version=nhd_version, method=method, hydro_type=hydro_type, buffer_m=buffer_m,
+                             similarity_cutoff=similarity_cutoff, session=session, cache=cache, backend=backend,
+                             combine_nonnetwork=combine_nonnetwork, distance_mode=distance_mode, flowline_cache=flowline_cache)
+
+    return ordered_map(hydrolink_one, rows, workers=workers)
+
+
+def buffer_envelope(lon, lat, buffer_m):
+    """Return envelope in degrees that contains a buffer around a NAD83 location.
+
+    Degrees are estimated from meters with a 10 percent margin, the envelope is used to
+    query candidate flowlines and is refined with measured distances in features_within_buffer.
+
+    Returns
+    ----------
+    envelope: tuple
+        (xmin, ymin, xmax, ymax)
+
+    """
+    dlat = buffer_m * 1.1 / 110574.0
+    dlon = buffer_m * 1.1 / (111320.0 * max(math.cos(math.radians(abs(lat) + dlat)), 0.01))
+    return lon - dlon, lat - dlat, lon + dlon, lat + dlat
+
+
+def plan_tiles(hydrolinks, tile_size_deg=0.05):
+    """Group HydroLink objects into square tiles.
+
+    Parameters
+    ----------
+    hydrolinks: list
+        HydroLink objects with NAD83 coordinates (init_lon, init_lat)
+    tile_size_deg: float, default 0.05
+        Width and height of tiles in degrees
+
+    Returns
+    ----------
+    tiles: list
+        Lists of HydroLink objects that fall in the same tile
+
+    """
+    tiles = {}
+    for hydrolink in hydrolinks:
+        key = (math.floor(hydrolink.init_lon / tile_size_deg), math.floor(hydrolink.init_lat / tile_size_deg))
+        tiles.setdefault(key, []).append(hydrolink)
+    return list(tiles.values())
+
+
+def tile_envelope(hydrolinks):
+    """Return envelope (xmin, ymin, xmax, ymax) containing the buffers of all HydroLink objects in a tile."""
+    envelopes = [buffer_envelope(h.init_lon, h.init_lat, h.buffer_m) for h in hydrolinks]
+    return (min(e[0] for e in envelopes), min(e[1] for e in envelopes),
+            max(e[2] for e in envelopes), max(e[3] for e in envelopes))
+
+
+def tile_lines(features):
+    """Return linestrings (NAD83) of the paths of flowline features and the index of the feature of each path.
+
+    Built once for the features of a tile and shared by its points, see features_within_buffer.
+    """
+    paths = [np.asarray(path, dtype=float)[:, :2] for feature in features for path in feature['geometry']['paths']]
+    feature_index = np.repeat(np.arange(len(features)), [len(feature['geometry']['paths']) for feature in features])
+    if len(paths) == 0:
+        return np.array([], dtype=object), feature_index
+    vertex_index = np.repeat(np.arange(len(paths)), [len(path) for path in paths])
+    lines = shapely.linestrings(np.concatenate(paths), indices=vertex_index)
+    shapely.prepare(lines)
+    return lines, feature_index
+
+
+def features_within_buffer(features, hydrolink, lines=None):
+    """Select flowline features within the buffer of a HydroLink object.
+
+    Returns the same flowlines a buffered point query (hem_flowline or network_flow) returns
+    for the object, from features queried for a larger area.  Paths are first filtered in degrees
+    with shapely.dwithin (a distance containing buffer_envelope), then distances in meters of the
+    remaining paths are measured in one vectorized call as in utils.build_flowlines_details.
+
+    Parameters
+    ----------
+    features: list
+        Flowline features from a flowline query (flowlines_json['features'])
+    hydrolink: nhd_hr.HighResPoint or nhd_mr.MedResPoint
+    lines: tuple, optional
+        Linestrings of features and the feature of each (see tile_lines), built from features when not given
+
+    Returns
+    ----------
+    selected_features: list
+
+    """
+    lines, feature_index = lines if lines is not None else tile_lines(features)
+    lon, lat = hydrolink.init_lon, hydrolink.init_lat
+    xmin, ymin, xmax, ymax = buffer_envelope(lon, lat, hydrolink.buffer_m)
+    point = shapely.points(lon, lat)
+    # skip distance measurement for paths clearly outside the buffer
+    near = np.flatnonzero(shapely.dwithin(lines, point, max(xmax - lon, ymax - lat)))
+    if len(near) == 0:
+        return []
+    snap_xy = shapely.get_coordinates(shapely.line_interpolate_point(lines[near], shapely.line_locate_point(lines[near], point)))
+    snap_distances = utils.distances_meters(snap_xy[:, 0], snap_xy[:, 1], np.full(len(near), lon), np.full(len(near), lat),
+                                            mode=hydrolink.distance_mode)
+    return [features[i] for i in np.unique(feature_index[near[snap_distances <= hydrolink.buffer_m]])]
+
+
+def prefetch_tile(hydrolinks, nhd_version='nhdhr'):
+    """Query flowlines for a tile of HydroLink objects with a single envelope query.
+
+    Each object is assigned the flowlines within its buffer (see set_flowlines).  If the envelope
+    query fails or the service does not return all features (exceededTransferLimit), objects are
+    queried individually using query_flowlines.  NHDPlusV2 objects without network flowlines
+    also use query_flowlines, which queries nonnetwork flowlines, unless nonnetwork flowlines are
+    combined (combine_nonnetwork) in which case they are requested for the tile with a second
+    envelope query made concurrently.
+
+    Parameters
+    ----------
+    hydrolinks: list
+        HydroLink objects in one tile, see plan_tiles
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+
+    """
+    module = nhd_hr if nhd_version == 'nhdhr' else nhd_mr
+    envelope = tile_envelope(hydrolinks)
+    combine = nhd_version == 'nhdplusv2' and hydrolinks[0].combines_nonnetwork()
+    try:
+        if combine:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                network = executor.submit(hydrolinks[0].request_json, nhd_mr.build_envelope_query(*envelope))
+                nonnetwork = executor.submit(hydrolinks[0].request_json, nhd_mr.build_envelope_query(*envelope, nonnetwork=True))
+                tile_json = nhd_mr.combine_flowlines(network.result(), nonnetwork.result())
+        else:
+            tile_json = hydrolinks[0].request_json(module.build_envelope_query(*envelope))
+    except Exception:
+        tile_json = {}
+
+    if 'features' not in tile_json or tile_json.get('exceededTransferLimit'):
+        for hydrolink in hydrolinks:
+            hydrolink.query_flowlines()
+        return
+
+    lines = tile_lines(tile_json['features'])
+    for hydrolink in hydrolinks:
+        features = features_within_buffer(tile_json['features'], hydrolink, lines=lines)
+        if nhd_version == 'nhdplusv2' and len(features) == 0 and not combine:
+            hydrolink.query_flowlines()
+        else:
+            hydrolink.set_flowlines({'features': features})
+
+
+def hydrolink_rows_tiled(rows, nhd_version='nhdhr', method='name_match', hydro_type='flowline', buffer_m=1000, similarity_cutoff=0.6, workers=1,
+                         session=None, cache=None, backend=None, combine_nonnetwork=False, distance_mode='albers', flowline_cache=None,
+                         tile_size_deg=0.05, chunk_size=1000):
+    """HydroLink rows of input data, querying flowlines once per spatial tile.
+
+    Rows are read in chunks.  Points in a chunk are grouped into tiles of tile_size_deg and flowlines
+    for each tile are requested with one envelope query against the same MapServer layer, where clause
+    and fields used for individual points.  Distance, confluence and name evaluations are then made for
+    each point against the flowlines within its buffer, and the flowlines of all points in a chunk are
+    selected together (see select_hydrolinks).  Points within a waterbody (hydro_type='waterbody')
+    query flowlines of the waterbody individually.  For clustered points this reduces requests from one
+    per point to one per tile.
+
+    Parameters
+    ----------
+    rows, nhd_version, method, hydro_type, buffer_m, similarity_cutoff, workers, session, cache, backend, combine_nonnetwork, distance_mode,
+    flowline_cache
+        See hydrolink_rows
+    tile_size_deg: float, default 0.05
+        Width and height of tiles in degrees. Larger tiles make fewer requests but are more likely
+        to exceed the number of features a service returns.
+    chunk_size: int, default 1000
+        Number of rows grouped into tiles at one time
+
+    Returns
+    ----------
+    generator of HydroLinked objects in the same order as rows
+
+    """
+    if method not in ['name_match', 'closest'] or hydro_type not in ['waterbody', 'flowline']:
+        raise ValueError(f'method {method} or hydro_type {hydro_type} not supported')
+    if session is None:
+        session = session_for_workers(workers)
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if len(chunk) == 0:
+            return
+        hydrolinks = [build_point(row, nhd_version=nhd_version, buffer_m=buffer_m, session=session, cache=cache, backend=backend,
+                                  combine_nonnetwork=combine_nonnetwork, distance_mode=distance_mode, flowline_cache=flowline_cache) for row in chunk]
+        active = [h for h in hydrolinks if h.status == 1]
+        for hydrolink in active:
+            hydrolink.build_nhd_query()
+
+        if hydro_type == 'waterbody':
+            list(ordered_map(lambda h: h.is_in_waterbody(), active, workers=workers))
+
+        tiled = [h for h in active if h.status == 1 and h.hydrolink_waterbody is None]
+        in_waterbody = [h for h in active if h.status == 1 and h.hydrolink_waterbody is not None]
+        list(ordered_map(lambda tile: prefetch_tile(tile, nhd_version=nhd_version), plan_tiles(tiled, tile_size_deg), workers=workers))
+        list(ordered_map(lambda h: h.query_flowlines(), in_waterbody, workers=workers))
+        list(ordered_map(lambda h: h.hydrolink_flowlines(), active, workers=workers))
+        select_hydrolinks(active, nhd_version=nhd_version, method=method, similarity_cutoff=similarity_cutoff)
+
+        for hydrolink in hydrolinks:
+            yield hydrolink
+
+
+def hydrolink_prepared_rows(df, tile_size_deg=0.0, nhd_version='nhdhr', buffer_m=1000, **kwargs):
+    """HydroLink rows of prepare_rows output, rows rejected by prepare_rows are not HydroLinked.
+
+    Rows within the United States are HydroLinked with hydrolink_rows, or with hydrolink_rows_tiled
+    when tile_size_deg is greater than 0.  Rejected rows (in_us_bounds False) yield a RejectedPoint
+    without building HydroLink objects or checking coordinates again.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Output of prepare_rows
+    tile_size_deg: float, default 0.0
+        Width and height of tiles in degrees, see hydrolink_rows_tiled. 0 queries each point.
+    nhd_version, buffer_m, kwargs
+        See hydrolink_rows
+
+    Returns
+    ----------
+    generator of HydroLinked objects and RejectedPoint objects in the same order as rows of df
+
+    """
+    accepted = df[df['in_us_bounds']].itertuples()
+    if tile_size_deg > 0:
+        hydrolinks = hydrolink_rows_tiled(accepted, nhd_version=nhd_version, buffer_m=buffer_m, tile_size_deg=tile_size_deg, **kwargs)
+    else:
+        hydrolinks = hydrolink_rows(accepted, nhd_version=nhd_version, buffer_m=buffer_m, **kwargs)
+    for row in df.itertuples():
+        if row.in_us_bounds:
+            yield next(hydrolinks)
+        else:
+            yield RejectedPoint(row, nhd_version=nhd_version, buffer_m=buffer_m)
@@ -0,0 +1,263 @@
+"""Persistent cache of NHD service responses.
+
+Queries built in build_nhd_query are determined by the coordinates, buffer and query type, so
+HydroLinking the same points again repeats the same requests.  ResponseCache stores JSON responses
+in a SQLite database keyed on the normalized query url.  Entries expire after a time to live, and
+the least recently used entries are removed when the cache grows beyond a maximum size.
+
+The cache is opt-in.  Pass a ResponseCache to nhd_hr.HighResPoint or nhd_mr.MedResPoint (cache=...)
+or use the --cache option of the hydrolinker command line tool.
+
+FlowlineCache holds flowlines in memory, once per permanent identifier (NHDHR) or COMID (NHDPlusV2),
+with vertices as contiguous float arrays rather than the nested lists of service responses.  HydroLink
+objects given a FlowlineCache (flowline_cache=...) keep these shared flowlines in place of the features
+of each response, and the least recently used flowlines are removed when the cache grows beyond a
+maximum size.
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import collections
+import json
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from hydrolink import utils
+
+############################################################################################
+############################################################################################
+
+
+def normalize_url(url):
+    """Normalize query url so equivalent requests share a cache key.
+
+    Scheme and host are lower cased and query parameters are sorted.
+
+    Parameters
+    ----------
+    url: str
+        Query url, e.g. built in nhd_hr.HighResPoint.build_nhd_query
+
+    Returns
+    ----------
+    normalized_url: str
+
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+class ResponseCache:
+    """SQLite backed cache of JSON responses from NHD services."""
+
+    def __init__(self, path='hydrolink_cache.sqlite', ttl_seconds=604800, max_bytes=1073741824):
+        """Open or create cache.
+
+        Parameters
+        ----------
+        path: str, default 'hydrolink_cache.sqlite'
+            Name and directory of SQLite database file. Use ':memory:' for a cache that is not kept on disk.
+        ttl_seconds: float or None, default 604800 (7 days)
+            Time to live of cached responses. None keeps responses until removed by size.
+        max_bytes: int or None, default 1073741824 (1 GB)
+            Maximum size of stored (compressed) responses. When exceeded the least recently used
+            responses are removed. None does not limit size.
+
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # connection is shared across worker threads, access is serialized with self._lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, accessed REAL, size INTEGER, body BLOB)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._connection.commit()
+        self.total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url):
+        """Return cached JSON for url, or None if not cached or expired."""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT created, size, body FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[0] > self.ttl_seconds:
+                self._delete(key, row[1])
+                self._connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self._connection.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[2]).decode('utf-8'))
+
+    def set(self, url, data):
+        """Store JSON for url. Error responses from services are not stored.
+
+        Parameters
+        ----------
+        url: str
+            Query url
+        data: dictionary
+            JSON returned from request of url
+
+        """
+        if not isinstance(data, dict) or 'error' in data:
+            return
+        key = normalize_url(url)
+        body = zlib.compress(json.dumps(data).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._delete(key, row[0])
+            self._connection.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?)', (key, now, now, len(body), body))
+            self.total_bytes += len(body)
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def _delete(self, key, size):
+        """Delete entry, caller holds lock and commits."""
+        self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self.total_bytes -= size
+
+    def _evict(self):
+        """Delete least recently used entries until cache is within max_bytes, caller holds lock and commits."""
+        rows = self._connection.execute('SELECT key, size FROM responses ORDER BY accessed')
+        for key, size in rows.fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._delete(key, size)
+            self.evictions += 1
+
+    def purge_expired(self):
+        """Delete all entries older than ttl_seconds."""
+        if self.ttl_seconds is None:
+            return
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            self._connection.execute('DELETE FROM responses WHERE created < ?', (cutoff,))
+            self._connection.commit()
+            self.total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def stats(self):
+        """Return dictionary of cache hits, misses, evictions and size."""
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self.total_bytes
+                }
+
+    def close(self):
+        """Close database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+# attributes identifying flowlines, NHDHR permanent identifier and NHDPlusV2 COMID
+FLOWLINE_ID_FIELDS = ['permanent_identifier', 'comid']
+
+
+def flowline_key(attributes):
+    """Return key of flowline attributes in FlowlineCache, None if the flowline has no identifier.
+
+    Keys include the names of attributes, so flowlines requested with different outFields are held separately.
+    """
+    for field, value in attributes.items():
+        if field.lower() in FLOWLINE_ID_FIELDS and value is not None:
+            return (tuple(attributes), value)
+    return None
+
+
+def flowline_bytes(flowline):
+    """Return approximate size in bytes of a utils.Flowline."""
+    return (flowline.vertices.nbytes + sys.getsizeof(flowline.attributes)
+            + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in flowline.attributes.items()))
+
+
+class FlowlineCache:
+    """In memory least recently used cache of flowlines held as utils.Flowline."""
+
+    def __init__(self, max_bytes=268435456):
+        """Initiate cache.
+
+        Parameters
+        ----------
+        max_bytes: int or None, default 268435456 (256 MB)
+            Maximum size of cached flowlines. When exceeded the least recently used flowlines
+            are removed. None does not limit size.
+
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._flowlines = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached utils.Flowline for key, or None if not cached."""
+        with self._lock:
+            entry = self._flowlines.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._flowlines.move_to_end(key)
+            self.hits += 1
+        return entry[0]
+
+    def set(self, key, flowline):
+        """Store utils.Flowline for key."""
+        size = flowline_bytes(flowline)
+        with self._lock:
+            if key in self._flowlines:
+                self.total_bytes -= self._flowlines.pop(key)[1]
+            self._flowlines[key] = (flowline, size)
+            self.total_bytes += size
+            while self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._flowlines) > 1:
+                self.total_bytes -= self._flowlines.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def flowline(self, feature):
+        """Return utils.Flowline of JSON flowline feature, from the cache when held and otherwise stored in the cache."""
+        key = flowline_key(feature['attributes'])
+        if key is None:
+            return utils.flowline_from_feature(feature)
+        flowline = self.get(key)
+        if flowline is None:
+            flowline = utils.flowline_from_feature(feature)
+            self.set(key, flowline)
+        return flowline
+
+    def flowlines(self, features):
+        """Return list of utils.Flowline of JSON flowline features, see flowline."""
+        return [self.flowline(feature) for feature in features]
+
+    def stats(self):
+        """Return dictionary of cache hits, misses, evictions and size."""
+        with self._lock:
+            entries = len(self._flowlines)
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'bytes': self.total_bytes
+                }
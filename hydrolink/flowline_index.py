@@ -0,0 +1,253 @@
+"""In-memory spatial index of flowlines fetched from NHD services, shared across points.
+
+Flowline queries request flowlines within a buffer of each point.  Points of a batch are often
+close together (e.g. stations along a river) so buffers overlap and the same flowlines are
+requested again and again.  FlowlineIndex is a backend that keeps every flowline returned by
+buffered point queries, once per permanent identifier (NHDHR) or COMID (NHDPlusV2) with
+coordinates and M values held as float arrays, along with the extents (buffers) already fetched.
+A query whose buffer is fully covered by fetched extents is answered from the index without a
+service call.  Other queries are passed to the wrapped backend.
+
+Buffers are measured in CONUS Albers (crs 5070), as in local.LocalNHD.  Fetched extents are held
+as polygons inscribed in each buffer and queries are tested with polygons circumscribing their
+buffer, so a query is only answered from the index when it is covered.
+
+Extents and flowlines are held in square cells (CELL_SIZE meters).  Each cell keeps the union of the
+extents touching it and the flowlines fetched with those extents, so adding a response only updates
+the cells it touches and a query only tests the flowlines of the cells its buffer touches.  Cells are
+removed least recently used first when the index holds more than max_flowlines flowlines.
+
+Example
+----------
+index = flowline_index.FlowlineIndex()
+hydrolinks = batch.hydrolink_rows(rows, workers=8, backend=index)
+print(index.stats())
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import collections
+import math
+import threading
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import shapely
+from hydrolink import backends
+from hydrolink import utils
+
+############################################################################################
+############################################################################################
+
+# attributes identifying flowlines, NHDHR permanent identifier and NHDPlusV2 COMID
+ID_FIELDS = ['permanent_identifier', 'comid']
+
+# segments per quarter circle of buffer polygons
+QUAD_SEGS = 16
+
+# width and height of cells in meters (CONUS Albers), several times the largest buffer (2000 meters)
+CELL_SIZE = 20000.0
+
+
+def parse_buffer_query(url):
+    """Parse buffered point query built in build_nhd_query.
+
+    Parameters
+    ----------
+    url: str
+        Query url
+
+    Returns
+    ----------
+    parsed: tuple or None
+        (layer key, lon, lat, distance in meters), None if url is not a buffered point query.  The layer
+        key is the url path and query parameters other than geometry and distance.
+
+    """
+    parts = urlsplit(url)
+    params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    if (params.get('geometryType') != 'esriGeometryPoint' or 'spatialRel' in params or 'distance' not in params
+            or params.get('units') != 'esriSRUnit_Meter' or params.get('inSR') != '4269'):
+        return None
+    try:
+        lon, lat = (float(c) for c in params.pop('geometry').split(','))
+        distance = float(params.pop('distance'))
+    except (KeyError, ValueError):
+        return None
+    return (parts.path, tuple(sorted(params.items()))), lon, lat, distance
+
+
+def feature_id(attributes):
+    """Return permanent identifier or COMID of flowline attributes, None if neither is included."""
+    for field, value in attributes.items():
+        if field.lower() in ID_FIELDS and value is not None:
+            return value
+    return None
+
+
+class FlowlineIndex(backends.QueryBackend):
+    """Answers buffered flowline queries from flowlines already fetched, requesting others from a backend."""
+
+    def __init__(self, backend=None, session=None, max_flowlines=500000):
+        """Initiate index.
+
+        Parameters
+        ----------
+        backend: backends.QueryBackend, optional
+            Backend requested when a query is not covered by the index, default is backends.RestBackend using session.
+            backends.RestBackend is wrapped in backends.PagedBackend so only complete responses are indexed.
+        session: requests.Session, optional
+            Session used when backend is not supplied
+        max_flowlines: int or None, default 500000
+            Maximum number of flowlines held. When exceeded the least recently used cells are removed
+            with their extents and the flowlines no other cell holds. None does not limit size.
+
+        """
+        if backend is None:
+            backend = backends.RestBackend(session=session)
+        if isinstance(backend, backends.RestBackend):
+            backend = backends.PagedBackend(backend)
+        self.backend = backend
+        self.max_flowlines = max_flowlines
+        self.to_albers = utils.get_transformer('epsg:4269', 'epsg:5070')
+        self.layers = {}
+        self.cells = collections.OrderedDict()
+        self.flowline_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def request_json(self, url):
+        """Answer query url from the index when covered, otherwise request it and add the response to the index."""
+        results = self.lookup(url)
+        if results is None:
+            results = self.backend.request_json(url)
+            self.add(url, results)
+        return results
+
+    def buffer(self, lon, lat, distance, circumscribe=False):
+        """Return buffer of NAD83 coordinates in CONUS Albers as a polygon inscribed in (or circumscribing) the circle."""
+        if circumscribe:
+            distance = distance / math.cos(math.pi / (4 * QUAD_SEGS))
+        x, y = self.to_albers.transform(lon, lat)
+        return shapely.buffer(shapely.Point(x, y), distance, quad_segs=QUAD_SEGS)
+
+    @staticmethod
+    def cell_keys(geometry):
+        """Return keys (column, row) of cells the bounds of geometry touch."""
+        xmin, ymin, xmax, ymax = geometry.bounds
+        return [(i, j) for i in range(math.floor(xmin / CELL_SIZE), math.floor(xmax / CELL_SIZE) + 1)
+                for j in range(math.floor(ymin / CELL_SIZE), math.floor(ymax / CELL_SIZE) + 1)]
+
+    def lookup(self, url):
+        """Return response of query url built from the index, None if url is not covered by fetched extents."""
+        parsed = parse_buffer_query(url)
+        if parsed is None:
+            return None
+        key, lon, lat, distance = parsed
+        needed = self.buffer(lon, lat, distance, circumscribe=True)
+        center = shapely.Point(self.to_albers.transform(lon, lat))
+        with self._lock:
+            layer = self.layers.get(key)
+            cells = [self.cells.get((key, cell_key)) for cell_key in self.cell_keys(needed)]
+            if layer is None or any(cell is None for cell in cells) or not self.covers(cells, needed):
+                self.misses += 1
+                return None
+            # flowlines within distance of the point, in the order they were added
+            found = {}
+            for cell in cells:
+                self.cells.move_to_end(cell['key'])
+                ids, geometries = self.cell_arrays(layer, cell)
+                for i in np.flatnonzero(shapely.dwithin(geometries, center, distance)):
+                    found[ids[i]] = layer['flowlines'][ids[i]]
+            flowlines = sorted(found.values(), key=lambda flowline: flowline['order'])
+            features = [{'attributes': dict(flowline['attributes']), 'geometry': {'paths': [path.tolist() for path in flowline['paths']]}}
+                        for flowline in flowlines]
+            self.hits += 1
+            return dict(layer['template'], features=features)
+
+    @staticmethod
+    def covers(cells, needed):
+        """Check if the extents of cells cover polygon needed, testing the part of needed within each cell."""
+        if len(cells) == 1:
+            return cells[0]['coverage'].covers(needed)
+        for cell in cells:
+            i, j = cell['key'][1]
+            box = shapely.box(i * CELL_SIZE, j * CELL_SIZE, (i + 1) * CELL_SIZE, (j + 1) * CELL_SIZE)
+            part = shapely.intersection(needed, box)
+            if not part.is_empty and not cell['coverage'].covers(part):
+                return False
+        return True
+
+    @staticmethod
+    def cell_arrays(layer, cell):
+        """Return identifiers and geometries of the flowlines of cell, built when first needed after flowlines are added."""
+        if cell['arrays'] is None:
+            ids = list(cell['ids'])
+            cell['arrays'] = (ids, np.array([layer['flowlines'][i]['geometry'] for i in ids], dtype=object))
+        return cell['arrays']
+
+    def add(self, url, results):
+        """Add flowlines and extent of the response of query url to the index.
+
+        Responses of other queries, error responses, truncated responses and responses of features without
+        identifiers or geometry are not added.
+        """
+        parsed = parse_buffer_query(url)
+        if parsed is None or 'error' in results or backends.is_truncated(results) or 'features' not in results:
+            return
+        features = results['features']
+        ids = [feature_id(feature.get('attributes', {})) for feature in features]
+        if any(i is None for i in ids) or any('paths' not in feature.get('geometry', {}) for feature in features):
+            return
+
+        key, lon, lat, distance = parsed
+        extent = self.buffer(lon, lat, distance)
+        with self._lock:
+            layer = self.layers.setdefault(key, {'template': {k: v for k, v in results.items() if k not in ['features', 'exceededTransferLimit']},
+                                                 'flowlines': {}, 'added': 0})
+            for i, feature in zip(ids, features):
+                if i in layer['flowlines']:
+                    continue
+                paths = [np.asarray(path, dtype=float) for path in feature['geometry']['paths']]
+                lines = [shapely.LineString(np.column_stack(self.to_albers.transform(path[:, 0], path[:, 1]))) for path in paths if len(path) > 1]
+                layer['flowlines'][i] = {'attributes': dict(feature['attributes']), 'paths': paths, 'geometry': shapely.MultiLineString(lines),
+                                         'order': layer['added'], 'cells': 0}
+                layer['added'] += 1
+                self.flowline_count += 1
+
+            for cell_key in self.cell_keys(extent):
+                cell = self.cells.get((key, cell_key))
+                if cell is None:
+                    cell = self.cells[(key, cell_key)] = {'key': (key, cell_key), 'coverage': extent, 'ids': set(), 'arrays': None}
+                else:
+                    cell['coverage'] = shapely.union(cell['coverage'], extent)
+                    self.cells.move_to_end((key, cell_key))
+                shapely.prepare(cell['coverage'])
+                for i in ids:
+                    if i not in cell['ids']:
+                        cell['ids'].add(i)
+                        layer['flowlines'][i]['cells'] += 1
+                        cell['arrays'] = None
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used cells until the index holds max_flowlines flowlines, called holding the lock."""
+        while self.max_flowlines is not None and self.flowline_count > self.max_flowlines and len(self.cells) > 0:
+            (key, cell_key), cell = self.cells.popitem(last=False)
+            self.evictions += 1
+            flowlines = self.layers[key]['flowlines']
+            for i in cell['ids']:
+                flowlines[i]['cells'] -= 1
+                if flowlines[i]['cells'] == 0:
+                    del flowlines[i]
+                    self.flowline_count -= 1
+
+    def stats(self):
+        """Return dictionary of queries answered from the index (hits), queries requested (misses), flowlines held and cells removed."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'flowlines': self.flowline_count, 'evictions': self.evictions}
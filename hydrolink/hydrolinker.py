@@ -10,8 +10,14 @@ Contact: bserna@usgs.gov
 
 """
 import click
-from hydrolink import nhd_hr
-from hydrolink import nhd_mr
+from hydrolink import backends
+from hydrolink import batch
+from hydrolink import cache as hl_cache
+from hydrolink import flowline_index
+from hydrolink import local
+from hydrolink import output
+from hydrolink import throttle as hl_throttle
+from hydrolink import utils
 import geopandas as gpd
 import pandas as pd
 import warnings
@@ -29,7 +35,25 @@ warnings.simplefilter('ignore')
 @click.option('--method', required=True, show_default=True, default='name_match', help='Enter method to use, options include name_match and closest')
 @click.option('--nhd_version', required=True, show_default=True, default='nhdhr', help='Version of NHD to use, options include nhdhr and nhdplusv2')
 @click.option('--hydro_type', required=True, show_default=True, default='flowline', help='Options flowline or waterbody')
-def handle_data(input_file, latitude_field, longitude_field, stream_name_field, identifier_field, crs, buffer, method, nhd_version, hydro_type):
+@click.option('--workers', show_default=True, default=1, type=click.IntRange(min=1), help='Number of points to HydroLink concurrently, output is written in input order')
+@click.option('--cache', 'cache_file', default=None, help='Enter SQLite file name to cache service responses, e.g. hydrolink_cache.sqlite. Responses are not cached by default')
+@click.option('--cache_ttl', show_default=True, default=168.0, help='Hours cached responses are kept')
+@click.option('--cache_max_mb', show_default=True, default=1024.0, help='Maximum size of cache in megabytes, least recently used responses are removed first')
+@click.option('--tile_size', show_default=True, default=0.0, help='Enter tile size in degrees (e.g. 0.05) to query flowlines once per tile of nearby points, 0 queries each point')
+@click.option('--local_flowlines', default=None, help='Enter file name of local NHD flowlines with M values (e.g. GeoPackage) to HydroLink without NHD services')
+@click.option('--local_waterbodies', default=None, help='Enter file name of local NHD waterbodies, used with --local_flowlines and hydro_type waterbody')
+@click.option('--local_nonnetwork_flowlines', default=None, help='Enter file name of local NHDPlusV2 nonnetwork flowlines, used with --local_flowlines')
+@click.option('--combine_nonnetwork', is_flag=True, default=False, help='nhdplusv2 only, query network and nonnetwork flowlines concurrently and HydroLink to either. By default nonnetwork flowlines are used only when no network flowlines are found')
+@click.option('--distance_mode', show_default=True, default='albers', type=click.Choice(['albers', 'geodesic']), help='Measure distances in CONUS Albers or as geodesic distances, geodesic is recommended for points in Alaska, Hawaii or Puerto Rico')
+@click.option('--rate_limit', show_default=True, default=10.0, help='Maximum requests per second to each NHD service host, requests in flight adapt to service latency and errors. 0 disables limits and retries')
+@click.option('--service_url', default=None, help='Enter scheme and host (e.g. http://127.0.0.1:8000 for hydrolink.mock_server) to request instead of NHD services')
+@click.option('--name_matcher', show_default=True, default='difflib', type=click.Choice(['difflib', 'rapidfuzz']), help='Fuzzy matcher for water names, rapidfuzz is faster (requires rapidfuzz) but similarity ratios differ from difflib')
+@click.option('--flowline_cache_mb', show_default=True, default=256.0, help='Maximum size in MB of flowlines held in memory as compact arrays and shared across points, 0 keeps the flowlines of each response')
+@click.option('--output_format', show_default=True, default='csv', type=click.Choice(list(output.OUTPUT_FORMATS)), help='Format of output file, parquet and arrow write typed columns in record batches (requires pyarrow) and replace an existing output file')
+@click.option('--share_flowlines', is_flag=True, default=False, help='Keep flowlines fetched for each point in memory and answer flowline queries of nearby points without service calls')
+def handle_data(input_file, latitude_field, longitude_field, stream_name_field, identifier_field, crs, buffer, method, nhd_version, hydro_type, workers,
+                cache_file, cache_ttl, cache_max_mb, tile_size, local_flowlines, local_waterbodies, local_nonnetwork_flowlines,
+                combine_nonnetwork, distance_mode, rate_limit, service_url, name_matcher, flowline_cache_mb, output_format, share_flowlines):
     """Hydrolink point data to the nhd high resolution.
 
     HydroLinker accepts a CSV file of multiple points of interest, HydroLinks each to
@@ -71,16 +95,57 @@ def handle_data(input_file, latitude_field, longitude_field, stream_name_field,
                                 in_data['stream_name']: 'stream'
                                 })
         df['crs'] = int(crs)
+        # reproject and check coordinates of all rows at once, before HydroLinking
+        df = batch.prepare_rows(df)
+        click.echo(f"{int((~df['in_us_bounds']).sum())} of {len(df)} points are outside the United States or not valid and are not HydroLinked")
 
     else:
         click.echo('Verify field names and rerun')
 
-    for row in df.itertuples():
-        if nhd_version == 'nhdhr':
-            hydrolink = nhd_hr.HighResPoint(row.id, float(row.lat), float(row.lon), input_crs=int(row.crs), water_name=str(row.stream), buffer_m=buffer)
-        elif nhd_version == 'nhdplusv2':
-            hydrolink = nhd_mr.MedResPoint(row.id, float(row.lat), float(row.lon), input_crs=int(row.crs), water_name=str(row.stream), buffer_m=buffer)
-        hydrolink.hydrolink_method(method=method, hydro_type=hydro_type)
+    cache = None
+    if cache_file is not None:
+        cache = hl_cache.ResponseCache(cache_file, ttl_seconds=cache_ttl * 3600, max_bytes=int(cache_max_mb * 1048576))
+
+    if name_matcher == 'rapidfuzz':
+        utils.set_name_matcher(utils.RapidfuzzMatcher())
+    else:
+        utils.set_name_matcher(utils.DifflibMatcher())
+
+    flowline_cache = hl_cache.FlowlineCache(max_bytes=int(flowline_cache_mb * 1048576)) if flowline_cache_mb > 0 else None
+
+    backend = None
+    throttle = None
+    if local_flowlines is not None:
+        click.echo('reading local NHD data')
+        backend = local.LocalNHD(local_flowlines, waterbodies=local_waterbodies, nonnetwork_flowlines=local_nonnetwork_flowlines)
+    else:
+        # failed requests are retried and concurrency adapts to the services, so workers can be set high
+        throttle = hl_throttle.Throttle(host_limits={}, rate=rate_limit, max_concurrency=workers) if rate_limit > 0 else None
+        backend = backends.RestBackend(session=batch.session_for_workers(workers), base_url=service_url, throttle=throttle)
+        if share_flowlines:
+            backend = flowline_index.FlowlineIndex(backend)
+
+    # points are HydroLinked concurrently by workers but written in the order of the input file,
+    # rows rejected by prepare_rows are written without HydroLinking
+    hydrolinks = batch.hydrolink_prepared_rows(df, tile_size_deg=tile_size, nhd_version=nhd_version, method=method, hydro_type=hydro_type,
+                                               buffer_m=buffer, workers=workers, cache=cache, backend=backend, combine_nonnetwork=combine_nonnetwork,
+                                               distance_mode=distance_mode, flowline_cache=flowline_cache)
+    # output file is held open and rows are written in batches
+    output_file = f'{nhd_version}_hydrolink_output.{output_format}'
+    with output.open_writer(output_file, nhd_version=nhd_version, output_format=output_format) as writer:
+        for hydrolink in hydrolinks:
+            hydrolink.write_hydrolink(writer=writer)
+
+    if cache is not None:
+        click.echo(f'cache stats: {cache.stats()}')
+        cache.close()
+    if flowline_cache is not None:
+        click.echo(f'flowline cache stats: {flowline_cache.stats()}')
+    click.echo(f'name cache stats: {utils.name_cache_stats()}')
+    if isinstance(backend, flowline_index.FlowlineIndex):
+        click.echo(f'shared flowline stats: {backend.stats()}')
+    if throttle is not None:
+        click.echo(f'throttle stats: {throttle.stats()}')
 
         # in_file = in_data['file'][:-4]  #remove .csv or .shp
         # output_file = f'{in_file}_output.csv'
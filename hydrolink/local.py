@@ -0,0 +1,232 @@
+"""HydroLink using locally stored NHD data instead of NHD services.
+
+LocalNHD answers the flowline, waterbody and waterbody flowline queries built in build_nhd_query
+(and the envelope queries used in batch.hydrolink_rows_tiled) from NHDHR or NHDPlusV2 data stored
+on disk.  Queries are answered with spatial indexes and return features shaped like ArcGIS REST
+JSON, including M values (measures), so flowlines are evaluated exactly as service responses are.
+
+Data requirements
+----------
+Flowlines must include M values and all data must be in NAD83 (crs 4269), as distributed for
+NHDHR and NHDPlusV2.  GeoPackage layers are read directly so M values are kept.  Other formats
+(e.g. FlatGeobuf) are read with geopandas.read_file, which keeps M values only when the installed
+reader supports them; a GeoDataFrame with M geometries can also be supplied.  Field names are
+matched to the fields requested in queries without regard to case.
+
+Example
+----------
+local_nhd = local.LocalNHD('nhdhr_extract.gpkg', waterbodies='nhdhr_extract.gpkg',
+                           flowline_layer='NHDFlowline', waterbody_layer='NHDWaterbody')
+hydrolink = nhd_hr.HighResPoint(1, 42.7284, -84.5026, backend=local_nhd)
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import re
+import sqlite3
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from urllib.parse import urlsplit, parse_qs
+from hydrolink import backends
+from hydrolink import nhd_hr
+from hydrolink import nhd_mr
+from hydrolink import utils
+
+############################################################################################
+############################################################################################
+
+# GeoPackage binary header envelope sizes in bytes, indexed by envelope contents indicator
+GPKG_ENVELOPE_BYTES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+# where clauses built in build_nhd_query take the form FIELD IN (values) or FIELD NOT IN (values)
+WHERE_PATTERN = re.compile(r"^\s*(\w+)\s+(NOT\s+)?IN\s*\((.*)\)\s*$", re.IGNORECASE)
+
+
+def read_geopackage(path, layer=None):
+    """Read GeoPackage layer into GeoDataFrame keeping M values.
+
+    Parameters
+    ----------
+    path: str
+        Name and directory of GeoPackage
+    layer: str, optional
+        Name of layer, default is the first feature layer
+
+    Returns
+    ----------
+    gdf: geopandas.GeoDataFrame
+
+    """
+    with sqlite3.connect(path) as connection:
+        if layer is None:
+            layer = connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features'").fetchone()[0]
+        geometry_column, srs_id = connection.execute('SELECT column_name, srs_id FROM gpkg_geometry_columns WHERE table_name = ?', (layer,)).fetchone()
+        srs = connection.execute('SELECT organization, organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srs_id,)).fetchone()
+        cursor = connection.execute(f'SELECT * FROM "{layer}"')
+        columns = [c[0] for c in cursor.description]
+        rows = cursor.fetchall()
+
+    df = pd.DataFrame(rows, columns=columns)
+    wkbs = [None if blob is None else bytes(blob[8 + GPKG_ENVELOPE_BYTES[(blob[3] >> 1) & 7]:]) for blob in df.pop(geometry_column)]
+    crs = f'{srs[0]}:{srs[1]}' if srs is not None and srs[0] is not None else None
+    return gpd.GeoDataFrame(df, geometry=shapely.from_wkb(wkbs), crs=crs)
+
+
+def read_features(data, layer=None):
+    """Return GeoDataFrame from a GeoDataFrame or a file path, see read_geopackage."""
+    if data is None or isinstance(data, gpd.GeoDataFrame):
+        return data
+    if str(data).lower().endswith('.gpkg'):
+        return read_geopackage(data, layer=layer)
+    return gpd.read_file(data, layer=layer)
+
+
+def parse_where(where):
+    """Parse where clause built in build_nhd_query.
+
+    Returns
+    ----------
+    field: str
+    negate: bool
+        True for NOT IN
+    values: list
+        Values as strings, without quotes
+
+    """
+    match = WHERE_PATTERN.match(where)
+    if match is None:
+        raise ValueError(f'where clause not supported by LocalNHD: {where}')
+    values = [v.strip().strip("'\"") for v in match.group(3).split(',')]
+    return match.group(1), match.group(2) is not None, values
+
+
+class LocalNHD(backends.QueryBackend):
+    """Answers NHD service queries using locally stored NHD data."""
+
+    def __init__(self, flowlines, waterbodies=None, nonnetwork_flowlines=None, flowline_layer=None, waterbody_layer=None, nonnetwork_flowline_layer=None):
+        """Load local NHD data.
+
+        Parameters
+        ----------
+        flowlines: str or geopandas.GeoDataFrame
+            Flowlines (NHDHR NHDFlowline or NHDPlusV2 network flowlines) with M values
+        waterbodies: str or geopandas.GeoDataFrame, optional
+            Waterbody polygons, required for hydro_type='waterbody'
+        nonnetwork_flowlines: str or geopandas.GeoDataFrame, optional
+            NHDPlusV2 nonnetwork flowlines. If not provided nonnetwork queries return no flowlines.
+        flowline_layer, waterbody_layer, nonnetwork_flowline_layer: str, optional
+            Layer names when reading from files containing multiple layers
+
+        """
+        self.layers = {'flowline': self.prepare_layer(read_features(flowlines, flowline_layer), measures=True),
+                       'waterbody': self.prepare_layer(read_features(waterbodies, waterbody_layer)),
+                       'nonnetwork': self.prepare_layer(read_features(nonnetwork_flowlines, nonnetwork_flowline_layer), measures=True)
+                       }
+        self.to_albers = utils.get_transformer('epsg:4269', 'epsg:5070')
+        # MapServer layers are matched on url path so queries can also be sent through mock_server.MockArcGISServer
+        self.paths = {urlsplit(nhd_hr.HEM_FLOWLINE_URL).path: 'flowline',
+                      urlsplit(nhd_hr.HEM_WATERBODY_URL).path: 'waterbody',
+                      urlsplit(nhd_mr.NETWORK_FLOWLINE_URL).path: 'flowline',
+                      urlsplit(nhd_mr.NONNETWORK_FLOWLINE_URL).path: 'nonnetwork',
+                      urlsplit(nhd_mr.WATERBODY_URL).path: 'waterbody'
+                      }
+
+    def prepare_layer(self, gdf, measures=False):
+        """Validate layer and build spatial indexes (NAD83 and, for flowlines, CONUS Albers)."""
+        if gdf is None:
+            return None
+        if gdf.crs is not None and pyproj.CRS.from_user_input(gdf.crs).to_epsg() != 4269:
+            raise ValueError('LocalNHD data must be in NAD83 (crs 4269)')
+        gdf = gdf.reset_index(drop=True)
+        if measures and not shapely.has_m(gdf.geometry.values).all():
+            raise ValueError('LocalNHD flowlines must include M values (measures)')
+        layer = {'gdf': gdf,
+                 'columns': {c.lower(): c for c in gdf.columns},
+                 'tree': shapely.STRtree(gdf.geometry.values)
+                 }
+        if measures:
+            albers = gpd.GeoSeries(shapely.force_2d(gdf.geometry.values), crs='epsg:4269').to_crs('epsg:5070')
+            layer['albers_tree'] = shapely.STRtree(albers.values)
+        return layer
+
+    def request_json(self, url):
+        """Answer query url with features from local data.
+
+        Parameters
+        ----------
+        url: str
+            Query built in build_nhd_query or build_envelope_query
+
+        Returns
+        ----------
+        results: dictionary
+            JSON shaped like the ArcGIS REST response, {'features': [...]}
+
+        """
+        path = urlsplit(url).path
+        if path not in self.paths:
+            raise ValueError(f'query not supported by LocalNHD: {path}')
+        layer = self.layers[self.paths[path]]
+        if layer is None:
+            return {'features': []}
+
+        params = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+        gdf = layer['gdf']
+        index = self.spatial_filter(layer, params)
+        if 'where' in params:
+            field, negate, values = parse_where(params['where'])
+            column = gdf[layer['columns'][field.lower()]].iloc[index] if index is not None else gdf[layer['columns'][field.lower()]]
+            matches = column.astype(str).isin(values)
+            numeric = pd.to_numeric(column, errors='coerce')
+            numeric_values = pd.to_numeric(pd.Series(values), errors='coerce').dropna()
+            if len(numeric_values) > 0:
+                matches = matches | numeric.isin(numeric_values)
+            matches = ~matches if negate else matches
+            index = np.asarray(column.index[matches.values])
+        if index is None:
+            index = np.arange(len(gdf))
+
+        out_fields = params.get('outFields', '').split(',')
+        return_geometry = params.get('returnGeometry', 'true').lower() != 'false'
+        return_m = params.get('returnM', 'false').lower() == 'true'
+        features = [self.build_feature(layer, i, out_fields, return_geometry, return_m) for i in np.sort(index)]
+        return {'features': features}
+
+    def spatial_filter(self, layer, params):
+        """Return index of features meeting the spatial part of a query, None if query has no geometry."""
+        if 'geometry' not in params:
+            return None
+        coordinates = [float(c) for c in params['geometry'].split(',')]
+        if params.get('geometryType') == 'esriGeometryEnvelope':
+            return layer['tree'].query(shapely.box(*coordinates), predicate='intersects')
+        if params.get('spatialRel') == 'esriSpatialRelWithin':
+            return layer['tree'].query(shapely.Point(coordinates), predicate='within')
+        # buffered point query, distance in meters measured in CONUS Albers
+        x, y = self.to_albers.transform(coordinates[0], coordinates[1])
+        return layer['albers_tree'].query(shapely.Point(x, y), predicate='dwithin', distance=float(params.get('distance', 0)))
+
+    def build_feature(self, layer, i, out_fields, return_geometry, return_m):
+        """Build JSON feature (attributes and paths) for row i of layer."""
+        row = layer['gdf'].iloc[i]
+        attributes = {}
+        for field in out_fields:
+            column = layer['columns'].get(field.lower())
+            value = row[column] if column is not None else None
+            if value is not None and pd.isna(value):
+                value = None
+            elif isinstance(value, np.generic):
+                value = value.item()
+            attributes[field] = value
+        feature = {'attributes': attributes}
+        if return_geometry:
+            geometry = row.geometry
+            parts = geometry.geoms if hasattr(geometry, 'geoms') else [geometry]
+            feature['geometry'] = {'paths': [shapely.get_coordinates(part, include_m=return_m).tolist() for part in parts]}
+        return feature
@@ -0,0 +1,131 @@
+"""Local stand-in for the ArcGIS REST services used in HydroLink.
+
+MockArcGISServer answers HTTP GET requests for MapServer queries from a backends.QueryBackend,
+by default a backends.FixtureBackend of recorded responses (e.g. tests/flowlines_json.json),
+after a configurable latency.  Pointing a backends.RestBackend at the server (base_url) sends
+HydroLink queries through the full HTTP path (sessions, connection pools, worker threads)
+without requesting NHD services, so throughput can be benchmarked and load tested.
+
+Example
+----------
+python -m hydrolink.mock_server --responses tests/flowlines_json.json --latency 0.2 --port 8000
+python -m hydrolink.hydrolinker --input_file=file_name.csv --service_url=http://127.0.0.1:8000 --workers=8
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+from hydrolink import backends
+
+############################################################################################
+############################################################################################
+
+
+class MockArcGISHandler(BaseHTTPRequestHandler):
+    """Answers GET requests with JSON from the backend of the server."""
+
+    def do_GET(self):
+        """Answer query after the latency of the server."""
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        try:
+            results = self.server.backend.request_json(self.path)
+            status = 200
+        except Exception as e:
+            # ArcGIS services report errors in the JSON body
+            results = {'error': {'code': 400, 'message': str(e)}}
+            status = 400
+        body = json.dumps(results).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Do not log each request."""
+        return
+
+
+class MockArcGISServer:
+    """HTTP server answering MapServer queries from a backend, run in a background thread."""
+
+    def __init__(self, backend=None, latency=0.0, host='127.0.0.1', port=0):
+        """Initiate server.
+
+        Parameters
+        ----------
+        backend: backends.QueryBackend, optional
+            Answers queries, default is a backends.FixtureBackend returning no features
+        latency: float, default 0.0
+            Seconds each request waits before it is answered
+        host: str, default '127.0.0.1'
+        port: int, default 0
+            Port of server, 0 uses a free port
+
+        """
+        self.backend = backend if backend is not None else backends.FixtureBackend()
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """Scheme, host and port of server, used as base_url of backends.RestBackend."""
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        """Start server in a background thread."""
+        self.server = ThreadingHTTPServer((self.host, self.port), MockArcGISHandler)
+        self.server.daemon_threads = True
+        self.server.backend = self.backend
+        self.server.latency = self.latency
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop server."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@click.command()
+@click.option('--responses', default=None, help='Enter JSON file of a recorded response (e.g. tests/flowlines_json.json) returned for all queries')
+@click.option('--latency', show_default=True, default=0.0, help='Seconds each request waits before it is answered')
+@click.option('--host', show_default=True, default='127.0.0.1', help='Host of server')
+@click.option('--port', show_default=True, default=8000, help='Port of server')
+def main(responses, latency, host, port):
+    """Serve recorded responses in place of NHD services until interrupted."""
+    backend = backends.FixtureBackend.from_file(responses) if responses is not None else None
+    server = MockArcGISServer(backend=backend, latency=latency, host=host, port=port).start()
+    click.echo(f'serving at {server.url}, use --service_url={server.url} with hydrolinker')
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,19 +14,42 @@ Contact: dwieferich@usgs.gov
 """
 
 # Import packages
-import requests
-import csv
-import os.path
+from hydrolink import output
 from hydrolink import utils
+from hydrolink import session as hl_session
+from hydrolink import selection as hl_selection
+from hydrolink import backends
 from shapely.geometry import Point
 ############################################################################################
 ############################################################################################
 
+# HEM MapServer layer, where clause and fields used to query flowlines
+HEM_FLOWLINE_URL = 'https://hydromaintenance.nationalmap.gov/arcgis/rest/services/HEM/NHDHigh/MapServer/1/query?'
+HEM_FLOWLINE_WHERE = 'ftype%20NOT%20IN%20(420,428,566)'
+HEM_FLOWLINE_FIELDS = 'gnis_name,lengthkm,permanent_identifier,reachcode'
+HEM_WATERBODY_URL = 'https://hydromaintenance.nationalmap.gov/arcgis/rest/services/HEM/NHDHigh/MapServer/2/query?'
+
+
+def build_envelope_query(xmin, ymin, xmax, ymax):
+    """Build query returning hem_flowline features that intersect an envelope (NAD83 coordinates).
+
+    Uses the same MapServer layer, where clause and fields as the hem_flowline query in
+    HighResPoint.build_nhd_query so flowlines can be shared by many points, see batch.hydrolink_rows_tiled.
+
+    Returns
+    ----------
+    envelope_query: str
+
+    """
+    q = f"where={HEM_FLOWLINE_WHERE}&geometryType=esriGeometryEnvelope&spatialRel=esriSpatialRelIntersects&inSR=4269&geometry={xmin},{ymin},{xmax},{ymax}&outSR=4269&f=JSON&outFields={HEM_FLOWLINE_FIELDS}&returnM=True"
+    return f"{HEM_FLOWLINE_URL}{q}"
+
 
 class HighResPoint:
     """Class specific for HydroLinking point data to the NHDHR."""
 
-    def __init__(self, source_identifier, input_lat, input_lon, input_crs=4269, water_name=None, buffer_m=1000):
+    def __init__(self, source_identifier, input_lat, input_lon, input_crs=4269, water_name=None, buffer_m=1000, session=None, cache=None, backend=None,
+                 distance_mode='albers', flowline_cache=None):
         """Initiate attributes for HydroLinking point data to the NHDHR.
 
         During initiation of an object the buffer is verified to be less than 2000 meters.  Initiation
@@ -49,6 +72,19 @@ class HighResPoint:
         buffer_m: int
             Distance in meters. Used as buffer to search for canidate NHD features
             for HydroLinking
+        session: requests.Session, optional
+            Session used for service calls. Default uses the shared pooled session from session.get_session()
+        cache: cache.ResponseCache, optional
+            Cache of service responses, default None does not cache responses
+        backend: backends.QueryBackend, optional
+            Answers queries instead of NHD services, e.g. local.LocalNHD or backends.FixtureBackend (session is not used).
+            Default is backends.RestBackend using session.
+        distance_mode: {'albers', 'geodesic'}, default 'albers'
+            Method used to measure distances to flowlines and confluences, see utils.distances_meters.
+            'geodesic' is recommended for points outside the conterminous United States.
+        flowline_cache: cache.FlowlineCache, optional
+            Holds flowlines shared across points as compact arrays in place of the features of each
+            flowline response. Default keeps the features of the response.
 
         Notes
         ----------
@@ -76,13 +112,23 @@ class HighResPoint:
         self.flowline_query = None
         self.waterbody_query = None
         self.hydrolink_waterbody = None
+        self.session = session if session is not None else hl_session.get_session()
+        self.cache = cache
+        self.backend = backends.build_backend(session=self.session, cache=cache, backend=backend)
+        self.distance_mode = distance_mode
+        self.flowline_cache = flowline_cache
 
         # If buffer is greater than 2000 do not run and set error message
         if buffer_m > 2000:
             self.message = ('Maximum buffer is 2000 meters, reduce buffer.')
             self.error_handling()
 
-        # If buffer is less than or equal to 2000 then run
+        # If distance_mode is not supported do not run and set error message
+        elif distance_mode not in utils.DISTANCE_MODES:
+            self.message = f'distance_mode {distance_mode} not supported, options include albers and geodesic.'
+            self.error_handling()
+
+        # If buffer is less than or equal to 2000 and distance_mode is supported then run
         else:
             # Try converting to NAD83 (crs==4269) coordinate system if different coordinate system provided
             # If fails do not run and set error message
@@ -93,10 +139,12 @@ class HighResPoint:
 
                 if int(input_crs) != 4269:
                     self.init_lon, self.init_lat = utils.crs_to_nad83(self.input_point, input_crs)
+                    # distances are measured from the NAD83 location
+                    self.input_point = Point(self.init_lon, self.init_lat)
 
                 # Test to make sure coordinates are within U.S. including Puerto Rico and Virgian Islands.
-                # This is based on a general bounding box and intended to pick up common issues like missing values, 0 values and positive lon values
-                if (float(self.init_lat) > 17.5 and float(self.init_lat) < 71.5) and (float(self.init_lon) < -64.0 and float(self.init_lon) > -178.5):
+                # This is based on a general bounding box (utils.US_BOUNDS) and intended to pick up common issues like missing values, 0 values and positive lon values
+                if utils.in_us_bounds(self.init_lon, self.init_lat):
                     pass
                 else:
                     self.message = f'Coordinates for id: {self.source_id} are outside of the bounding box of the United States.'
@@ -106,7 +154,8 @@ class HighResPoint:
                 self.message = f'Issues handling provided coordinate system or coordinates for {self.source_id}. Consider using a common crs like 4269 (NAD83) or 4326 (WGS84).'
                 self.error_handling()
 
-    def hydrolink_method(self, method='name_match', hydro_type='flowline', outfile_name='nhdhr_hydrolink_output.csv', similarity_cutoff=0.6):
+    def hydrolink_method(self, method='name_match', hydro_type='flowline', outfile_name='nhdhr_hydrolink_output.csv', similarity_cutoff=0.6,
+                         writer=None):
         """Build HydroLinking pipeline based on specified method and hydro_type.
 
         Builds commonly used HydroLink pipelines for users.
@@ -132,10 +181,13 @@ class HighResPoint:
             Waterbody features represent water types such as lakes, ponds, estuaries, reservoirs,
             marshes, swamps.
 
-        outfile_name: str
+        outfile_name: str or None
             Name and directory of csv output file.  default is 'nhdhr_hydrolink_output.csv'.
+            If None, output is not written, allowing the caller to write results later (see write_hydrolink).
         similarity_cutoff: float
             Values between 0 and 1.0, range of similarity between 0 representing no match to 1.0 being perfect match.
+        writer: output.CSVWriter, output.ParquetWriter or output.ArrowWriter, optional
+            Writer holding the output file open, used instead of outfile_name when HydroLinking many points.
 
         """
         if hydro_type in ['waterbody', 'flowline'] and method in ['name_match', 'closest'] and 0.6 <= similarity_cutoff <= 1.0:
@@ -149,9 +201,8 @@ class HighResPoint:
                     self.select_closest_flowline_w_name_match(similarity_cutoff=similarity_cutoff)
                 elif method == 'closest':
                     self.select_closest_flowline()
-                self.write_hydrolink(outfile_name=outfile_name)
-            else:
-                self.write_hydrolink(outfile_name=outfile_name)
+            if writer is not None or outfile_name is not None:
+                self.write_hydrolink(outfile_name=outfile_name, writer=writer)
 
     def build_nhd_query(self, query=['hem_flowline', 'hem_waterbody']):
         """Build queries to return required data for HydroLink process.
@@ -183,20 +234,20 @@ class HighResPoint:
         """
         # hem flowlines within a buffer of coordinates
         if 'hem_flowline' in query:
-            q = f"where=ftype%20NOT%20IN%20(420,428,566)&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields=gnis_name,lengthkm,permanent_identifier,reachcode&returnM=True"
-            base_url = 'https://hydromaintenance.nationalmap.gov/arcgis/rest/services/HEM/NHDHigh/MapServer/1/query?'
+            q = f"where={HEM_FLOWLINE_WHERE}&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields={HEM_FLOWLINE_FIELDS}&returnM=True"
+            base_url = HEM_FLOWLINE_URL
             self.flowline_query = f"{base_url}{q}"
 
         # hem waterbody returns information about hem waterbodies that the point is within
         if 'hem_waterbody' in query:
             q = f"geometryType=esriGeometryPoint&spatialRel=esriSpatialRelWithin&inSR=4269&geometry={self.init_lon},{self.init_lat}&f=JSON&outFields=permanent_identifier,gnis_name,ftype,reachcode&returnGeometry=False"
-            base_url = 'https://hydromaintenance.nationalmap.gov/arcgis/rest/services/HEM/NHDHigh/MapServer/2/query?'
+            base_url = HEM_WATERBODY_URL
             self.waterbody_query = f"{base_url}{q}"
 
         # returns flowlines associated with a waterbody (e.g. reservoir, lake...)
         if 'hem_waterbody_flowline' in query:
-            q = f"where=WBAREA_PERMANENT_IDENTIFIER%20IN%20(%27{self.hydrolink_waterbody['nhdhr waterbody permanent identifier']}%27)&outSR=4269&f=JSON&outFields=gnis_name,lengthkm,permanent_identifier,reachcode&returnM=True"
-            base_url = 'https://hydromaintenance.nationalmap.gov/arcgis/rest/services/HEM/NHDHigh/MapServer/1/query?'
+            q = f"where=WBAREA_PERMANENT_IDENTIFIER%20IN%20(%27{self.hydrolink_waterbody['nhdhr waterbody permanent identifier']}%27)&outSR=4269&f=JSON&outFields={HEM_FLOWLINE_FIELDS}&returnM=True"
+            base_url = HEM_FLOWLINE_URL
             self.flowline_query = f"{base_url}{q}"
 
         # The National Map (including HighResPlus) are included for future reference, not currenlty supported
@@ -206,6 +257,10 @@ class HighResPoint:
         # if service == 'TNM_HRPlus':
         #    base_url = 'https://hydro.nationalmap.gov/arcgis/rest/services/NHDPlus_HR/MapServer/2/query?'
 
+    def request_json(self, query):
+        """Request query built in build_nhd_query from self.backend and return JSON."""
+        return self.backend.request_json(query)
+
     def is_in_waterbody(self):
         """Check to see if point location falls within waterbody feature.
 
@@ -229,24 +284,38 @@ class HighResPoint:
         # if status == 0 or if we do not have waterbody query set then skip to avoid wasted processing time
         if self.status == 1 and self.waterbody_query is not None:
             try:
-                results = requests.get(self.waterbody_query).json()
-                self.waterbody_json = results
-                if len(results['features']) > 0:
-                    self.hydrolink_waterbody = {'nhdhr waterbody permanent identifier': results['features'][0]['attributes']['permanent_identifier'],
-                                                'nhdhr waterbody gnis name': results['features'][0]['attributes']["gnis_name"],
-                                                'nhdhr waterbody reachcode': results['features'][0]['attributes']['reachcode']
-                                                }
-                    self.build_nhd_query(query=['hem_waterbody_flowline'])
-                    # add name match here?
+                self.set_waterbody(self.request_json(self.waterbody_query))
             except:
                 self.message = f'is_in_waterbody failed for: {self.source_id}. possibly service call issue'
                 self.error_handling()
 
+    def set_waterbody(self, results):
+        """Collect HydroLink data for the waterbody returned by waterbody_query.
+
+        Separated from is_in_waterbody so responses requested elsewhere (e.g. aio.hydrolink_many)
+        are handled the same way.
+
+        Parameters
+        ----------
+        results: dictionary
+            JSON returned from request of waterbody_query
+
+        """
+        self.waterbody_json = results
+        if len(results['features']) > 0:
+            self.hydrolink_waterbody = {'nhdhr waterbody permanent identifier': results['features'][0]['attributes']['permanent_identifier'],
+                                        'nhdhr waterbody gnis name': results['features'][0]['attributes']["gnis_name"],
+                                        'nhdhr waterbody reachcode': results['features'][0]['attributes']['reachcode']
+                                        }
+            self.build_nhd_query(query=['hem_waterbody_flowline'])
+            # add name match here?
+
     def query_flowlines(self):
         """Query flowlines using query built in build_nhd_query.
 
         Query flowlines using query built in build_nhd_query.  Handles failed requests and
-        instances where no flowlines are returned.
+        instances where no flowlines are returned.  Responses truncated by the service
+        (exceededTransferLimit) are completed by backends.PagedBackend.
 
         Parameters
         ----------
@@ -261,15 +330,29 @@ class HighResPoint:
         """
         if self.status == 1:  # if status == 0 we don't want to waste time processing
             try:
-                self.flowlines_json = requests.get(self.flowline_query).json()
-                if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) == 0:
-                    self.message = f'No flowlines selected in query_flowlines for id: {self.source_id}. Try increasing buffer.'
-                    self.error_handling()
+                self.set_flowlines(self.request_json(self.flowline_query))
 
             except:
                 self.message = f'query_flowlines failed for id: {self.source_id}. Request failed.'
                 self.error_handling()
 
+    def set_flowlines(self, flowlines_json):
+        """Store flowlines returned by flowline_query, setting an error message if none were returned.
+
+        Parameters
+        ----------
+        flowlines_json: dictionary
+            JSON returned from request of flowline_query.  JSON contains data about flowlines.
+            With self.flowline_cache features are replaced with utils.Flowline shared across points.
+
+        """
+        if self.flowline_cache is not None and 'features' in flowlines_json.keys():
+            flowlines_json = dict(flowlines_json, features=self.flowline_cache.flowlines(flowlines_json['features']))
+        self.flowlines_json = flowlines_json
+        if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) == 0:
+            self.message = f'No flowlines selected in query_flowlines for id: {self.source_id}. Try increasing buffer.'
+            self.error_handling()
+
     def hydrolink_flowlines(self):
         """Evaluate flowlines in self.flowlines_json to understand certainty for HydroLink selection.
 
@@ -299,14 +382,11 @@ class HighResPoint:
         if self.status == 1:
             if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) > 0:
                 try:
-                    flowlines_data = []
-                    all_flowline_terminal_node_points = []
-                    for flowline_data in self.flowlines_json['features']:
-                        flowline_attributes, terminal_node_points, flowline_geo = utils.build_flowline_details(flowline_data, self.input_point, 'nhdhr', self.water_name)
-                        flowlines_data.append(flowline_attributes)
-                        all_flowline_terminal_node_points = all_flowline_terminal_node_points + terminal_node_points
-
-                    self.closest_confluence_meters = utils.closest_confluence(all_flowline_terminal_node_points, self.input_point, flowline_geo)
+                    # all candidate flowlines are evaluated at once, see utils.build_flowlines_details
+                    flowlines_data, all_flowline_terminal_node_points, flowline_geo = utils.build_flowlines_details(
+                        self.flowlines_json['features'], self.input_point, 'nhdhr', self.water_name, distance_mode=self.distance_mode)
+                    self.closest_confluence_meters = utils.closest_confluence(all_flowline_terminal_node_points, self.input_point, flowline_geo,
+                                                                              distance_mode=self.distance_mode)
                     self.flowlines_data = flowlines_data
 
                 except:
@@ -325,22 +405,8 @@ class HighResPoint:
 
         """
         if self.status == 1:
-            df = utils.df_for_selection(self.flowlines_data)
-            df = df.rename(columns={"lengthkm": "nhdhr flowline length km",
-                                    "reachcode": "nhdhr flowline reachcode",
-                                    "gnis_name": "nhdhr flowline gnis name",
-                                    "permanent_identifier": "nhdhr flowline permanent identifier"
-                                    })
-            self.total_count_flowlines = df.shape[0]
-            self.name_match_in_buffer = df.loc[df['flowline name similarity'] >= similarity_cutoff].shape[0]
-
-            df = df.nsmallest(1, 'meters from flowline', keep='all')
-            if df.shape[0] > 1:
-                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}. Use name_match method.'
-                self.error_handling()
-
-            else:
-                self.hydrolink_flowline = ((df.to_dict('records'))[0])
+            selection = hl_selection.select_flowline(self.flowlines_data, 'nhdhr', method='closest', similarity_cutoff=similarity_cutoff)
+            self.set_selection(selection, method='closest')
 
     def select_closest_flowline_w_name_match(self, similarity_cutoff=0.6):
         """Select closest flowline with matching water name.
@@ -350,54 +416,51 @@ class HighResPoint:
         closest NHD feature. Requires output from hydrolink_flowlines.
         """
         if self.status == 1:
-            df = utils.df_for_selection(self.flowlines_data)
-            df = df.rename(columns={"lengthkm": "nhdhr flowline length km",
-                                    "reachcode": "nhdhr flowline reachcode",
-                                    "gnis_name": "nhdhr flowline gnis name",
-                                    "permanent_identifier": "nhdhr flowline permanent identifier"
-                                    })
-            self.total_count_flowlines = df.shape[0]
-            df_1 = df.loc[df['flowline name similarity'] == 1.0]
-            df_similarity = df.loc[df['flowline name similarity'] >= similarity_cutoff]
-            # only 1 flowline has extact matching name
-            if df_1.shape[0] == 1:
-                self.hydrolink_flowline = ((df.to_dict('records'))[0])
-            # more than 1 flowline has exact matching name, grab closest of matching name flowlines
-            elif df_1.shape[0] > 1:
-                df_1 = df_1.nsmallest(1, 'meters from flowline', keep='all')
-                if df_1.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df_1.to_dict('records'))[0])
-            # only one flowline has matching name meeting similarity cutoff
-            elif df_1.shape[0] == 0 and df_similarity.shape[0] == 1:
-                self.hydrolink_flowline = ((df_similarity.to_dict('records'))[0])
-            # select closest flowline meeting name match similarity cutoff
-            elif df_1.shape[0] == 0 and df_similarity.shape[0] > 1:
-                df_similarity = df_similarity.nsmallest(1, 'meters from flowline', keep='all')
-                if df_similarity.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df_similarity.to_dict('records'))[0])
-            # no flowlines with name match, select closest
+            selection = hl_selection.select_flowline(self.flowlines_data, 'nhdhr', method='name_match', similarity_cutoff=similarity_cutoff)
+            self.set_selection(selection, method='name_match')
+
+    def set_selection(self, selection, method='name_match'):
+        """Set the HydroLink flowline from a selection of flowlines_data made with method.
+
+        Used by the select methods and when flowlines of many points are selected together, see
+        selection.select_many.
+
+        Parameters
+        ----------
+        selection: selection.Selection
+            Selection of flowlines_data, see selection.select_flowline
+        method: {'name_match', 'closest'}, default 'name_match'
+            Method of the selection
+
+        """
+        self.total_count_flowlines = selection.total_count
+        if method == 'closest':
+            self.name_match_in_buffer = selection.name_match_count
+        if selection.tie:
+            if method == 'closest':
+                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}. Use name_match method.'
             else:
-                df = df.nsmallest(1, 'meters from flowline', keep='all')
-                if df.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df.to_dict('records'))[0])
+                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
+            self.error_handling()
+        else:
+            self.hydrolink_flowline = selection.flowline
 
     def error_handling(self):
         """Handle errors throughout HydroLink."""
         self.status = 0
         print(self.message)
 
-    def write_hydrolink(self, outfile_name='nhdhr_hydrolink_output.csv'):
-        """Write HydroLink data output to CSV."""
-        file_exists = os.path.isfile(outfile_name)
+    def write_hydrolink(self, outfile_name='nhdhr_hydrolink_output.csv', writer=None):
+        """Write HydroLink data output to CSV, or with writer to CSV, Parquet or Arrow (see output.open_writer).
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of csv output file, opened and closed to write this row
+        writer: output.CSVWriter, output.ParquetWriter or output.ArrowWriter, optional
+            Writer holding the output file open, used instead of outfile_name when HydroLinking many points
+
+        """
         if self.status == 1:
             source_data = {'source id': self.source_id,
                            'source water name': self.water_name,
@@ -417,20 +480,11 @@ class HighResPoint:
                            'source lon nad83': self.init_lon,
                            'source buffer meters': self.buffer_m,
                            'hydrolink message': self.message}
-        field_names = ['source id', 'source lat nad83', 'source lon nad83', 'source buffer meters',
-                       'closest conluence meters', 'closest flowline order', 'total count flowlines in buffer',
-                       'source water name', 'cleaned source water name', 'flowline name similarity',
-                       'flowline name similarity message', 'nhdhr flowline gnis name',
-                       'nhdhr flowline length km', 'nhdhr flowline permanent identifier',
-                       'nhdhr flowline reachcode', 'meters from flowline', 'nhdhr flowline measure',
-                       'nhdhr waterbody permanent identifier', 'nhdhr waterbody gnis name',
-                       'nhdhr waterbody reachcode', 'hydrolink message'
-                       ]
-        with open(outfile_name, 'a', newline='') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=field_names, delimiter=',')
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(source_data)
+        if writer is not None:
+            writer.write(source_data)
+        else:
+            with output.CSVWriter(outfile_name, output.FIELD_NAMES['nhdhr'], batch_size=1) as writer:
+                writer.write(source_data)
 
     # def write_flowline_options(self, outfile_name='hr_hydrolink_reach_output.csv'):
     #     """Write HydroLink data output to CSV."""
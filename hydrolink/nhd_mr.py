@@ -14,20 +14,68 @@ Contact: dwieferich@usgs.gov
 """
 
 # Import packages
-import requests
-import csv
-import os.path
+from concurrent.futures import ThreadPoolExecutor
+from hydrolink import output
 from hydrolink import utils
+from hydrolink import session as hl_session
+from hydrolink import selection as hl_selection
+from hydrolink import backends
 from shapely.geometry import Point
 
 ############################################################################################
 ############################################################################################
 
+# WatersGeo MapServer layers, where clause and fields used to query flowlines
+NETWORK_FLOWLINE_URL = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?'
+NONNETWORK_FLOWLINE_URL = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/3/query?'
+FLOWLINE_WHERE = 'FTYPE%20NOT%20IN%20(420,428,566)'
+NETWORK_FLOWLINE_FIELDS = 'GNIS_NAME,LENGTHKM,REACHCODE,COMID,TERMINALFLAG'
+NONNETWORK_FLOWLINE_FIELDS = 'GNIS_NAME,LENGTHKM,REACHCODE,COMID'
+WATERBODY_URL = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/4/query?'
+
+
+def build_envelope_query(xmin, ymin, xmax, ymax, nonnetwork=False):
+    """Build query returning network_flow features that intersect an envelope (NAD83 coordinates).
+
+    Uses the same MapServer layer, where clause and fields as the network_flow query in
+    MedResPoint.build_nhd_query so flowlines can be shared by many points, see batch.hydrolink_rows_tiled.
+    If nonnetwork is True uses those of the nonnetwork_flow query.
+
+    Returns
+    ----------
+    envelope_query: str
+
+    """
+    fields = NONNETWORK_FLOWLINE_FIELDS if nonnetwork else NETWORK_FLOWLINE_FIELDS
+    base_url = NONNETWORK_FLOWLINE_URL if nonnetwork else NETWORK_FLOWLINE_URL
+    q = f"where={FLOWLINE_WHERE}&geometryType=esriGeometryEnvelope&spatialRel=esriSpatialRelIntersects&inSR=4269&geometry={xmin},{ymin},{xmax},{ymax}&outSR=4269&f=JSON&outFields={fields}&returnM=True"
+    return f"{base_url}{q}"
+
+
+def combine_flowlines(network_json, nonnetwork_json):
+    """Combine responses of network and nonnetwork flowline queries.
+
+    Returns
+    ----------
+    flowlines_json: dictionary
+        network_json with features of both responses. If the network response has no features
+        (e.g. service error) it is returned so the failure is handled as before.  If only the
+        nonnetwork response has no features network_json is returned, so an error of the optional
+        nonnetwork query does not fail points with network flowlines.
+
+    """
+    if 'features' not in network_json.keys():
+        return network_json
+    if 'features' not in nonnetwork_json.keys():
+        return network_json
+    return dict(network_json, features=network_json['features'] + nonnetwork_json['features'])
+
 
 class MedResPoint:
     """Class specific for HydroLinking point data to the NHDPlusV2.1."""
 
-    def __init__(self, source_identifier, input_lat, input_lon, input_crs=4269, water_name=None, buffer_m=1000):
+    def __init__(self, source_identifier, input_lat, input_lon, input_crs=4269, water_name=None, buffer_m=1000, session=None, cache=None, backend=None,
+                 combine_nonnetwork=False, distance_mode='albers', flowline_cache=None):
         """Initiate attributes for HydroLinking point data to the NHDHR.
 
         During initiation of an object the buffer is verified to be less than 2000 meters.  Initiation
@@ -50,6 +98,22 @@ class MedResPoint:
         buffer_m: int
             Distance in meters. Used as buffer to search for canidate NHD features
             for HydroLinking
+        session: requests.Session, optional
+            Session used for service calls. Default uses the shared pooled session from session.get_session()
+        cache: cache.ResponseCache, optional
+            Cache of service responses, default None does not cache responses
+        backend: backends.QueryBackend, optional
+            Answers queries instead of NHD services, e.g. local.LocalNHD or backends.FixtureBackend (session is not used).
+            Default is backends.RestBackend using session.
+        distance_mode: {'albers', 'geodesic'}, default 'albers'
+            Method used to measure distances to flowlines and confluences, see utils.distances_meters.
+            'geodesic' is recommended for points outside the conterminous United States.
+        combine_nonnetwork: bool, default False
+            If True network and nonnetwork flowlines are queried concurrently and combined as candidates
+            for HydroLinking. Default queries nonnetwork flowlines only when no network flowlines are returned.
+        flowline_cache: cache.FlowlineCache, optional
+            Holds flowlines shared across points as compact arrays in place of the features of each
+            flowline response. Default keeps the features of the response.
 
         Notes
         ----------
@@ -77,13 +141,24 @@ class MedResPoint:
         self.flowline_query = None
         self.waterbody_query = None
         self.hydrolink_waterbody = None
+        self.combine_nonnetwork = combine_nonnetwork
+        self.session = session if session is not None else hl_session.get_session()
+        self.cache = cache
+        self.backend = backends.build_backend(session=self.session, cache=cache, backend=backend)
+        self.distance_mode = distance_mode
+        self.flowline_cache = flowline_cache
 
         # If buffer is greater than 2000 do not run and set error message
         if buffer_m > 2000:
             self.message = ('Maximum buffer is 2000 meters, reduce buffer.')
             self.error_handling()
 
-        # If buffer is less than or equal to 2000 then run
+        # If distance_mode is not supported do not run and set error message
+        elif distance_mode not in utils.DISTANCE_MODES:
+            self.message = f'distance_mode {distance_mode} not supported, options include albers and geodesic.'
+            self.error_handling()
+
+        # If buffer is less than or equal to 2000 and distance_mode is supported then run
         else:
             # Try converting to NAD83 (crs==4269) coordinate system if different coordinate system provided
             # If fails do not run and set error message
@@ -94,10 +169,12 @@ class MedResPoint:
 
                 if int(input_crs) != 4269:
                     self.init_lon, self.init_lat = utils.crs_to_nad83(self.input_point, input_crs)
+                    # distances are measured from the NAD83 location
+                    self.input_point = Point(self.init_lon, self.init_lat)
 
                 # Test to make sure coordinates are within U.S. including Puerto Rico and Virgian Islands.
-                # This is based on a general bounding box and intended to pick up common issues like missing values, 0 values and positive lon values
-                if (float(self.init_lat) > 17.5 and float(self.init_lat) < 71.5) and (float(self.init_lon) < -64.0 and float(self.init_lon) > -178.5):
+                # This is based on a general bounding box (utils.US_BOUNDS) and intended to pick up common issues like missing values, 0 values and positive lon values
+                if utils.in_us_bounds(self.init_lon, self.init_lat):
                     pass
                 else:
                     self.message = f'Coordinates for id: {self.source_id} are outside of the bounding box of the United States.'
@@ -107,7 +184,8 @@ class MedResPoint:
                 self.message = f'Issues handling provided coordinate system or coordinates for {self.source_id}. Consider using a common crs like 4269 (NAD83) or 4326 (WGS84).'
                 self.error_handling()
 
-    def hydrolink_method(self, method='name_match', hydro_type='flowline', outfile_name='nhdplusv2_hydrolink_output.csv', similarity_cutoff=0.6):
+    def hydrolink_method(self, method='name_match', hydro_type='flowline', outfile_name='nhdplusv2_hydrolink_output.csv', similarity_cutoff=0.6,
+                         writer=None):
         """Build HydroLinking pipeline based on specified method and hydro_type.
 
         Builds commonly used HydroLink pipelines for users.
@@ -133,10 +211,13 @@ class MedResPoint:
             Waterbody features represent water types such as lakes, ponds, estuaries, reservoirs,
             marshes, swamps.
 
-        outfile_name: str
+        outfile_name: str or None
             Name and directory of csv output file.  default is 'nhdplusv2_hydrolink_output.csv'.
+            If None, output is not written, allowing the caller to write results later (see write_hydrolink).
         similarity_cutoff: float
             Values between 0 and 1.0, range of similarity between 0 representing no match to 1.0 being perfect match.
+        writer: output.CSVWriter, output.ParquetWriter or output.ArrowWriter, optional
+            Writer holding the output file open, used instead of outfile_name when HydroLinking many points.
 
         """
         if hydro_type in ['waterbody', 'flowline'] and method in ['name_match', 'closest'] and 0.6 <= similarity_cutoff <= 1.0:
@@ -150,9 +231,8 @@ class MedResPoint:
                     self.select_closest_flowline_w_name_match(similarity_cutoff=similarity_cutoff)
                 elif method == 'closest':
                     self.select_closest_flowline()
-                self.write_hydrolink(outfile_name=outfile_name)
-            else:
-                self.write_hydrolink(outfile_name=outfile_name)
+            if writer is not None or outfile_name is not None:
+                self.write_hydrolink(outfile_name=outfile_name, writer=writer)
 
     def build_nhd_query(self, query=['network_flow', 'waterbody']):
         """Build queries to return required data for HydroLink process.
@@ -174,28 +254,32 @@ class MedResPoint:
 
         Note(s)
         ----------
-        Currently nonnetwork streams are only used if no streams are returned with network flowlines.
-        It would be best to query both network and nonnetwork and combine before hydrolinking but that
-        doubles the requests and would increase processing time and service loads...
+        By default nonnetwork streams are only used if no streams are returned with network flowlines.
+        With combine_nonnetwork both are queried concurrently and combined before hydrolinking, this
+        doubles the requests (and service loads) but not the time waiting on services.
 
         """
         if 'network_flow' in query:
-            q = f"where=FTYPE%20NOT%20IN%20(420,428,566)&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields=GNIS_NAME,LENGTHKM,REACHCODE,COMID,TERMINALFLAG&returnM=True"
-            base_url = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?'
+            q = f"where={FLOWLINE_WHERE}&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields={NETWORK_FLOWLINE_FIELDS}&returnM=True"
+            base_url = NETWORK_FLOWLINE_URL
             self.flowline_query = f"{base_url}{q}"
         if 'nonnetwork_flow' in query:
-            q = f"where=FTYPE%20NOT%20IN%20(420,428,566)&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields=GNIS_NAME,LENGTHKM,REACHCODE,COMID&returnM=True"
-            base_url = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/3/query?'
+            q = f"where={FLOWLINE_WHERE}&geometryType=esriGeometryPoint&inSR=4269&geometry={self.init_lon},{self.init_lat}&distance={self.buffer_m}&units=esriSRUnit_Meter&outSR=4269&f=JSON&outFields={NONNETWORK_FLOWLINE_FIELDS}&returnM=True"
+            base_url = NONNETWORK_FLOWLINE_URL
             self.nonnetwork_flowline_query = f"{base_url}{q}"
         if 'waterbody' in query:
             q = f"geometryType=esriGeometryPoint&spatialRel=esriSpatialRelWithin&inSR=4269&geometry={self.init_lon},{self.init_lat}&f=JSON&outFields=PERMANENT_IDENTIFIER,COMID,GNIS_NAME,FTYPE,REACHCODE&returnGeometry=False"
-            base_url = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/4/query?'
+            base_url = WATERBODY_URL
             self.waterbody_query = f"{base_url}{q}"
         if 'waterbody_flowline' in query:
-            q = f"where=WBAREA_PERMANENT_IDENTIFIER%20IN%20(%27{self.hydrolink_waterbody['nhdplusv2 waterbody permanent identifier']}%27)&outSR=4269&f=JSON&outFields=GNIS_NAME,LENGTHKM,REACHCODE,COMID,TERMINALFLAG&returnM=True"
-            base_url = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?'
+            q = f"where=WBAREA_PERMANENT_IDENTIFIER%20IN%20(%27{self.hydrolink_waterbody['nhdplusv2 waterbody permanent identifier']}%27)&outSR=4269&f=JSON&outFields={NETWORK_FLOWLINE_FIELDS}&returnM=True"
+            base_url = NETWORK_FLOWLINE_URL
             self.flowline_query = f"{base_url}{q}"
 
+    def request_json(self, query):
+        """Request query built in build_nhd_query from self.backend and return JSON."""
+        return self.backend.request_json(query)
+
     def is_in_waterbody(self):
         """Check to see if point location falls within waterbody feature.
 
@@ -219,26 +303,40 @@ class MedResPoint:
         # if status == 0 or if we do not have waterbody query set then skip to avoid wasted processing time
         if self.status == 1 and self.waterbody_query is not None:
             try:
-                results = requests.get(self.waterbody_query).json()
-                self.waterbody_json = results
-                if len(results['features']) > 0:
-                    self.hydrolink_waterbody = {'nhdplusv2 waterbody permanent identifier': results['features'][0]['attributes']['PERMANENT_IDENTIFIER'],
-                                                'nhdplusv2 waterbody gnis name': results['features'][0]['attributes']["GNIS_NAME"],
-                                                'nhdplusv2 waterbody reachcode': results['features'][0]['attributes']['REACHCODE'],
-                                                'nhdplusv2 waterbody ftype': results['features'][0]['attributes']['FTYPE'],
-                                                'nhdplusv2 waterbody comid': results['features'][0]['attributes']['COMID']
-                                                }
-                    self.build_nhd_query(query=['waterbody_flowline'])
-                    # add name match here?
+                self.set_waterbody(self.request_json(self.waterbody_query))
             except:
                 self.message = f'is_in_waterbody failed for: {self.source_id}. possibly service call issue'
                 self.error_handling()
 
+    def set_waterbody(self, results):
+        """Collect HydroLink data for the waterbody returned by waterbody_query.
+
+        Separated from is_in_waterbody so responses requested elsewhere (e.g. aio.hydrolink_many)
+        are handled the same way.
+
+        Parameters
+        ----------
+        results: dictionary
+            JSON returned from request of waterbody_query
+
+        """
+        self.waterbody_json = results
+        if len(results['features']) > 0:
+            self.hydrolink_waterbody = {'nhdplusv2 waterbody permanent identifier': results['features'][0]['attributes']['PERMANENT_IDENTIFIER'],
+                                        'nhdplusv2 waterbody gnis name': results['features'][0]['attributes']["GNIS_NAME"],
+                                        'nhdplusv2 waterbody reachcode': results['features'][0]['attributes']['REACHCODE'],
+                                        'nhdplusv2 waterbody ftype': results['features'][0]['attributes']['FTYPE'],
+                                        'nhdplusv2 waterbody comid': results['features'][0]['attributes']['COMID']
+                                        }
+            self.build_nhd_query(query=['waterbody_flowline'])
+            # add name match here?
+
     def query_flowlines(self):
         """Query flowlines using query built in build_nhd_query.
 
         Query flowlines using query built in build_nhd_query.  Handles failed requests and
-        instances where no flowlines are returned.
+        instances where no flowlines are returned.  Responses truncated by the service
+        (exceededTransferLimit) are completed by backends.PagedBackend.
 
         Parameters
         ----------
@@ -253,17 +351,54 @@ class MedResPoint:
         """
         if self.status == 1:  # if status == 0 we don't want to waste time processing
             try:
-                self.flowlines_json = requests.get(self.flowline_query).json()
-                if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) == 0:
+                if self.combines_nonnetwork():
                     self.build_nhd_query(query=['nonnetwork_flow'])
-                    self.flowlines_json = requests.get(self.nonnetwork_flowline_query).json()
-                    if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) == 0:
-                        self.message = f'No flowlines selected in query_flowlines for id: {self.source_id}. Try increasing buffer.'
-                        self.error_handling()
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        network = executor.submit(self.request_json, self.flowline_query)
+                        nonnetwork = executor.submit(self.request_json, self.nonnetwork_flowline_query)
+                        flowlines_json = combine_flowlines(network.result(), nonnetwork.result())
+                else:
+                    flowlines_json = self.request_json(self.flowline_query)
+                    if self.requires_nonnetwork_query(flowlines_json):
+                        self.build_nhd_query(query=['nonnetwork_flow'])
+                        flowlines_json = self.request_json(self.nonnetwork_flowline_query)
+                self.set_flowlines(flowlines_json)
             except:
                 self.message = f'query_flowlines failed for id: {self.source_id}. Request failed.'
                 self.error_handling()
 
+    def combines_nonnetwork(self):
+        """Check if network and nonnetwork flowlines are queried together, flowlines within a waterbody use the network only."""
+        return self.combine_nonnetwork and self.hydrolink_waterbody is None
+
+    def requires_nonnetwork_query(self, flowlines_json):
+        """Check if nonnetwork flowlines should be queried, true when network flowline query returned no flowlines.
+
+        Parameters
+        ----------
+        flowlines_json: dictionary
+            JSON returned from request of network flowline_query
+
+        """
+        return 'features' in flowlines_json.keys() and len(flowlines_json['features']) == 0
+
+    def set_flowlines(self, flowlines_json):
+        """Store flowlines returned by flowline_query, setting an error message if none were returned.
+
+        Parameters
+        ----------
+        flowlines_json: dictionary
+            JSON returned from request of flowline_query.  JSON contains data about flowlines.
+            With self.flowline_cache features are replaced with utils.Flowline shared across points.
+
+        """
+        if self.flowline_cache is not None and 'features' in flowlines_json.keys():
+            flowlines_json = dict(flowlines_json, features=self.flowline_cache.flowlines(flowlines_json['features']))
+        self.flowlines_json = flowlines_json
+        if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) == 0:
+            self.message = f'No flowlines selected in query_flowlines for id: {self.source_id}. Try increasing buffer.'
+            self.error_handling()
+
     def hydrolink_flowlines(self):
         """Evaluate flowlines in self.flowlines_json to understand certainty for HydroLink selection.
 
@@ -293,14 +428,11 @@ class MedResPoint:
         if self.status == 1:
             if 'features' in self.flowlines_json.keys() and len(self.flowlines_json['features']) > 0:
                 try:
-                    flowlines_data = []
-                    all_flowline_terminal_node_points = []
-                    for flowline_data in self.flowlines_json['features']:
-                        flowline_attributes, terminal_node_points, flowline_geo = utils.build_flowline_details(flowline_data, self.input_point, 'nhdplusv2', self.water_name)
-                        flowlines_data.append(flowline_attributes)
-                        all_flowline_terminal_node_points = all_flowline_terminal_node_points + terminal_node_points
-
-                    self.closest_confluence_meters = utils.closest_confluence(all_flowline_terminal_node_points, self.input_point, flowline_geo)
+                    # all candidate flowlines are evaluated at once, see utils.build_flowlines_details
+                    flowlines_data, all_flowline_terminal_node_points, flowline_geo = utils.build_flowlines_details(
+                        self.flowlines_json['features'], self.input_point, 'nhdplusv2', self.water_name, distance_mode=self.distance_mode)
+                    self.closest_confluence_meters = utils.closest_confluence(all_flowline_terminal_node_points, self.input_point, flowline_geo,
+                                                                              distance_mode=self.distance_mode)
                     self.flowlines_data = flowlines_data
 
                 except:
@@ -319,24 +451,8 @@ class MedResPoint:
 
         """
         if self.status == 1:
-            df = utils.df_for_selection(self.flowlines_data)
-            df = df.rename(columns={"lengthkm": "nhdplusv2 flowline length km",
-                                    "reachcode": "nhdplusv2 flowline reachcode",
-                                    "gnis_name": "nhdplusv2 flowline gnis name",
-                                    "comid": "nhdplusv2 comid",
-                                    "terminalflag": "nhdplusv2 terminal flag",
-                                    "permanent_identifier": "nhdplusv2 flowline permanent identifier"
-                                    })
-            self.total_count_flowlines = df.shape[0]
-            self.name_match_in_buffer = df.loc[df['flowline name similarity'] >= similarity_cutoff].shape[0]
-
-            df = df.nsmallest(1, 'meters from flowline', keep='all')
-            if df.shape[0] > 1:
-                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}. Use name_match method.'
-                self.error_handling()
-
-            else:
-                self.hydrolink_flowline = ((df.to_dict('records'))[0])
+            selection = hl_selection.select_flowline(self.flowlines_data, 'nhdplusv2', method='closest', similarity_cutoff=similarity_cutoff)
+            self.set_selection(selection, method='closest')
 
     def select_closest_flowline_w_name_match(self, similarity_cutoff=0.6):
         """Select closest flowline with matching water name.
@@ -346,56 +462,51 @@ class MedResPoint:
         closest NHD feature. Requires output from hydrolink_flowlines.
         """
         if self.status == 1:
-            df = utils.df_for_selection(self.flowlines_data)
-            df = df.rename(columns={"lengthkm": "nhdplusv2 flowline length km",
-                                    "reachcode": "nhdplusv2 flowline reachcode",
-                                    "gnis_name": "nhdplusv2 flowline gnis name",
-                                    "comid": "nhdplusv2 comid",
-                                    "terminalflag": "nhdplusv2 terminal flag",
-                                    "permanent_identifier": "nhdplusv2 flowline permanent identifier"
-                                    })
-            self.total_count_flowlines = df.shape[0]
-            df_1 = df.loc[df['flowline name similarity'] == 1.0]
-            df_similarity = df.loc[df['flowline name similarity'] >= similarity_cutoff]
-            # only 1 flowline has extact matching name
-            if df_1.shape[0] == 1:
-                self.hydrolink_flowline = ((df.to_dict('records'))[0])
-            # more than 1 flowline has exact matching name, grab closest of matching name flowlines
-            elif df_1.shape[0] > 1:
-                df_1 = df_1.nsmallest(1, 'meters from flowline', keep='all')
-                if df_1.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df_1.to_dict('records'))[0])
-            # only one flowline has matching name meeting similarity cutoff
-            elif df_1.shape[0] == 0 and df_similarity.shape[0] == 1:
-                self.hydrolink_flowline = ((df_similarity.to_dict('records'))[0])
-            # select closest flowline meeting name match similarity cutoff
-            elif df_1.shape[0] == 0 and df_similarity.shape[0] > 1:
-                df_similarity = df_similarity.nsmallest(1, 'meters from flowline', keep='all')
-                if df_similarity.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df_similarity.to_dict('records'))[0])
-            # no flowlines with name match, select closest
+            selection = hl_selection.select_flowline(self.flowlines_data, 'nhdplusv2', method='name_match', similarity_cutoff=similarity_cutoff)
+            self.set_selection(selection, method='name_match')
+
+    def set_selection(self, selection, method='name_match'):
+        """Set the HydroLink flowline from a selection of flowlines_data made with method.
+
+        Used by the select methods and when flowlines of many points are selected together, see
+        selection.select_many.
+
+        Parameters
+        ----------
+        selection: selection.Selection
+            Selection of flowlines_data, see selection.select_flowline
+        method: {'name_match', 'closest'}, default 'name_match'
+            Method of the selection
+
+        """
+        self.total_count_flowlines = selection.total_count
+        if method == 'closest':
+            self.name_match_in_buffer = selection.name_match_count
+        if selection.tie:
+            if method == 'closest':
+                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}. Use name_match method.'
             else:
-                df = df.nsmallest(1, 'meters from flowline', keep='all')
-                if df.shape[0] > 1:
-                    self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
-                    self.error_handling()
-                else:
-                    self.hydrolink_flowline = ((df.to_dict('records'))[0])
+                self.message = f'multiple flowlines with same snap distance for id: {self.source_id}.'
+            self.error_handling()
+        else:
+            self.hydrolink_flowline = selection.flowline
 
     def error_handling(self):
         """Handle errors throughout HydroLink."""
         self.status = 0
         print(self.message)
 
-    def write_hydrolink(self, outfile_name='nhdplusv2_hydrolink_output.csv'):
-        """Write HydroLink data output to CSV."""
-        file_exists = os.path.isfile(outfile_name)
+    def write_hydrolink(self, outfile_name='nhdplusv2_hydrolink_output.csv', writer=None):
+        """Write HydroLink data output to CSV, or with writer to CSV, Parquet or Arrow (see output.open_writer).
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of csv output file, opened and closed to write this row
+        writer: output.CSVWriter, output.ParquetWriter or output.ArrowWriter, optional
+            Writer holding the output file open, used instead of outfile_name when HydroLinking many points
+
+        """
         if self.status == 1:
             source_data = {'source id': self.source_id,
                            'source water name': self.water_name,
@@ -415,21 +526,11 @@ class MedResPoint:
                            'source lon nad83': self.init_lon,
                            'source buffer meters': self.buffer_m,
                            'hydrolink message': self.message}
-        field_names = ['source id', 'source lat nad83', 'source lon nad83', 'source buffer meters',
-                       'closest conluence meters', 'closest flowline order', 'total count flowlines in buffer',
-                       'source water name', 'cleaned source water name', 'flowline name similarity',
-                       'flowline name similarity message', 'nhdplusv2 flowline gnis name', 'nhdplusv2 comid',
-                       'nhdplusv2 flowline length km', 'nhdplusv2 flowline reachcode',
-                       'meters from flowline', 'nhdplusv2 flowline measure',
-                       'nhdplusv2 terminal flag', 'nhdplusv2 waterbody permanent identifier',
-                       'nhdplusv2 waterbody gnis name', 'nhdplusv2 waterbody reachcode',
-                       'nhdplusv2 waterbody ftype', 'nhdplusv2 waterbody comid', 'hydrolink message'
-                       ]
-        with open(outfile_name, 'a', newline='') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=field_names, delimiter=',')
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(source_data)
+        if writer is not None:
+            writer.write(source_data)
+        else:
+            with output.CSVWriter(outfile_name, output.FIELD_NAMES['nhdplusv2'], batch_size=1) as writer:
+                writer.write(source_data)
 
     # def get_hl_measure(self):
     #     '''
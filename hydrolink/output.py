@@ -0,0 +1,315 @@
+"""Writers of HydroLink output.
+
+HydroLinked objects write output with write_hydrolink.  Called alone, write_hydrolink opens the
+output file, writes one row and closes the file.  When many points are HydroLinked pass a writer
+(writer=...) instead, which holds the file open, buffers rows and writes them in batches.  Writers
+may be shared by worker threads.
+
+CSVWriter appends rows to a CSV file.  ParquetWriter and ArrowWriter write rows to a new Parquet
+or Arrow IPC file, with a typed schema for each version of NHD (see arrow_schema) and each batch
+written as a record batch (a row group of the Parquet file), so memory stays flat for large inputs.
+Parquet and Arrow output require pyarrow, which is not installed with HydroLink (pip install pyarrow).
+
+Example
+----------
+with output.open_writer('nhdhr_hydrolink_output.parquet', nhd_version='nhdhr', output_format='parquet') as writer:
+    for hydrolink in batch.hydrolink_rows(rows, workers=8):
+        hydrolink.write_hydrolink(writer=writer)
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import csv
+import math
+import threading
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+############################################################################################
+############################################################################################
+
+# fields of HydroLink output for each version of NHD, in the order written
+FIELD_NAMES = {'nhdhr': ['source id', 'source lat nad83', 'source lon nad83', 'source buffer meters',
+                         'closest conluence meters', 'closest flowline order', 'total count flowlines in buffer',
+                         'source water name', 'cleaned source water name', 'flowline name similarity',
+                         'flowline name similarity message', 'nhdhr flowline gnis name',
+                         'nhdhr flowline length km', 'nhdhr flowline permanent identifier',
+                         'nhdhr flowline reachcode', 'meters from flowline', 'nhdhr flowline measure',
+                         'nhdhr waterbody permanent identifier', 'nhdhr waterbody gnis name',
+                         'nhdhr waterbody reachcode', 'hydrolink message'
+                         ],
+               'nhdplusv2': ['source id', 'source lat nad83', 'source lon nad83', 'source buffer meters',
+                             'closest conluence meters', 'closest flowline order', 'total count flowlines in buffer',
+                             'source water name', 'cleaned source water name', 'flowline name similarity',
+                             'flowline name similarity message', 'nhdplusv2 flowline gnis name', 'nhdplusv2 comid',
+                             'nhdplusv2 flowline length km', 'nhdplusv2 flowline reachcode',
+                             'meters from flowline', 'nhdplusv2 flowline measure',
+                             'nhdplusv2 terminal flag', 'nhdplusv2 waterbody permanent identifier',
+                             'nhdplusv2 waterbody gnis name', 'nhdplusv2 waterbody reachcode',
+                             'nhdplusv2 waterbody ftype', 'nhdplusv2 waterbody comid', 'hydrolink message'
+                             ]
+               }
+
+
+# type of output fields, fields not listed are text
+FIELD_TYPES = {'source lat nad83': 'float',
+               'source lon nad83': 'float',
+               'source buffer meters': 'float',
+               'closest conluence meters': 'float',
+               'closest flowline order': 'int',
+               'total count flowlines in buffer': 'int',
+               'flowline name similarity': 'float',
+               'nhdhr flowline length km': 'float',
+               'nhdplusv2 flowline length km': 'float',
+               'nhdplusv2 comid': 'int',
+               'meters from flowline': 'float',
+               'nhdhr flowline measure': 'float',
+               'nhdplusv2 flowline measure': 'float',
+               'nhdplusv2 terminal flag': 'int',
+               'nhdplusv2 waterbody comid': 'int'
+               }
+
+# output formats and default batch size of their writers
+OUTPUT_FORMATS = {'csv': 1000, 'parquet': 50000, 'arrow': 50000}
+
+
+class BufferedWriter:
+    """Buffers HydroLink output rows and writes them in batches, shared by worker threads.
+
+    Subclasses write batches of rows in write_rows.
+    """
+
+    def __init__(self, outfile_name, batch_size=1000):
+        """Initiate writer.
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of output file
+        batch_size: int, default 1000
+            Number of rows buffered before they are written to the file
+
+        """
+        self.outfile_name = outfile_name
+        self.batch_size = batch_size
+        self.rows = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def write(self, row):
+        """Buffer row (dictionary of output fields), writing buffered rows when batch_size rows are buffered."""
+        with self._lock:
+            self.rows.append(row)
+            if len(self.rows) >= self.batch_size:
+                self._write_buffered()
+
+    def flush(self):
+        """Write buffered rows to the file."""
+        with self._lock:
+            self._write_buffered()
+
+    def _write_buffered(self):
+        """Write buffered rows, called holding the lock."""
+        if len(self.rows) > 0:
+            rows, self.rows = self.rows, []
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        """Write a batch of rows to the file."""
+        raise NotImplementedError
+
+    def close_file(self):
+        """Close the file."""
+        raise NotImplementedError
+
+    def close(self):
+        """Write buffered rows and close the file."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self._write_buffered()
+            finally:
+                self.close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CSVWriter(BufferedWriter):
+    """Writes HydroLink output rows to a CSV file held open, in batches."""
+
+    def __init__(self, outfile_name, field_names, batch_size=1000):
+        """Open CSV file for appending rows.
+
+        The header is written when the file is new or empty.
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of csv output file
+        field_names: list
+            Fields of output rows in the order written, see FIELD_NAMES
+        batch_size: int, default 1000
+            Number of rows buffered before they are written to the file
+
+        """
+        super().__init__(outfile_name, batch_size=batch_size)
+        self.field_names = field_names
+        self._file = open(outfile_name, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=field_names, delimiter=',')
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+
+    def write_rows(self, rows):
+        """Write a batch of rows to the file."""
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close_file(self):
+        """Close the file."""
+        self._file.close()
+
+
+def arrow_schema(nhd_version='nhdhr'):
+    """Return pyarrow schema of HydroLink output.
+
+    Fields are those of FIELD_NAMES, in the same order, typed as float64, int64 or string (see FIELD_TYPES).
+    'source id' is written as text so the schema does not depend on the identifiers of the input data.
+
+    Parameters
+    ----------
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+
+    Returns
+    ----------
+    schema: pyarrow.Schema
+
+    """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Parquet and Arrow output, install with pip install pyarrow')
+    types = {'float': pyarrow.float64(), 'int': pyarrow.int64(), 'text': pyarrow.string()}
+    return pyarrow.schema([(field, types[FIELD_TYPES.get(field, 'text')]) for field in FIELD_NAMES[nhd_version]])
+
+
+def arrow_value(value, kind):
+    """Convert output value to the Python type of a field of kind 'float', 'int' or 'text', None and NaN are missing (None)."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if kind == 'float':
+        return float(value)
+    if kind == 'int':
+        return int(value)
+    return str(value)
+
+
+def record_batch(rows, schema):
+    """Return pyarrow.RecordBatch of output rows (dictionaries of output fields) with schema, missing fields are null and other fields are not written."""
+    columns = []
+    for field in schema:
+        kind = FIELD_TYPES.get(field.name, 'text')
+        columns.append(pyarrow.array([arrow_value(row.get(field.name), kind) for row in rows], type=field.type))
+    return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class ParquetWriter(BufferedWriter):
+    """Writes HydroLink output rows to a Parquet file, each batch of rows as a row group."""
+
+    def __init__(self, outfile_name, nhd_version='nhdhr', batch_size=50000):
+        """Open new Parquet file, replacing an existing file.
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of Parquet output file
+        nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+            Version of National Hydrography Dataset, selects the schema (see arrow_schema)
+        batch_size: int, default 50000
+            Number of rows buffered before they are written to the file as a row group
+
+        """
+        super().__init__(outfile_name, batch_size=batch_size)
+        self.schema = arrow_schema(nhd_version)
+        self._writer = pyarrow.parquet.ParquetWriter(outfile_name, self.schema)
+
+    def write_rows(self, rows):
+        """Write a batch of rows to the file as a row group."""
+        self._writer.write_batch(record_batch(rows, self.schema))
+
+    def close_file(self):
+        """Close the file."""
+        self._writer.close()
+
+
+class ArrowWriter(BufferedWriter):
+    """Writes HydroLink output rows to an Arrow IPC file, each batch of rows as a record batch."""
+
+    def __init__(self, outfile_name, nhd_version='nhdhr', batch_size=50000):
+        """Open new Arrow IPC file, replacing an existing file.
+
+        Parameters
+        ----------
+        outfile_name: str
+            Name and directory of Arrow output file
+        nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+            Version of National Hydrography Dataset, selects the schema (see arrow_schema)
+        batch_size: int, default 50000
+            Number of rows buffered before they are written to the file as a record batch
+
+        """
+        super().__init__(outfile_name, batch_size=batch_size)
+        self.schema = arrow_schema(nhd_version)
+        self._writer = pyarrow.ipc.new_file(outfile_name, self.schema)
+
+    def write_rows(self, rows):
+        """Write a batch of rows to the file as a record batch."""
+        self._writer.write_batch(record_batch(rows, self.schema))
+
+    def close_file(self):
+        """Close the file."""
+        self._writer.close()
+
+
+def open_writer(outfile_name, nhd_version='nhdhr', output_format='csv', batch_size=None):
+    """Open writer of HydroLink output.
+
+    Parameters
+    ----------
+    outfile_name: str
+        Name and directory of output file
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset
+    output_format: {'csv', 'parquet', 'arrow'}, default 'csv'
+        Format of output file.  CSV files are appended, Parquet and Arrow files are replaced.
+    batch_size: int, optional
+        Number of rows buffered before they are written, default depends on output_format (see OUTPUT_FORMATS)
+
+    Returns
+    ----------
+    writer: CSVWriter, ParquetWriter or ArrowWriter
+
+    """
+    if nhd_version not in FIELD_NAMES:
+        raise ValueError(f'nhd_version {nhd_version} not supported, options include nhdhr and nhdplusv2')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format {output_format} not supported, options include csv, parquet and arrow')
+    if batch_size is None:
+        batch_size = OUTPUT_FORMATS[output_format]
+    if output_format == 'parquet':
+        return ParquetWriter(outfile_name, nhd_version=nhd_version, batch_size=batch_size)
+    if output_format == 'arrow':
+        return ArrowWriter(outfile_name, nhd_version=nhd_version, batch_size=batch_size)
+    return CSVWriter(outfile_name, FIELD_NAMES[nhd_version], batch_size=batch_size)
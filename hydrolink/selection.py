@@ -0,0 +1,246 @@
+"""Selection of the HydroLink flowline from evaluated candidate flowlines.
+
+Candidate flowlines evaluated in hydrolink_flowlines (utils.build_flowlines_details) are plain
+records.  select_flowline applies the HydroLink selection rules to these records in one pass,
+without building a pandas DataFrame for each point.  select_flowlines applies the same rules to
+the candidates of many points at once, held in one table keyed by 'source id' (see candidates_table),
+with grouped operations.  select_many returns the selections of select_flowline for many points,
+selected together with select_flowlines, see batch.hydrolink_rows_tiled.
+
+Rules
+----------
+closest
+    The closest flowline is selected.
+name_match
+    The closest flowline with an exact name match (similarity 1.0) is selected, otherwise the
+    closest flowline meeting the similarity cutoff, otherwise the closest flowline.
+
+If two or more flowlines tie for the selection (same snap distance) no flowline is selected.
+The selected record has the fields of all candidates (see selection_record) and 'closest flowline
+order', with NHD attributes renamed for the version of NHD, e.g. 'nhdhr flowline permanent identifier'.
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import collections
+import math
+import numpy as np
+import pandas as pd
+
+############################################################################################
+############################################################################################
+
+# NHD attributes renamed in selected records for each version of NHD
+RENAME_COLUMNS = {'nhdhr': {'lengthkm': 'nhdhr flowline length km',
+                            'reachcode': 'nhdhr flowline reachcode',
+                            'gnis_name': 'nhdhr flowline gnis name',
+                            'permanent_identifier': 'nhdhr flowline permanent identifier'
+                            },
+                  'nhdplusv2': {'lengthkm': 'nhdplusv2 flowline length km',
+                                'reachcode': 'nhdplusv2 flowline reachcode',
+                                'gnis_name': 'nhdplusv2 flowline gnis name',
+                                'comid': 'nhdplusv2 comid',
+                                'terminalflag': 'nhdplusv2 terminal flag',
+                                'permanent_identifier': 'nhdplusv2 flowline permanent identifier'
+                                }
+                  }
+
+# fields of candidate records returned as floats in selected records, missing values are NaN
+FLOAT_FIELDS = ['lengthkm', 'flowline name similarity', 'meters from flowline', 'nhdhr flowline measure', 'nhdplusv2 flowline measure']
+
+# result of select_flowline
+# flowline: selected record (None when no flowline is selected), tie: True when flowlines tie for the selection,
+# total_count: number of candidate flowlines, name_match_count: number of flowlines meeting the similarity cutoff
+Selection = collections.namedtuple('Selection', ['flowline', 'tie', 'total_count', 'name_match_count'])
+
+
+def select_flowline(flowlines_data, nhd_version='nhdhr', method='name_match', similarity_cutoff=0.6):
+    """Select the HydroLink flowline from evaluated candidate flowlines.
+
+    Parameters
+    ----------
+    flowlines_data: list
+        Records (dictionaries) of candidate flowlines, see utils.build_flowlines_details
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset, used to rename NHD attributes
+    method: {'name_match', 'closest'}, default 'name_match'
+        Selection rules, see module description
+    similarity_cutoff: float
+        Values between 0.6 and 1.0, minimum name similarity of a name match
+
+    Returns
+    ----------
+    selection: Selection
+
+    """
+    if method not in ['name_match', 'closest']:
+        raise ValueError(f'method {method} not supported, options include name_match and closest')
+
+    # candidates ordered by distance with a stable sort, flowlines at the same distance keep their order as in select_flowlines
+    order = np.argsort(np.array([f['meters from flowline'] for f in flowlines_data], dtype=float), kind='mergesort').tolist()
+    # closest flowline (position in order) and tie of each group of candidates
+    best = {}
+    name_match_count = 0
+    for position, i in enumerate(order):
+        similarity = flowlines_data[i]['flowline name similarity']
+        groups = ['all']
+        if similarity >= similarity_cutoff:
+            name_match_count += 1
+            groups.append('similar')
+        if similarity == 1.0:
+            groups.append('exact')
+        for group in groups:
+            if group not in best:
+                best[group] = [position, False]
+            elif flowlines_data[i]['meters from flowline'] == flowlines_data[order[best[group][0]]]['meters from flowline']:
+                best[group][1] = True
+
+    if len(order) == 0:
+        return Selection(None, False, 0, 0)
+    group = 'all'
+    if method == 'name_match':
+        group = 'exact' if 'exact' in best else 'similar' if 'similar' in best else 'all'
+    position, tie = best[group]
+    flowline = None if tie else selection_record(flowlines_data, order[position], position + 1, nhd_version)
+    return Selection(flowline, tie, len(order), name_match_count)
+
+
+def selection_record(flowlines_data, index, closest_order, nhd_version='nhdhr'):
+    """Return record of the candidate at index of flowlines_data, with NHD attributes renamed for nhd_version.
+
+    Fields of all candidates are included.  Fields in FLOAT_FIELDS are floats, NaN when the value is
+    missing (None or a field the candidate does not have).  Other fields (text and integer identifiers,
+    e.g. gnis_name and comid) keep the value of the candidate, None when missing.  'closest flowline order'
+    is closest_order, the position (from 1) of the candidate when ordered by distance.
+    """
+    rename = RENAME_COLUMNS[nhd_version]
+    fields = dict.fromkeys(field for record in flowlines_data for field in record)
+    record = flowlines_data[index]
+    selected = {}
+    for field in fields:
+        value = record.get(field)
+        if field in FLOAT_FIELDS:
+            value = math.nan if value is None else float(value)
+        selected[rename.get(field, field)] = value
+    selected['closest flowline order'] = closest_order
+    return selected
+
+
+def candidates_table(hydrolinks):
+    """Return candidate flowlines of many HydroLink objects as one table keyed by 'source id'.
+
+    Parameters
+    ----------
+    hydrolinks: list
+        nhd_hr.HighResPoint or nhd_mr.MedResPoint objects after hydrolink_flowlines, objects that
+        failed (status 0) are not included
+
+    Returns
+    ----------
+    candidates: pandas.DataFrame
+        Row for each candidate flowline of each object, with the fields of utils.build_flowlines_details
+
+    """
+    records = [dict(flowline_data, **{'source id': hydrolink.source_id}) for hydrolink in hydrolinks
+               if hydrolink.status == 1 and getattr(hydrolink, 'flowlines_data', None) is not None
+               for flowline_data in hydrolink.flowlines_data]
+    return pd.DataFrame(records)
+
+
+def select_flowlines(candidates, nhd_version='nhdhr', method='name_match', similarity_cutoff=0.6, by='source id'):
+    """Select the HydroLink flowline of many points at once from one table of candidate flowlines.
+
+    Applies the rules of select_flowline with grouped operations over all points, rather than
+    selecting for each point separately.  Candidates are ordered with the same stable sort as
+    select_flowline, so 'closest flowline order' is the same for flowlines at the same distance.
+
+    Parameters
+    ----------
+    candidates: pandas.DataFrame
+        Candidate flowlines of all points with a 'source id' column, see candidates_table
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset, used to rename NHD attributes
+    method: {'name_match', 'closest'}, default 'name_match'
+        Selection rules, see module description
+    similarity_cutoff: float
+        Values between 0.6 and 1.0, minimum name similarity of a name match
+    by: str, default 'source id'
+        Column identifying the point of each candidate
+
+    Returns
+    ----------
+    selections: pandas.DataFrame
+        Row for each point (by) with the fields of the selected flowline (NaN where flowlines tie),
+        'closest flowline order', 'total count flowlines in buffer', 'name match count' and 'tie'
+
+    """
+    if method not in ['name_match', 'closest']:
+        raise ValueError(f'method {method} not supported, options include name_match and closest')
+
+    df = candidates.sort_values([by, 'meters from flowline'], kind='mergesort').reset_index(drop=True)
+    groups = df.groupby(by, sort=False)
+    df['closest flowline order'] = groups.cumcount() + 1
+    df['total count flowlines in buffer'] = groups[by].transform('size')
+    similar = df['flowline name similarity'] >= similarity_cutoff
+    df['name match count'] = similar.groupby(df[by], sort=False).transform('sum')
+
+    eligible = pd.Series(True, index=df.index)
+    if method == 'name_match':
+        exact = df['flowline name similarity'] == 1.0
+        has_exact = exact.groupby(df[by], sort=False).transform('any')
+        has_similar = similar.groupby(df[by], sort=False).transform('any')
+        eligible = exact.where(has_exact, similar.where(has_similar, True))
+
+    # candidates are ordered by distance, the first eligible candidate of each point is selected
+    df = df.loc[eligible.astype(bool)]
+    closest = df.groupby(by, sort=False)['meters from flowline'].transform('first')
+    ties = (df['meters from flowline'] == closest).groupby(df[by], sort=False).transform('sum') > 1
+    selections = df.drop_duplicates(by, keep='first').copy()
+    selections['tie'] = ties.loc[selections.index]
+    fields = [c for c in selections.columns if c not in [by, 'source id', 'total count flowlines in buffer', 'name match count', 'tie']]
+    if selections['tie'].any():
+        selections[fields] = selections[fields].where(~selections['tie'], np.nan)
+    return selections.rename(columns=RENAME_COLUMNS[nhd_version]).reset_index(drop=True)
+
+
+def select_many(flowlines_data_of_points, nhd_version='nhdhr', method='name_match', similarity_cutoff=0.6):
+    """Select the HydroLink flowline of many points together, with the results of select_flowline for each point.
+
+    Distances and name similarities of all candidates are held in one table and selected with
+    select_flowlines, selected records are then built from the candidates of each point (see selection_record).
+
+    Parameters
+    ----------
+    flowlines_data_of_points: list
+        Records of candidate flowlines of each point, see select_flowline
+    nhd_version, method, similarity_cutoff
+        See select_flowline
+
+    Returns
+    ----------
+    selections: list
+        Selection of each point, in the same order as flowlines_data_of_points
+
+    """
+    if method not in ['name_match', 'closest']:
+        raise ValueError(f'method {method} not supported, options include name_match and closest')
+    columns = ['meters from flowline', 'flowline name similarity']
+    candidates = pd.DataFrame([[point, candidate] + [flowline_data[c] for c in columns]
+                               for point, flowlines_data in enumerate(flowlines_data_of_points)
+                               for candidate, flowline_data in enumerate(flowlines_data)],
+                              columns=['point', 'candidate'] + columns)
+    selections = [Selection(None, False, 0, 0)] * len(flowlines_data_of_points)
+    if len(candidates) == 0:
+        return selections
+    for row in select_flowlines(candidates, nhd_version, method, similarity_cutoff, by='point').to_dict('records'):
+        flowlines_data = flowlines_data_of_points[int(row['point'])]
+        flowline = None
+        if not row['tie']:
+            flowline = selection_record(flowlines_data, int(row['candidate']), int(row['closest flowline order']), nhd_version)
+        selections[int(row['point'])] = Selection(flowline, bool(row['tie']), int(row['total count flowlines in buffer']),
+                                                  int(row['name match count']))
+    return selections
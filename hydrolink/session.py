@@ -0,0 +1,144 @@
+"""Shared HTTP session used for NHD service calls.
+
+HydroLinking a point requires one or more requests to ArcGIS REST services hosted by the
+USGS (Hydro Event Management) and the EPA (WatersGeo).  Making these requests with bare
+requests.get opens a new connection (TCP and TLS handshake) for every call.  This module
+builds a requests.Session with keep-alive connection pooling, pool sizes and timeouts
+configured per service host, and provides a shared default session used by the
+HydroLink classes and the hydrolinker command line tool.
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+############################################################################################
+############################################################################################
+
+# Default connection settings for hosts of NHD MapServers used in HydroLink
+# pool_maxsize is the number of connections kept alive per host, timeout is in seconds
+HOST_CONFIG = {'https://hydromaintenance.nationalmap.gov': {'pool_maxsize': 10, 'timeout': 60},
+               'https://watersgeo.epa.gov': {'pool_maxsize': 10, 'timeout': 60}
+               }
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """Transport adapter that applies a default timeout to each request."""
+
+    def __init__(self, timeout=60, **kwargs):
+        """Initiate adapter.
+
+        Parameters
+        ----------
+        timeout: float or tuple
+            Default timeout in seconds passed to requests, used when a request does not specify a timeout.
+            A tuple is interpreted as (connect timeout, read timeout).
+        **kwargs
+            Passed to requests.adapters.HTTPAdapter (e.g. pool_connections, pool_maxsize, max_retries)
+
+        """
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        """Send request using default timeout if one is not supplied."""
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def build_session(pool_maxsize=10, timeout=60, host_config=None):
+    """Build requests session with connection pooling and timeouts.
+
+    Parameters
+    ----------
+    pool_maxsize: int, default 10
+        Number of connections kept alive per host, used for hosts not listed in host_config.
+        When HydroLinking points concurrently this should be at least the number of workers.
+    timeout: float or tuple, default 60
+        Timeout in seconds for hosts not listed in host_config.
+    host_config: dictionary, optional
+        Settings per host where keys are url prefixes (e.g. 'https://watersgeo.epa.gov') and values are
+        dictionaries with optional 'pool_maxsize' and 'timeout' keys. Defaults to HOST_CONFIG.
+
+    Returns
+    ----------
+    session: requests.Session
+        Session with TimeoutHTTPAdapter mounted for each host
+
+    """
+    if host_config is None:
+        host_config = HOST_CONFIG
+
+    session = requests.Session()
+    for prefix in ['https://', 'http://']:
+        session.mount(prefix, TimeoutHTTPAdapter(timeout=timeout, pool_maxsize=pool_maxsize))
+    for host, config in host_config.items():
+        adapter = TimeoutHTTPAdapter(timeout=config.get('timeout', timeout),
+                                     pool_maxsize=config.get('pool_maxsize', pool_maxsize))
+        session.mount(host, adapter)
+
+    return session
+
+
+def get_session():
+    """Return shared session used by default for NHD service calls, building it on first use."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = build_session()
+    return _default_session
+
+
+def set_session(session):
+    """Replace shared session used by default for NHD service calls.
+
+    Parameters
+    ----------
+    session: requests.Session
+        Session to be used by HydroLink classes that are not given their own session.
+        Use None to rebuild the default session on next use.
+
+    """
+    global _default_session
+    with _default_session_lock:
+        _default_session = session
+
+
+def request_json(url, session=None, cache=None):
+    """Request url and return JSON, using cached response when available.
+
+    Parameters
+    ----------
+    url: str
+        Query url, e.g. built in nhd_hr.HighResPoint.build_nhd_query
+    session: requests.Session, optional
+        Session used for the request, default is the shared session from get_session
+    cache: cache.ResponseCache, optional
+        Cache checked before making the request and updated with the response
+
+    Returns
+    ----------
+    results: dictionary
+        JSON returned from request of url
+
+    """
+    if cache is not None:
+        results = cache.get(url)
+        if results is not None:
+            return results
+    if session is None:
+        session = get_session()
+    results = session.get(url).json()
+    if cache is not None:
+        cache.set(url, results)
+    return results
@@ -0,0 +1,277 @@
+"""Client side rate limiting, adaptive concurrency and retries for NHD service calls.
+
+HEM and WatersGeo services throttle or block clients making too many requests.  Throttle limits
+requests to each service host with a token bucket (requests per second) and an adaptive limit on
+requests in flight.  The limit grows by one request after a full limit of successful requests and
+is halved when a request fails or recent latency climbs well above the usual latency of the host
+(additive increase, multiplicative decrease), so workers can be set high and throughput settles at
+what the service tolerates.  Requests failing with 429 or 5xx status codes, timeouts or dropped
+connections are retried with exponential backoff and jitter, honoring Retry-After headers.
+
+Example
+----------
+throttle = throttle.Throttle()
+backend = backends.RestBackend(throttle=throttle)
+hydrolinks = batch.hydrolink_rows(rows, workers=32, backend=backend)
+
+Author
+----------
+Name: Daniel Wieferich
+Contact: dwieferich@usgs.gov
+"""
+
+# Import packages
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from hydrolink import session as hl_session
+
+############################################################################################
+############################################################################################
+
+# Default limits for hosts of NHD MapServers used in HydroLink
+# rate is requests per second, burst is requests allowed at once, max_concurrency is requests in flight
+HOST_LIMITS = {'hydromaintenance.nationalmap.gov': {'rate': 10.0, 'burst': 10, 'max_concurrency': 16},
+               'watersgeo.epa.gov': {'rate': 10.0, 'burst': 10, 'max_concurrency': 16}
+               }
+
+# HTTP status codes (and ArcGIS JSON error codes) that are retried
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """Request failed in a way that may succeed when retried."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of requests."""
+
+    def __init__(self, rate=10.0, burst=10, clock=time.monotonic, sleep=time.sleep):
+        """Initiate bucket.
+
+        Parameters
+        ----------
+        rate: float, default 10.0
+            Tokens added per second, None does not limit rate
+        burst: int, default 10
+            Maximum number of tokens held
+        clock, sleep: callable
+            Time functions, replaced in tests
+
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for and take a token."""
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Limit on requests in flight adjusted by additive increase, multiplicative decrease."""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, latency_factor=3.0, recent_weight=0.2, baseline_weight=0.02):
+        """Initiate limiter.
+
+        Latency is tracked as two exponentially weighted moving averages of successful requests, a
+        recent latency and a slowly moving baseline.  Requests of a host differ in latency (e.g. point
+        and buffer queries, cached and cold responses), comparing averages keeps a mix of fast and
+        slow requests from decreasing the limit while a sustained climb in latency still does.
+
+        Parameters
+        ----------
+        initial: int, default 4
+            Starting limit of requests in flight
+        minimum, maximum: int, default 1 and 16
+            Range of limit
+        latency_factor: float, default 3.0
+            Limit is decreased when recent latency is longer than latency_factor times the baseline latency
+        recent_weight, baseline_weight: float, default 0.2 and 0.02
+            Weight of each request in the moving averages of recent and baseline latency
+
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_factor = latency_factor
+        self.recent_weight = recent_weight
+        self.baseline_weight = baseline_weight
+        self.recent_latency = None
+        self.baseline_latency = None
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request can be made within the limit."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, success=True):
+        """Release request and adjust limit.
+
+        Parameters
+        ----------
+        latency: float, optional
+            Seconds taken by request
+        success: bool, default True
+            False when request failed or was throttled
+
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None and success:
+                if self.baseline_latency is None:
+                    self.recent_latency = self.baseline_latency = latency
+                self.recent_latency += self.recent_weight * (latency - self.recent_latency)
+                self.baseline_latency += self.baseline_weight * (latency - self.baseline_latency)
+                # allow a floor on latency so very fast responses (e.g. cached by a proxy) do not cause decreases
+                success = self.recent_latency <= self.latency_factor * max(self.baseline_latency, 0.05)
+            if success:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit / 2)
+            self._condition.notify_all()
+
+
+class Throttle:
+    """Rate limits, adaptive concurrency and retries per service host."""
+
+    def __init__(self, host_limits=None, rate=10.0, burst=10, max_concurrency=16, retries=5, backoff=0.5, max_backoff=30.0,
+                 sleep=time.sleep):
+        """Initiate throttle.
+
+        Parameters
+        ----------
+        host_limits: dictionary, optional
+            Limits per host where keys are host names (e.g. 'watersgeo.epa.gov') and values are dictionaries
+            with optional 'rate', 'burst' and 'max_concurrency' keys. Defaults to HOST_LIMITS.
+        rate, burst, max_concurrency: default 10.0, 10 and 16
+            Limits for hosts not listed in host_limits, see TokenBucket and AdaptiveLimiter
+        retries: int, default 5
+            Number of times a failed request is retried
+        backoff: float, default 0.5
+            Seconds waited before the first retry, doubled for each following retry
+        max_backoff: float, default 30.0
+            Maximum seconds waited before a retry
+        sleep: callable
+            Replaced in tests
+
+        """
+        self.host_limits = host_limits if host_limits is not None else HOST_LIMITS
+        self.defaults = {'rate': rate, 'burst': burst, 'max_concurrency': max_concurrency}
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.retried = 0
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        """Return (TokenBucket, AdaptiveLimiter) of host of url, building them on first use."""
+        name = urlsplit(url).hostname
+        with self._lock:
+            if name not in self.hosts:
+                limits = dict(self.defaults, **self.host_limits.get(name, {}))
+                self.hosts[name] = (TokenBucket(limits['rate'], limits['burst'], sleep=self.sleep),
+                                    AdaptiveLimiter(initial=min(4, limits['max_concurrency']), maximum=limits['max_concurrency']))
+        return self.hosts[name]
+
+    def backoff_seconds(self, attempt, retry_after=None):
+        """Return seconds to wait before retry attempt (0 based), with full jitter."""
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request_json(self, url, session=None):
+        """Request url and return JSON, waiting on limits of host and retrying failed requests.
+
+        Parameters
+        ----------
+        url: str
+            Query url
+        session: requests.Session, optional
+            Session used for the request, default is the shared session from session.get_session
+
+        Returns
+        ----------
+        results: dictionary
+            JSON returned from request of url
+
+        """
+        if session is None:
+            session = hl_session.get_session()
+        bucket, limiter = self.host(url)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            limiter.acquire()
+            start = time.monotonic()
+            success = False
+            # the request is always released, failures other than RetryableError (e.g. a response that is not JSON) are raised
+            try:
+                results = self.send(session, url)
+                success = True
+            except RetryableError as e:
+                if attempt == self.retries:
+                    raise
+                retry_after = e.retry_after
+            finally:
+                limiter.release(latency=time.monotonic() - start if success else None, success=success)
+            if success:
+                return results
+            with self._lock:
+                self.retried += 1
+            self.sleep(self.backoff_seconds(attempt, retry_after))
+
+    def send(self, session, url):
+        """Make a single request, raising RetryableError for failures that are retried."""
+        try:
+            response = session.get(url)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise RetryableError(f'request failed: {e}')
+
+        status_code = getattr(response, 'status_code', 200)
+        if status_code in RETRY_STATUS:
+            retry_after = getattr(response, 'headers', {}).get('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after is not None else None
+            except ValueError:
+                # Retry-After can also be an HTTP date, use backoff instead
+                retry_after = None
+            raise RetryableError(f'status code {status_code}', retry_after=retry_after)
+
+        results = response.json()
+        # ArcGIS services can report errors, including throttling, in the body of a 200 response
+        if isinstance(results, dict) and isinstance(results.get('error'), dict) and results['error'].get('code') in RETRY_STATUS:
+            raise RetryableError(f"service error {results['error'].get('code')}")
+        return results
+
+    def stats(self):
+        """Return dictionary of retries and current concurrency limit per host."""
+        with self._lock:
+            limits = {name: int(limiter.limit) for name, (bucket, limiter) in self.hosts.items()}
+        return {'retried': self.retried, 'limits': limits}
@@ -6,16 +6,40 @@ Daniel Wieferich: dwieferich@usgs.gov
 """
 
 # Import packages
-import geopandas as gpd
+import collections
+import functools
+import numpy as np
 import pandas as pd
+import pyproj
+import shapely
 from shapely.geometry import Point, LineString
 import shapely.wkt
 import re
 import difflib
+import threading
+try:
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+    from rapidfuzz import process as rapidfuzz_process
+except ImportError:
+    rapidfuzz_fuzz = None
+    rapidfuzz_process = None
 
 ############################################################################################
 ############################################################################################
 
+# Distance modes, see distances_meters
+DISTANCE_MODES = ['albers', 'geodesic']
+
+# General bounding box of the United States including Puerto Rico and Virgin Islands (min lon, min lat, max lon, max lat)
+# intended to pick up common issues like missing values, 0 values and positive lon values
+US_BOUNDS = (-178.5, 17.5, -64.0, 71.5)
+
+# Maximum number of cleaned names and of name similarity ratios held in memory, see name_cache_stats
+NAME_CACHE_SIZE = 65536
+
+# Flowline attributes and vertices (x, y, m) of its path as a contiguous float array, see flowline_from_feature
+Flowline = collections.namedtuple('Flowline', ['attributes', 'vertices'])
+
 
 def crs_to_nad83(input_point, crs):
     """Reproject point data to NAD83, aka crs 4269.
@@ -35,21 +59,55 @@ def crs_to_nad83(input_point, crs):
         latitude in crs 4269 (NAD83)
 
     """
-    # create geoseries of shapely point
-    pt_gdf = gpd.GeoSeries(input_point)
-    # set crs of geoseries, using user provided crs
-    epsg_crs = f'epsg:{str(int(crs))}'
-    pt_gdf.crs = epsg_crs
-    # reproject point
-    pt_gdf = pt_gdf.to_crs('epsg:4269')
-
-    lon_nad83 = float(pt_gdf[0].x)
-    lat_nad83 = float(pt_gdf[0].y)
+    lons_nad83, lats_nad83 = coordinates_to_nad83([input_point.x], [input_point.y], crs)
+    lon_nad83 = float(lons_nad83[0])
+    lat_nad83 = float(lats_nad83[0])
 
     return lon_nad83, lat_nad83
 
 
-def build_flowline_details(flowline_data, input_point, nhd_version='nhdhr', source_water_name=''):
+def coordinates_to_nad83(lons, lats, crs):
+    """Reproject arrays of coordinates to NAD83 (crs 4269) in one call.
+
+    Parameters
+    ----------
+    lons, lats: array like
+        x and y coordinates in crs
+    crs: int
+        EPSG defined coordinate reference system
+
+    Returns
+    ----------
+    lons_nad83, lats_nad83: numpy.ndarray
+        Coordinates in crs 4269 (NAD83). Coordinates that can not be transformed are inf.
+
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    if int(crs) == 4269:
+        return lons, lats
+    return get_transformer(f'epsg:{int(crs)}', 'epsg:4269').transform(lons, lats)
+
+
+def in_us_bounds(lons, lats):
+    """Check if NAD83 coordinates are within the bounding box of the United States (US_BOUNDS).
+
+    Parameters
+    ----------
+    lons, lats: float or array like
+
+    Returns
+    ----------
+    in_bounds: bool or numpy.ndarray of bool
+
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    min_lon, min_lat, max_lon, max_lat = US_BOUNDS
+    return (lats > min_lat) & (lats < max_lat) & (lons > min_lon) & (lons < max_lon)
+
+
+def build_flowline_details(flowline_data, input_point, nhd_version='nhdhr', source_water_name='', distance_mode='albers'):
     """Brings together functions to get hydrolink details for a flowline.
 
     Parameters
@@ -66,45 +124,141 @@ def build_flowline_details(flowline_data, input_point, nhd_version='nhdhr', sour
 
     source_water_name: str, optional, default ''
         If available name of water body (e.g. name of lake, river, estuary...)
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances in meters, see distances_meters
 
     Returns
     ----------
     flowline_attributes: dictionary
         Hydrolink calculated attributes updated to input flowline_data
     terminal_node_points: list
-        List of shapely points expressed in wkt representing terminal nodes of flowline
-        Example [POINT (-70.63598606746581 41.7689812018329)', 'POINT (-70.63435706746833 41.77051200183053)']
+        List of (x, y) tuples representing terminal nodes of flowline
+        Example [(-70.63598606746581, 41.7689812018329), (-70.63435706746833, 41.77051200183053)]
     flowline_geo: list
         List of shapely points representing shapely linestring of the flowline
 
     """
-    flowline_attributes = flowline_data['attributes']
-    # get all keys lower case hr lower, mr was upper
-    flowline_attributes = {key.lower(): v for key, v in flowline_attributes.items()}
-    flowline_geo = flowline_data['geometry']['paths'][0]
+    # a single flowline is evaluated with the same routine used for all candidate flowlines
+    flowlines_data, terminal_node_points, flowline_geo = build_flowlines_details([flowline_data], input_point, nhd_version=nhd_version,
+                                                                                 source_water_name=source_water_name, distance_mode=distance_mode)
+    return flowlines_data[0], terminal_node_points, flowline_geo
 
-    # measure distance from point to flowline, return point location on flowline (flowline_point)
-    flowline_snap_point, snap_distance_meters = point_to_line_meters(flowline_geo, input_point)
-    # list of nhd measures within flowline_geo (m values)
-    node_measures = [x[2] for x in flowline_geo]
 
-    # check to see if there are more than 2 occurences of a terminal node (this indicates a confluence)
-    terminal_node_points = list(set([Point(x[0], x[1]).wkt for x in flowline_geo if x[2] == max(node_measures) or x[2] == min(node_measures)]))
+def flowline_from_feature(feature):
+    """Return Flowline holding attributes and vertices of the first path of a JSON flowline feature.
+
+    Parameters
+    ----------
+    feature: dictionary
+        Flowline feature returned from NHD services, e.g. flowlines_json['features'][0]
+
+    Returns
+    ----------
+    flowline: Flowline
+        attributes dictionary and vertices as numpy.ndarray with a row (x, y, m) per vertex
+
+    """
+    return Flowline(feature['attributes'], np.ascontiguousarray(feature['geometry']['paths'][0], dtype=float))
+
+
+def build_flowlines_details(flowlines_features, input_point, nhd_version='nhdhr', source_water_name='', distance_mode='albers'):
+    """Get hydrolink details for all candidate flowlines at once using shapely array operations.
+
+    Geometries of all flowlines are built once as one array from the vertices (x, y, m) of all
+    flowlines.  Min and max measures, terminal nodes, snap points, snap distances and NHD measures
+    are then calculated for every flowline in bulk, without further passes over vertices in Python.
+
+    Parameters
+    ----------
+    flowlines_features: list
+        Features of flowlines, e.g. flowlines_json['features'] in nhd_hr.hydrolink_flowlines or nhd_mr.hydrolink_flowlines,
+        as JSON features or Flowline (e.g. from cache.FlowlineCache)
+    input_point: shapely point
+        Input location for hydrolinking. For formatting see shapely.geometry Point method
+    nhd_version: {'nhdhr', 'nhdplusv2'}, default 'nhdhr'
+        Version of National Hydrography Dataset, see build_flowline_details
+    source_water_name: str, optional, default ''
+        If available name of water body (e.g. name of lake, river, estuary...)
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances in meters, see distances_meters
 
-    nhd_measure = nhd_flowline_measure(flowline_geo, node_measures, flowline_snap_point)
+    Returns
+    ----------
+    flowlines_data: list
+        Hydrolink calculated attributes for each flowline, see build_flowline_details
+    terminal_node_points: list
+        Terminal node (x, y) tuples of all flowlines, each flowline contributing each node once
+    flowline_geo: list
+        List of points representing the last flowline, see build_flowline_details
 
-    name_similarity = gnis_name_similarity(flowline_attributes['gnis_name'], source_water_name)
-    flowline_attributes.update(name_similarity)
+    """
+    flowlines = [f if isinstance(f, Flowline) else flowline_from_feature(f) for f in flowlines_features]
+    vertex_arrays = [flowline.vertices[:, :3] for flowline in flowlines]
+    vertex_counts = np.array([len(v) for v in vertex_arrays])
+    starts = np.concatenate([[0], np.cumsum(vertex_counts)[:-1]])
+    vertices = np.concatenate(vertex_arrays)
+    line_index = np.repeat(np.arange(len(flowlines)), vertex_counts)
+    lines = shapely.linestrings(vertices[:, :2], indices=line_index)
+
+    # snap point (closest location on each flowline) and distance in meters
+    snap_meas = shapely.line_locate_point(lines, input_point)
+    snap_xy = shapely.get_coordinates(shapely.line_interpolate_point(lines, snap_meas))
+    snap_distances = distances_meters(snap_xy[:, 0], snap_xy[:, 1], [input_point.x] * len(lines), [input_point.y] * len(lines), mode=distance_mode)
+
+    # min and max nhd measures (m values) of each flowline and the first vertex with each
+    measures = vertices[:, 2]
+    max_measures = np.maximum.reduceat(measures, starts)
+    min_measures = np.minimum.reduceat(measures, starts)
+    is_max = measures == max_measures[line_index]
+    is_min = measures == min_measures[line_index]
+    max_vertex = np.flatnonzero(is_max)[np.unique(line_index[is_max], return_index=True)[1]]
+    min_vertex = np.flatnonzero(is_min)[np.unique(line_index[is_min], return_index=True)[1]]
+    max_node_meas = shapely.line_locate_point(lines, shapely.points(vertices[max_vertex, :2]))
+    min_node_meas = shapely.line_locate_point(lines, shapely.points(vertices[min_vertex, :2]))
+
+    # terminal nodes are vertices with the min or max measure of a flowline, a confluence is shared by 3 or more flowlines
+    terminal = is_max | is_min
+    terminal_nodes = np.unique(np.column_stack([line_index[terminal], vertices[terminal, :2]]), axis=0)
+    terminal_node_points = list(map(tuple, terminal_nodes[:, 1:].tolist()))
 
     label_nhd_version = f'{nhd_version} flowline measure'
-    flowline_attributes.update({'meters from flowline': snap_distance_meters,
-                                label_nhd_version: nhd_measure
-                                })
+    flowlines_attributes = [{key.lower(): v for key, v in flowline.attributes.items()} for flowline in flowlines]
+    names_similarity = gnis_names_similarity([flowline_attributes['gnis_name'] for flowline_attributes in flowlines_attributes], source_water_name)
+    flowlines_data = []
+    for i, flowline_attributes in enumerate(flowlines_attributes):
+        flowline_attributes.update(names_similarity[i])
+        flowline_attributes.update({'meters from flowline': float(snap_distances[i]),
+                                    label_nhd_version: measure_from_projections(snap_meas[i], min_node_meas[i], max_node_meas[i],
+                                                                                min_measures[i], max_measures[i])
+                                    })
+        flowlines_data.append(flowline_attributes)
+
+    return flowlines_data, terminal_node_points, flowlines[-1].vertices.tolist()
+
+
+def measure_from_projections(length_line_to_point, min_node_meas, max_node_meas, min_measure, max_measure):
+    """Calculate NHD measure from distances along a flowline (the address), see nhd_flowline_measure.
+
+    Parameters
+    ----------
+    length_line_to_point: float
+        Distance along flowline to the snap point
+    min_node_meas, max_node_meas: float
+        Distance along flowline to the nodes with the min and max NHD measures
+    min_measure, max_measure: float
+        Min and max NHD measures (m values) of flowline
 
-    return flowline_attributes, terminal_node_points, flowline_geo
+    """
+    length_line_total = max(min_node_meas, max_node_meas)
+    flowline_total_meas = float(max_measure) - float(min_measure)
+    if min_node_meas > max_node_meas:
+        return float(max_measure) - ((flowline_total_meas * float(length_line_to_point)) / float(length_line_total))
+    elif length_line_total != 0:
+        return ((flowline_total_meas * float(length_line_to_point)) / float(length_line_total)) + float(min_measure)
+    return None
 
 
-def nhd_flowline_measure(flowline_geo, node_measures, flowline_snap_point):
+def nhd_flowline_measure(flowline_geo, node_measures, flowline_snap_point, flowline_line=None):
     """Measure along flowline where the flowline_snap_point is located (the address).
 
     Parameters
@@ -115,6 +269,8 @@ def nhd_flowline_measure(flowline_geo, node_measures, flowline_snap_point):
         nhd measures within flowline_geo (m values)
     flowline_snap_point: shapely point
         shapely point that marks snap location (closest location on line to a coordinate), see point_to_line_meters
+    flowline_line: shapely linestring, optional
+        Line of flowline_geo if already built
 
     Returns
     ----------
@@ -123,29 +279,52 @@ def nhd_flowline_measure(flowline_geo, node_measures, flowline_snap_point):
         Note a reachcode can span multiple flowlines
 
     """
-    flowline_line = LineString(flowline_geo)
+    if flowline_line is None:
+        flowline_line = LineString(flowline_geo)
 
-    # Below calculates measure along nhd flowline
-    # Make sure the max node value is actually the max measure for the flowline
-    max_node_point = [Point(x[0], x[1]) for x in flowline_geo if x[2] == max(node_measures)][0]
-    min_node_point = [Point(x[0], x[1]) for x in flowline_geo if x[2] == min(node_measures)][0]
+    # Below calculates measure along nhd flowline, using the first nodes with the max and min measures
+    node_measures = list(node_measures)
+    max_measure = max(node_measures)
+    min_measure = min(node_measures)
+    max_node = flowline_geo[node_measures.index(max_measure)]
+    min_node = flowline_geo[node_measures.index(min_measure)]
 
-    length_line_to_point = flowline_line.project(flowline_snap_point)
-    length_line_total = max(flowline_line.project(min_node_point), flowline_line.project(max_node_point))
-    # total span of flowline measures
-    flowline_total_meas = float(max(node_measures)) - float(min(node_measures))
+    return measure_from_projections(flowline_line.project(flowline_snap_point),
+                                    flowline_line.project(Point(min_node[0], min_node[1])),
+                                    flowline_line.project(Point(max_node[0], max_node[1])),
+                                    min_measure, max_measure)
 
-    if flowline_line.project(min_node_point) > flowline_line.project(max_node_point):
-        nhd_measure = (float(max(node_measures)) - ((float(flowline_total_meas) * float(length_line_to_point)) / float(length_line_total)))
-    elif length_line_total != 0:
-        nhd_measure = (((float(flowline_total_meas) * float(length_line_to_point)) / float(length_line_total)) + float(min(node_measures)))
-    else:
-        nhd_measure = None
 
-    return nhd_measure
+def confluence_points(terminal_node_points, tolerance=None):
+    """Find confluences, terminal nodes shared by three or more flowlines, in one pass.
 
+    Parameters
+    ----------
+    terminal_node_points: list
+        Terminal nodes of flowlines as (x, y) tuples or points expressed in wkt, including duplicate values
+    tolerance: float, optional
+        Nodes within the same grid cell of tolerance (in coordinate units, degrees for NAD83) are
+        considered the same node. Default requires identical coordinates.
+
+    Returns
+    ----------
+    confluences: list
+        (x, y) tuples of confluences, using the first coordinates seen for each node
 
-def closest_confluence(terminal_node_points, input_point, flowline_geo):
+    """
+    counts = collections.Counter()
+    coordinates = {}
+    for node in terminal_node_points:
+        if isinstance(node, str):
+            node = shapely.wkt.loads(node).coords[0]
+        x, y = node[0], node[1]
+        key = (x, y) if tolerance is None else (round(x / tolerance), round(y / tolerance))
+        counts[key] += 1
+        coordinates.setdefault(key, (x, y))
+    return [coordinates[key] for key, count in counts.items() if count > 2]
+
+
+def closest_confluence(terminal_node_points, input_point, flowline_geo=None, distance_mode='albers', tolerance=None):
     """Calculate distance from input point coordinates to closest confluence.
 
     This function accepts a list of terminal nodes.  A confluence is considered where
@@ -155,11 +334,16 @@ def closest_confluence(terminal_node_points, input_point, flowline_geo):
     Parameters
     ----------
     terminal_node_points: list
-        complete list of terminal node points from a subset of flowlines including duplicate values
+        complete list of terminal node points from a subset of flowlines including duplicate values,
+        as (x, y) tuples (see build_flowlines_details) or points expressed in wkt (see build_flowline_details)
     input_point: shapely point
         location from which distance calculations are made. For formatting see shapely.geometry Point method
-    flowline_geo: list
-        List of shapely points representing shapely linestring of the flowline, see build_flowline_details
+    flowline_geo: list, optional
+        Not used, kept for compatibility
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances in meters, see distances_meters
+    tolerance: float, optional
+        Snapping tolerance of terminal nodes, see confluence_points
 
     Returns
     ----------
@@ -167,19 +351,18 @@ def closest_confluence(terminal_node_points, input_point, flowline_geo):
         distance from input point to closest confluence in meters
 
     """
-    confluence_points = sorted(set([i for i in terminal_node_points if terminal_node_points.count(i) > 2]))
+    confluences = confluence_points(terminal_node_points, tolerance=tolerance)
     closest_confluence_meters = None
-    if len(confluence_points) > 0:
-        for point_wkt in confluence_points:
-            p = shapely.wkt.loads(point_wkt)
-            confluence_snap_distance_meters = build_distance_line(p, input_point, crs='epsg:4269')
-            if closest_confluence_meters is None or closest_confluence_meters > confluence_snap_distance_meters:
-                closest_confluence_meters = confluence_snap_distance_meters
+    if len(confluences) > 0:
+        xy = np.array(confluences, dtype=float)
+        distances = distances_meters(xy[:, 0], xy[:, 1], np.full(len(xy), input_point.x), np.full(len(xy), input_point.y),
+                                     crs='epsg:4269', mode=distance_mode)
+        closest_confluence_meters = float(distances.min())
 
     return closest_confluence_meters
 
 
-def point_to_line_meters(flowline_geo, input_point):
+def point_to_line_meters(flowline_geo, input_point, distance_mode='albers'):
     """Calculate distance in meters from input point coordinates to closest point along a line.
 
     Parameters
@@ -188,6 +371,8 @@ def point_to_line_meters(flowline_geo, input_point):
         Location from which distance calculations are made. For formatting see shapely.geometry Point method
     flowline_geo: list
         List of shapely points representing shapely linestring of the flowline, see build_flowline_details
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances in meters, see distances_meters
 
     Returns
     ----------
@@ -201,12 +386,72 @@ def point_to_line_meters(flowline_geo, input_point):
     snap_xy = flowline_geo_line.interpolate(snap_meas)
     # shapely point that marks snap location (closest location on line to a coordinate)
     flowline_snap_point = Point(snap_xy.x, snap_xy.y)
-    snap_distance_meters = build_distance_line(flowline_snap_point, input_point, crs='epsg:4269')
+    snap_distance_meters = build_distance_line(flowline_snap_point, input_point, crs='epsg:4269', distance_mode=distance_mode)
 
     return flowline_snap_point, snap_distance_meters
 
 
-def build_distance_line(point_1, point_2, crs='epsg:4269'):
+@functools.lru_cache(maxsize=None)
+def get_transformer(crs_from='epsg:4269', crs_to='epsg:5070'):
+    """Return transformer from crs_from to crs_to (x, y order), built once and reused.
+
+    pyproj transformers are thread safe (pyproj >= 3.1) so one transformer is shared by worker threads.
+    """
+    return pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+@functools.lru_cache(maxsize=None)
+def get_geod():
+    """Return GRS80 ellipsoid (used by NAD83) for geodesic distances, built once and reused."""
+    return pyproj.Geod(ellps='GRS80')
+
+
+def distances_meters(x_1, y_1, x_2, y_2, crs='epsg:4269', mode='albers'):
+    """Measure distances in meters between pairs of points in one vectorized call.
+
+    Distance modes are
+
+    - ``'albers'``: Default, points are projected to CONUS Albers (crs 5070) and distances are the
+    lengths of the lines connecting each pair.  Distances are distorted away from the conterminous U.S.
+    (e.g. Alaska, Hawaii, Puerto Rico).
+    - ``'geodesic'``: Ellipsoidal (GRS80) distances calculated directly from NAD83 coordinates,
+    accurate everywhere but about three times slower than projecting for large arrays.
+
+    Parameters
+    ----------
+    x_1, y_1: array like
+        Coordinates of locations from which distance calculations are made
+    x_2, y_2: array like
+        Coordinates of locations to which distance calculations are made
+    crs: str, default = 'epsg:4269'
+        Coordinate reference system of all coordinates
+    mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances
+
+    Returns
+    ----------
+    distances: numpy.ndarray
+        Distances in meters
+
+    """
+    if mode not in DISTANCE_MODES:
+        raise ValueError(f'distance mode {mode} not supported, options include albers and geodesic')
+    if mode == 'geodesic':
+        x_1, y_1, x_2, y_2 = [np.asarray(c, dtype=float) for c in [x_1, y_1, x_2, y_2]]
+        if str(crs).lower() != 'epsg:4269':
+            transformer = get_transformer(crs, 'epsg:4269')
+            x_1, y_1 = transformer.transform(x_1, y_1)
+            x_2, y_2 = transformer.transform(x_2, y_2)
+        return np.asarray(get_geod().inv(x_1, y_1, x_2, y_2)[2])
+    transformer = get_transformer(crs, 'epsg:5070')
+    albers_x_1, albers_y_1 = transformer.transform(np.asarray(x_1, dtype=float), np.asarray(y_1, dtype=float))
+    albers_x_2, albers_y_2 = transformer.transform(np.asarray(x_2, dtype=float), np.asarray(y_2, dtype=float))
+    dx = albers_x_2 - albers_x_1
+    dy = albers_y_2 - albers_y_1
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def build_distance_line(point_1, point_2, crs='epsg:4269', distance_mode='albers'):
     """Build line from point1 to point2 an measure distance in meters.
 
     Parameters
@@ -218,6 +463,8 @@ def build_distance_line(point_1, point_2, crs='epsg:4269'):
     crs: str, default = 'epsg:4269'
         The value can be anything accepted by pyproj.CRS.from_user_input(), such as an
         authority string (eg “EPSG:4326”) or a WKT string.
+    distance_mode: {'albers', 'geodesic'}, default 'albers'
+        Method used to measure distances, see distances_meters
 
     Returns
     ----------
@@ -225,18 +472,14 @@ def build_distance_line(point_1, point_2, crs='epsg:4269'):
         Distance in meters
 
     """
-    line_geom = LineString([point_1, point_2])
-    line_geoseries = gpd.GeoSeries(line_geom)
-    line_geoseries.crs = crs
-    line_geoseries = line_geoseries.to_crs('epsg:5070')
-    line_length_meters = line_geoseries.length[0]
+    line_length_meters = float(distances_meters([point_1.x], [point_1.y], [point_2.x], [point_2.y], crs=crs, mode=distance_mode)[0])
     return line_length_meters
 
 
 def gnis_name_similarity(gnis_name, source_water_name):
-    """Similarity comparison of two names using difflib.
+    """Similarity comparison of two names using the name matcher (see set_name_matcher).
 
-    Measures similarity between two names using difflib
+    Measures similarity between two names, see gnis_names_similarity
     Returned dictionary has a measure of similarity called 'flowline name similarity'
 
     Parameters
@@ -254,55 +497,302 @@ def gnis_name_similarity(gnis_name, source_water_name):
         'flowline name similarity message' is a text representation of the similarity measure
 
     """
-    name_similarity = {}
-    if gnis_name is None and (source_water_name is None or source_water_name.isspace() or source_water_name.lower() == 'none'):
-        name_similarity.update({'flowline name similarity message': 'no source water name provided and no GNIS_NAME',
-                                'flowline name similarity': 0
-                                })
-    elif source_water_name is None or source_water_name.isspace() or source_water_name.lower() == 'none':
-        name_similarity.update({'flowline name similarity message': 'no source water name provided',
-                                'flowline name similarity': 0
-                                })
-    elif gnis_name is None:
-        name_similarity.update({'flowline name similarity message': 'no GNIS name',
-                                'cleaned source water name': source_water_name.lower(),
-                                'flowline name similarity': 0
-                                })
-    elif gnis_name.lower() == source_water_name.lower():
-        name_similarity.update({'flowline name similarity message': 'exact water name match',
-                                'cleaned source water name': source_water_name.lower(),
-                                'flowline name similarity': 1.0
-                                })
-    else:
-        cleaned_water_name = clean_water_name(source_water_name)
-        gnis = gnis_name.lower()
-        if 'tributary' not in cleaned_water_name and 'branch' not in cleaned_water_name:
-            match_ratio = difflib.SequenceMatcher(lambda x: x == " ", gnis, cleaned_water_name).ratio()
-            name_similarity.update({'cleaned source water name': cleaned_water_name,
-                                    'flowline name similarity': match_ratio
-                                    })
-            if match_ratio >= 0.75:
-                name_similarity.update({'flowline name similarity message': 'most likely match, based on fuzzy match'})
-            elif 0.75 > match_ratio >= 0.6:
-                name_similarity.update({'flowline name similarity message': 'likely match, based on fuzzy match'})
-            elif match_ratio < 0.6:
-                name_similarity.update({'flowline name similarity message': 'likely not a match, based on fuzzy match'})
+    return gnis_names_similarity([gnis_name], source_water_name)[0]
+
+
+def gnis_names_similarity(gnis_names, source_water_name):
+    """Similarity comparison of a source water name with the names of all candidate flowlines.
+
+    Fuzzy match ratios of all names are scored with one call of the name matcher, see name_similarity_ratios.
+
+    Parameters
+    ----------
+    gnis_names: list
+        names of water features as defined by USGS Geographic Names Information System, None where not named
+    source_water_name: str
+        name of water feature as defined by user
+
+    Returns
+    ----------
+    names_similarity: list
+        dictionary capturing measures of similarity for each of gnis_names, see gnis_name_similarity
+
+    """
+    gnis_names = list(gnis_names)
+    no_source_name = source_water_name is None or source_water_name.isspace() or source_water_name.lower() == 'none'
+    cleaned_water_name = None
+    names_similarity = []
+    fuzzy = []
+    for gnis_name in gnis_names:
+        if gnis_name is None and no_source_name:
+            names_similarity.append({'flowline name similarity message': 'no source water name provided and no GNIS_NAME',
+                                     'flowline name similarity': 0
+                                     })
+        elif no_source_name:
+            names_similarity.append({'flowline name similarity message': 'no source water name provided',
+                                     'flowline name similarity': 0
+                                     })
+        elif gnis_name is None:
+            names_similarity.append({'flowline name similarity message': 'no GNIS name',
+                                     'cleaned source water name': source_water_name.lower(),
+                                     'flowline name similarity': 0
+                                     })
+        elif gnis_name.lower() == source_water_name.lower():
+            names_similarity.append({'flowline name similarity message': 'exact water name match',
+                                     'cleaned source water name': source_water_name.lower(),
+                                     'flowline name similarity': 1.0
+                                     })
         else:
-            name_similarity.update({'cleaned source water name': cleaned_water_name,
-                                    'flowline name similarity message': 'tributary or branch in source water name, fuzzy match not conducted.',
-                                    'flowline name similarity': 0
-                                    })
+            if cleaned_water_name is None:
+                cleaned_water_name = clean_water_name(source_water_name)
+            if 'tributary' not in cleaned_water_name and 'branch' not in cleaned_water_name:
+                fuzzy.append(len(names_similarity))
+                names_similarity.append({'cleaned source water name': cleaned_water_name})
+            else:
+                names_similarity.append({'cleaned source water name': cleaned_water_name,
+                                         'flowline name similarity message': 'tributary or branch in source water name, fuzzy match not conducted.',
+                                         'flowline name similarity': 0
+                                         })
+
+    if len(fuzzy) > 0:
+        match_ratios = name_similarity_ratios([gnis_names[i].lower() for i in fuzzy], cleaned_water_name)
+        for i, match_ratio in zip(fuzzy, match_ratios):
+            names_similarity[i].update({'flowline name similarity': match_ratio,
+                                        'flowline name similarity message': similarity_message(match_ratio)
+                                        })
+
+    return names_similarity
+
+
+def similarity_message(match_ratio):
+    """Return text representation of a fuzzy match ratio."""
+    if match_ratio >= 0.75:
+        return 'most likely match, based on fuzzy match'
+    elif match_ratio >= 0.6:
+        return 'likely match, based on fuzzy match'
+    return 'likely not a match, based on fuzzy match'
+
+
+class NameMatcher:
+    """Interface for scoring similarity of names from 0 (no match) to 1 (exact match), see set_name_matcher."""
+
+    def ratio(self, name, other):
+        """Return similarity of name and other."""
+        raise NotImplementedError
+
+    def ratios(self, names, other):
+        """Return list of similarities of each of names and other."""
+        return [self.ratio(name, other) for name in names]
+
+
+class DifflibMatcher(NameMatcher):
+    """Scores names with difflib.SequenceMatcher, treating spaces as junk."""
+
+    def ratio(self, name, other):
+        """Return difflib similarity ratio of name and other."""
+        return difflib.SequenceMatcher(lambda x: x == " ", name, other).ratio()
+
+
+class RapidfuzzMatcher(NameMatcher):
+    """Scores names with rapidfuzz (normalized Indel similarity), compiled code scoring many names in one call.
+
+    Ratios are close to but not always the same as difflib ratios.  Requires rapidfuzz, which is not
+    installed with HydroLink (pip install rapidfuzz).
+    """
+
+    def __init__(self):
+        if rapidfuzz_fuzz is None:
+            raise ImportError('rapidfuzz is required for RapidfuzzMatcher, install with pip install rapidfuzz')
+
+    def ratio(self, name, other):
+        """Return rapidfuzz similarity ratio of name and other."""
+        return rapidfuzz_fuzz.ratio(name, other) / 100
+
+    def ratios(self, names, other):
+        """Return list of rapidfuzz similarity ratios of each of names and other, scored in one call."""
+        if len(names) == 0:
+            return []
+        return (rapidfuzz_process.cdist(names, [other], scorer=rapidfuzz_fuzz.ratio, dtype=np.float64)[:, 0] / 100).tolist()
+
+
+def default_name_matcher():
+    """Return DifflibMatcher, so similarity ratios do not depend on installed packages.
+
+    RapidfuzzMatcher is used only when set with set_name_matcher (hydrolinker --name_matcher=rapidfuzz).
+    """
+    return DifflibMatcher()
+
+
+# matcher used in name matching, see set_name_matcher
+name_matcher = default_name_matcher()
+
+
+def set_name_matcher(matcher=None):
+    """Use matcher to score name similarity in name matching.
+
+    Parameters
+    ----------
+    matcher: NameMatcher, optional
+        e.g. RapidfuzzMatcher() to score names with rapidfuzz. None restores default_name_matcher (difflib).
 
-    return name_similarity
+    """
+    global name_matcher
+    name_matcher = matcher if matcher is not None else default_name_matcher()
+    clear_name_caches()
+
+
+class SimilarityCache:
+    """Bounded least recently used cache of similarity ratios keyed by (GNIS name, cleaned source water name)."""
+
+    def __init__(self, maxsize=NAME_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._ratios = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached ratio for key, or None if not cached."""
+        with self._lock:
+            ratio = self._ratios.get(key)
+            if ratio is None:
+                self.misses += 1
+                return None
+            self._ratios.move_to_end(key)
+            self.hits += 1
+        return ratio
+
+    def set(self, key, ratio):
+        """Store ratio for key, removing the least recently used ratio when full."""
+        with self._lock:
+            self._ratios[key] = ratio
+            self._ratios.move_to_end(key)
+            if len(self._ratios) > self.maxsize:
+                self._ratios.popitem(last=False)
+
+    def stats(self):
+        """Return dictionary of hits, misses, entries and hit rate."""
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._ratios),
+                'hit_rate': self.hits / calls if calls > 0 else 0.0
+                }
+
+    def clear(self):
+        """Remove all ratios and reset stats."""
+        with self._lock:
+            self._ratios.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# similarity ratios shared by all HydroLink objects, see name_cache_stats
+similarity_cache = SimilarityCache()
+
+
+def name_similarity_ratios(gnis_names, cleaned_water_name):
+    """Return similarity ratios of lower case GNIS names and a cleaned source water name.
+
+    Results are memoized, the same names are compared for many points and candidate flowlines, see
+    name_cache_stats.  Names not cached are scored with one call of the name matcher.
+    """
+    match_ratios = [similarity_cache.get((gnis_name, cleaned_water_name)) for gnis_name in gnis_names]
+    missing = list(dict.fromkeys(gnis_name for gnis_name, ratio in zip(gnis_names, match_ratios) if ratio is None))
+    if len(missing) > 0:
+        scored = dict(zip(missing, name_matcher.ratios(missing, cleaned_water_name)))
+        for gnis_name, ratio in scored.items():
+            similarity_cache.set((gnis_name, cleaned_water_name), ratio)
+        match_ratios = [scored[gnis_name] if ratio is None else ratio for gnis_name, ratio in zip(gnis_names, match_ratios)]
+    return match_ratios
+
+
+def name_similarity_ratio(gnis_name, cleaned_water_name):
+    """Return similarity ratio of a lower case GNIS name and a cleaned source water name, see name_similarity_ratios."""
+    return name_similarity_ratios([gnis_name], cleaned_water_name)[0]
+
+
+# Abbreviations of water names and their expansions, see WaterNameCleaner
+ABBREVIATIONS = {'st': 'stream', 'st.': 'stream', 'str': 'stream', 'str.': 'stream',
+                 'rv': 'river', 'rv.': 'river',
+                 'unt': 'unnamed tributary',
+                 'trib': 'tributary', 'trib.': 'tributary', 'trib)': 'tributary',
+                 'ck': 'creek', 'ck.': 'creek',
+                 'br': 'branch', 'br.': 'branch'
+                 }
+
+
+class WaterNameCleaner:
+    """Expands abbreviations in water names with a table of rules compiled into one regular expression.
+
+    Names are lower cased, text in parentheses or brackets is removed and each whitespace separated
+    abbreviation in the table (e.g. 'st.') is replaced with its expansion (e.g. 'stream') in a single pass.
+    """
+
+    # text in parentheses or brackets
+    BRACKETS = re.compile(r"[\(\[].*?[\)\]]")
 
+    def __init__(self, rules=None):
+        """Compile abbreviation rules.
 
+        Parameters
+        ----------
+        rules: dictionary, optional
+            Abbreviations (lower case) and their expansions, added to (or replacing) ABBREVIATIONS
+
+        """
+        self.rules = dict(ABBREVIATIONS, **(rules or {}))
+        # longer abbreviations first so 'str.' is matched before 'str' and 'st'
+        alternation = '|'.join(re.escape(abbreviation) for abbreviation in sorted(self.rules, key=len, reverse=True))
+        self.pattern = re.compile(f'(?<= )(?:{alternation})(?= )')
+
+    def clean(self, name):
+        """Return name lower cased with text in brackets removed and abbreviations expanded."""
+        name_lower = self.BRACKETS.sub('', f' {name.lower()} ')
+        return self.pattern.sub(lambda match: self.rules[match.group(0)], name_lower).strip()
+
+    def clean_many(self, names):
+        """Return list of cleaned names, cleaning each distinct name once.
+
+        Parameters
+        ----------
+        names: iterable of str
+            e.g. a pandas.Series of source water names, missing names (None or NaN) are returned as None
+
+        """
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        # missing names have code -1
+        cleaned = np.array([self.clean(name) for name in uniques] + [None], dtype=object)
+        return cleaned[codes].tolist()
+
+
+# cleaner used by clean_water_name, see set_abbreviations
+water_name_cleaner = WaterNameCleaner()
+
+
+def set_abbreviations(rules=None):
+    """Use abbreviation rules, added to ABBREVIATIONS, in clean_water_name and name matching.
+
+    Parameters
+    ----------
+    rules: dictionary, optional
+        Abbreviations (lower case) and their expansions, e.g. {'crk': 'creek'}. None restores ABBREVIATIONS.
+
+    """
+    global water_name_cleaner
+    water_name_cleaner = WaterNameCleaner(rules)
+    clear_name_caches()
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
 def clean_water_name(name):
     """Quick and dirty approach to clean up unstandardized water names.
 
-    Replaces common abbreviations, and deals with unnneeded spaces.
+    Replaces common abbreviations (ABBREVIATIONS, see set_abbreviations), and deals with unnneeded spaces.
     This needs improvement but need to be careful not to replace unwanted strings.
     This step is implemented with the assumption that GNIS_NAME never contains abbreviations... something to verify.
     If you have a better way to do this let me know!!!!
+    Results are memoized, see name_cache_stats.
 
     Parameters
     ----------
@@ -315,24 +805,49 @@ def clean_water_name(name):
         resulting waterbody name with common abbreviations (hopefully) spelled out
 
     """
-    name_lower = f' {name.lower()} '
-    name_lower = re.sub(r"[\(\[].*?[\)\]]", "", name_lower)
-    name_lower = name_lower.replace(' st. ', ' stream ')
-    name_lower = name_lower.replace(' st ', ' stream ')
-    name_lower = name_lower.replace(' str ', ' stream ')
-    name_lower = name_lower.replace(' str. ', ' stream ')
-    name_lower = name_lower.replace(' rv. ', ' river ')
-    name_lower = name_lower.replace(' rv ', ' river ')
-    name_lower = name_lower.replace(' unt ', ' unnamed tributary ')
-    name_lower = name_lower.replace(' trib. ', ' tributary ')
-    name_lower = name_lower.replace(' trib) ', ' tributary ')
-    name_lower = name_lower.replace(' trib ', ' tributary ')
-    name_lower = name_lower.replace(' ck ', ' creek ')
-    name_lower = name_lower.replace(' ck. ', ' creek ')
-    name_lower = name_lower.replace(' br ', ' branch ')
-    name_lower = name_lower.replace(' br. ', ' branch ')
-    water_name_cleaned = name_lower.strip()
-    return water_name_cleaned
+    return water_name_cleaner.clean(name)
+
+
+def clean_water_names(names, rules=None):
+    """Clean many water names at once, e.g. a column of source water names, see clean_water_name.
+
+    Parameters
+    ----------
+    names: iterable of str
+        names of water features as defined by user
+    rules: dictionary, optional
+        Abbreviations and their expansions added to ABBREVIATIONS, default uses the rules of clean_water_name
+
+    Returns
+    ----------
+    water_names_cleaned: list of str
+        Cleaned names in the order of names, None for missing names (None or NaN)
+
+    """
+    cleaner = water_name_cleaner if rules is None else WaterNameCleaner(rules)
+    return cleaner.clean_many(names)
+
+
+def name_cache_stats():
+    """Return dictionary of hits, misses, size and hit rate of memoized name cleaning and similarity ratios.
+
+    Caches are shared by all HydroLink objects (nhd_hr.HighResPoint and nhd_mr.MedResPoint) in a program.
+    """
+    info = clean_water_name.cache_info()
+    calls = info.hits + info.misses
+    return {'clean_water_name': {'hits': info.hits,
+                                 'misses': info.misses,
+                                 'entries': info.currsize,
+                                 'hit_rate': info.hits / calls if calls > 0 else 0.0
+                                 },
+            'name_similarity_ratio': similarity_cache.stats()
+            }
+
+
+def clear_name_caches():
+    """Clear memoized name cleaning and similarity ratios, see name_cache_stats."""
+    clean_water_name.cache_clear()
+    similarity_cache.clear()
 
 
 def df_for_selection(flowlines_data):
@@ -348,7 +863,8 @@ def df_for_selection(flowlines_data):
     df: pandas dataframe
 
     """
-    df = (pd.DataFrame(flowlines_data)).sort_values(by=['meters from flowline'])
+    # stable sort, flowlines at the same distance keep their order as in selection.select_flowline
+    df = (pd.DataFrame(flowlines_data)).sort_values(by=['meters from flowline'], kind='mergesort')
     df = df.reset_index(drop=True)
     df['closest flowline order'] = df.index + 1
 
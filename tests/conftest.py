@@ -0,0 +1,85 @@
+"""Stand ins for requests and aiohttp sessions shared by tests.
+
+Backends other than backends.RestBackend are tested with backends.FixtureBackend.  These stand ins
+are used where the request itself is tested, e.g. sessions, throttling and asyncio requests.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+
+def load_flowlines_json():
+    """Return recorded flowline query response, tests/flowlines_json.json."""
+    with open('tests/flowlines_json.json') as f:
+        return json.load(f)
+
+
+class FixtureResponse:
+    """Stand in for requests.Response with status code, headers and JSON, raising data from json when data is an exception."""
+
+    def __init__(self, data=None, status_code=200, headers=None):
+        self.data = data if data is not None else {'features': []}
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self, **kwargs):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+class AsyncFixtureResponse(FixtureResponse):
+    """Stand in for aiohttp response, used as an async context manager."""
+
+    async def __aenter__(self):
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def json(self, **kwargs):
+        return super().json()
+
+
+class FixtureSession:
+    """Stand in for requests.Session recording requested urls.
+
+    Returns responses (or raises exceptions) in order when responses are given, otherwise the data of
+    the first of routes (url substring: data) found in the url, otherwise tests/flowlines_json.json.
+    """
+
+    def __init__(self, responses=None, routes=None, delay=0.0):
+        self.responses = list(responses) if responses is not None else None
+        self.routes = routes or {}
+        self.delay = delay
+        self.data = load_flowlines_json()
+        self.urls = []
+
+    def response(self, url):
+        """Return response of url, see class description."""
+        self.urls.append(url)
+        if self.responses is not None:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        for part, data in self.routes.items():
+            if part in url:
+                return FixtureResponse(data)
+        return FixtureResponse(self.data)
+
+    def get(self, url, **kwargs):
+        if self.delay > 0:
+            time.sleep(random.uniform(0, self.delay))
+        return self.response(url)
+
+
+class FixtureClientSession(FixtureSession):
+    """Stand in for aiohttp.ClientSession, see FixtureSession."""
+
+    def get(self, url, **kwargs):
+        response = self.response(url)
+        return AsyncFixtureResponse(response.data, response.status_code, response.headers)
@@ -0,0 +1,62 @@
+# !/usr/bin/env python
+
+"""Tests for `aio` module."""
+
+import asyncio
+import collections
+import threading
+from hydrolink import aio
+from hydrolink import nhd_mr
+from tests.conftest import FixtureClientSession
+
+Row = collections.namedtuple('Row', ['id', 'lat', 'lon', 'crs', 'stream'])
+
+# no NHDPlusV2 network flowlines are returned, so nonnetwork flowlines are queried
+NO_NETWORK_FLOWLINES = {nhd_mr.NETWORK_FLOWLINE_URL: {'features': []}}
+
+
+def test_hydrolink_many():
+    """HydroLink points with asyncio, keeping input order and using the nonnetwork fallback for nhdplusv2."""
+    rows = [Row(i, 42.7284, -84.5026, 4269, 'Red Cedar River') for i in range(5)]
+    rows.append(Row('bad', 0, 0, 4269, 'Red Cedar River'))
+
+    session = FixtureClientSession(routes=NO_NETWORK_FLOWLINES)
+    hydrolinks = asyncio.run(aio.hydrolink_many(rows, nhd_version='nhdhr', concurrency=2, session=session))
+    assert [h.source_id for h in hydrolinks] == [str(r.id) for r in rows]
+    assert all(h.status == 1 for h in hydrolinks[:-1]) and hydrolinks[-1].status == 0
+    assert hydrolinks[0].hydrolink_flowline['nhdhr flowline gnis name'] == 'Red Cedar River'
+    assert len(session.urls) == 5
+
+    session = FixtureClientSession(routes=NO_NETWORK_FLOWLINES)
+    hydrolinks = asyncio.run(aio.hydrolink_many(rows[:1], nhd_version='nhdplusv2', session=session))
+    assert [url.split('query?')[0][-12:] for url in session.urls] == ['MapServer/2/', 'MapServer/3/']
+    assert hydrolinks[0].status == 1
+
+
+def test_hydrolink_iter(monkeypatch):
+    """Points are started only max_pending ahead of the point yielded and are evaluated outside the event loop thread."""
+    threads = set()
+    evaluate_flowlines = aio.batch.evaluate_flowlines
+
+    def recording_evaluate(hydrolink, **kwargs):
+        threads.add(threading.current_thread())
+        return evaluate_flowlines(hydrolink, **kwargs)
+    monkeypatch.setattr(aio.batch, 'evaluate_flowlines', recording_evaluate)
+
+    read = []
+
+    def rows():
+        for i in range(20):
+            read.append(i)
+            yield Row(i, 42.7284, -84.5026, 4269, 'Red Cedar River')
+
+    async def run():
+        started = []
+        async for hydrolink in aio.hydrolink_iter(rows(), concurrency=2, max_pending=3, session=FixtureClientSession()):
+            started.append(len(read) - len(started))
+            assert hydrolink.status == 1
+        return started
+
+    assert max(asyncio.run(run())) <= 3
+    assert len(read) == 20
+    assert threading.main_thread() not in threads
@@ -0,0 +1,92 @@
+# !/usr/bin/env python
+
+"""Tests for `backends` and `mock_server` modules."""
+
+from urllib.parse import parse_qsl, urlsplit
+from hydrolink import backends
+from hydrolink import cache as hl_cache
+from hydrolink import mock_server
+from hydrolink import nhd_hr
+
+
+def test_fixture_backend():
+    """Responses are matched on query, then MapServer layer, ignoring host and parameter order."""
+    query_url = f'{nhd_hr.HEM_WATERBODY_URL}geometry=-84.5,42.7&f=json'
+    fixture = backends.FixtureBackend(responses={query_url: {'features': ['query']},
+                                                 nhd_hr.HEM_FLOWLINE_URL: {'features': ['layer']}})
+
+    mock_url = 'http://127.0.0.1:8000/arcgis/rest/services/HEM/NHDHigh/MapServer/2/query?f=json&geometry=-84.5,42.7'
+    assert fixture.request_json(mock_url) == {'features': ['query']}
+    assert fixture.request_json(f'{nhd_hr.HEM_FLOWLINE_URL}geometry=-84.5,42.7&f=json') == {'features': ['layer']}
+    assert fixture.request_json(f'{nhd_hr.HEM_WATERBODY_URL}geometry=-80,40&f=json') == {'features': []}
+    assert len(fixture.requests) == 3
+
+
+def test_cached_backend():
+    """Misses are requested from the wrapped backend and then answered from the cache."""
+    fixture = backends.FixtureBackend(default_response={'features': [1]})
+    cached = backends.build_backend(backend=fixture, cache=hl_cache.ResponseCache(':memory:'))
+    assert isinstance(cached, backends.CachedBackend)
+
+    url = f'{nhd_hr.HEM_FLOWLINE_URL}geometry=-84.5,42.7&f=json'
+    assert cached.request_json(url) == {'features': [1]}
+    assert cached.request_json(url) == {'features': [1]}
+    assert len(fixture.requests) == 1
+
+
+def test_rest_backend_service_url():
+    """base_url replaces scheme and host of queries."""
+    assert backends.RestBackend().service_url(nhd_hr.HEM_FLOWLINE_URL) == nhd_hr.HEM_FLOWLINE_URL
+    rest = backends.RestBackend(base_url='http://127.0.0.1:8000')
+    assert rest.service_url(f'{nhd_hr.HEM_FLOWLINE_URL}f=json') == 'http://127.0.0.1:8000/arcgis/rest/services/HEM/NHDHigh/MapServer/1/query?f=json'
+
+
+def test_mock_server():
+    """HydroLink through the mock server matches HydroLink from the recorded response."""
+    fixture = backends.FixtureBackend.from_file('tests/flowlines_json.json', url=nhd_hr.HEM_FLOWLINE_URL)
+    with mock_server.MockArcGISServer(backend=fixture, latency=0.01) as server:
+        hydrolink = nhd_hr.HighResPoint(1, 42.7284, -84.5026, water_name='Red Cedar River', backend=backends.RestBackend(base_url=server.url))
+        hydrolink.hydrolink_method(method='name_match', outfile_name=None)
+
+    assert hydrolink.status == 1
+    assert hydrolink.hydrolink_flowline['nhdhr flowline gnis name'] == 'Red Cedar River'
+    assert len(fixture.requests) == 1
+
+
+class TruncatingBackend(backends.QueryBackend):
+    """Answers queries with numbered features, at most max_record_count per response."""
+
+    def __init__(self, count=25, max_record_count=10):
+        self.count = count
+        self.max_record_count = max_record_count
+        self.requests = []
+
+    def request_json(self, url):
+        self.requests.append(url)
+        params = dict(parse_qsl(urlsplit(url).query))
+        if params.get('returnCountOnly') == 'true':
+            return {'count': self.count}
+        offset = int(params.get('resultOffset', 0))
+        end = min(self.count, offset + int(params.get('resultRecordCount', self.max_record_count)), offset + self.max_record_count)
+        return {'features': [{'attributes': {'id': i}} for i in range(offset, end)], 'exceededTransferLimit': end < self.count}
+
+
+def test_paged_backend():
+    """Truncated responses are completed with a count query and concurrent page queries."""
+    truncating = TruncatingBackend()
+    results = backends.PagedBackend(truncating).request_json(f'{nhd_hr.HEM_FLOWLINE_URL}f=JSON')
+    assert [f['attributes']['id'] for f in results['features']] == list(range(25))
+    assert 'exceededTransferLimit' not in results
+    assert len(truncating.requests) == 4
+
+    truncating = TruncatingBackend(count=5)
+    assert len(backends.PagedBackend(truncating).request_json(f'{nhd_hr.HEM_FLOWLINE_URL}f=JSON')['features']) == 5
+    assert len(truncating.requests) == 1
+
+    # responses with more pages than max_pages are not flagged complete
+    truncating = TruncatingBackend(count=45)
+    results = backends.PagedBackend(truncating, max_pages=3).request_json(f'{nhd_hr.HEM_FLOWLINE_URL}f=JSON')
+    assert [f['attributes']['id'] for f in results['features']] == list(range(30))
+    assert results['exceededTransferLimit'] is True and backends.is_truncated(results)
+
+    assert isinstance(backends.build_backend().backend, backends.RestBackend)
@@ -0,0 +1,147 @@
+# !/usr/bin/env python
+
+"""Tests for `batch` module."""
+
+import collections
+import csv
+import random
+import time
+import pandas as pd
+import pytest
+from hydrolink import batch
+from hydrolink import nhd_hr
+from hydrolink import output
+from hydrolink import utils
+from tests.conftest import FixtureSession, load_flowlines_json
+
+
+Row = collections.namedtuple('Row', ['id', 'lat', 'lon', 'crs', 'stream'])
+
+
+def test_prepare_rows():
+    """Rows are reprojected to NAD83 together and rows outside the United States are marked."""
+    x, y = utils.get_transformer('epsg:4269', 'epsg:3857').transform(-84.5026, 42.7284)
+    df = pd.DataFrame({'id': [1, 2, 3, 4], 'lat': [y, 0.0, 42.7284, 'missing'], 'lon': [x, 0.0, -84.5026, -84.5026],
+                       'crs': [3857, 3857, 4269, 4269], 'stream': ['Red Cedar River'] * 4})
+    prepared = batch.prepare_rows(df)
+    assert list(prepared['in_us_bounds']) == [True, False, True, False]
+    assert list(prepared['crs']) == [4269] * 4
+    assert float(prepared['lon'][0]) == pytest.approx(-84.5026, abs=1e-6)
+    assert float(prepared['lat'][0]) == pytest.approx(42.7284, abs=1e-6)
+    # input is not modified
+    assert df['crs'][0] == 3857
+
+    # rejected rows fail without requesting services, with the same message as the HydroLink classes
+    hydrolink = batch.build_point(next(prepared.iloc[[1]].itertuples()))
+    assert hydrolink.status == 0
+    assert 'outside of the bounding box' in hydrolink.message
+
+    # missing and text crs are not reprojected and do not fail other rows
+    df = pd.DataFrame({'id': [1, 2, 3], 'lat': [y, 42.7284, 42.7284], 'lon': [x, -84.5026, -84.5026],
+                       'crs': [3857, None, 'epsg:4326'], 'stream': ['Red Cedar River'] * 3})
+    prepared = batch.prepare_rows(df)
+    assert list(prepared['in_nad83']) == [True, False, False]
+    assert list(prepared['in_us_bounds']) == [True, False, False]
+
+
+def test_hydrolink_prepared_rows(tmp_path):
+    """Rejected rows are written with the messages of the HydroLink classes without HydroLinking, in input order."""
+    df = pd.DataFrame({'id': [1, 'outside', 3, 'crs', 'text'], 'lat': [42.7284, 0.0, 42.7284, 42.7284, 'missing'],
+                       'lon': [-84.5026, 0.0, -84.5026, -84.5026, -84.5026], 'crs': [4269, 4269, 4269, 'epsg:4326', 4269],
+                       'stream': ['Red Cedar River'] * 5})
+    session = FixtureSession()
+    # response with only the fields requested from the service
+    for feature in session.data['features']:
+        feature['attributes'] = {k: v for k, v in feature['attributes'].items() if k in nhd_hr.HEM_FLOWLINE_FIELDS.split(',')}
+    prepared = batch.prepare_rows(df)
+    hydrolinks = list(batch.hydrolink_prepared_rows(prepared, workers=2, session=session))
+    assert [h.source_id for h in hydrolinks] == ['1', 'outside', '3', 'crs', 'text']
+    assert [h.status for h in hydrolinks] == [1, 0, 1, 0, 0]
+    assert len(session.urls) == 2
+    assert all(isinstance(h, batch.RejectedPoint) for h in hydrolinks if h.status == 0)
+    for i in [1, 3, 4]:
+        assert hydrolinks[i].message == batch.build_point(next(df.iloc[[i]].itertuples())).message
+
+    tiled = list(batch.hydrolink_prepared_rows(prepared, tile_size_deg=0.05, session=FixtureSession()))
+    assert [h.status for h in tiled] == [1, 0, 1, 0, 0]
+
+    path = str(tmp_path / 'output.csv')
+    with output.open_writer(path) as writer:
+        for hydrolink in hydrolinks:
+            hydrolink.write_hydrolink(writer=writer)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['source id'] for row in rows] == ['1', 'outside', '3', 'crs', 'text']
+    assert rows[1]['hydrolink message'] == hydrolinks[1].message and rows[4]['source lat nad83'] == ''
+
+
+def test_ordered_map():
+    """Results are yielded in input order regardless of completion order."""
+    def slow_square(x):
+        time.sleep(random.uniform(0, 0.01))
+        return x * x
+
+    items = list(range(50))
+    assert list(batch.ordered_map(slow_square, items, workers=8, max_pending=5)) == [x * x for x in items]
+    assert list(batch.ordered_map(slow_square, items, workers=1)) == [x * x for x in items]
+
+
+def test_hydrolink_rows():
+    """HydroLink rows concurrently, keeping input order and per point error messages."""
+    rows = [Row(i, 42.7284, -84.5026, 4269, 'Red Cedar River') for i in range(10)]
+    rows.append(Row('bad', 0, 0, 4269, 'Red Cedar River'))
+    hydrolinks = list(batch.hydrolink_rows(rows, workers=4, session=FixtureSession(delay=0.01)))
+
+    assert [h.source_id for h in hydrolinks] == [str(r.id) for r in rows]
+    for hydrolink in hydrolinks[:-1]:
+        assert hydrolink.status == 1
+        assert hydrolink.hydrolink_flowline['nhdhr flowline gnis name'] == 'Red Cedar River'
+    assert hydrolinks[-1].status == 0
+    assert hydrolinks[-1].message == 'Coordinates for id: bad are outside of the bounding box of the United States.'
+
+    with pytest.raises(ValueError):
+        list(batch.hydrolink_rows(rows, method='farthest', session=FixtureSession()))
+
+
+def test_hydrolink_rows_tiled():
+    """Clustered points are HydroLinked with one envelope query and match HydroLinks from individual queries."""
+    rows = [Row(i, 42.7284 + i * 0.0002, -84.5026 - i * 0.0002, 4269, 'Red Cedar River') for i in range(10)]
+    rows.append(Row('bad', 0, 0, 4269, 'Red Cedar River'))
+
+    session = FixtureSession(delay=0.01)
+    tiled = list(batch.hydrolink_rows_tiled(rows, buffer_m=1500, workers=2, session=session))
+    individual = list(batch.hydrolink_rows(rows, buffer_m=1500, session=FixtureSession()))
+    assert len(session.urls) == 1 and 'esriGeometryEnvelope' in session.urls[0]
+    assert [h.source_id for h in tiled] == [str(r.id) for r in rows]
+    for tiled_hydrolink, hydrolink in zip(tiled[:-1], individual[:-1]):
+        assert tiled_hydrolink.status == 1
+        assert tiled_hydrolink.hydrolink_flowline == hydrolink.hydrolink_flowline
+        assert tiled_hydrolink.total_count_flowlines == hydrolink.total_count_flowlines
+    assert tiled[-1].status == 0
+
+    # flowlines of the tiled points are selected together, with the results of each point
+    tiled = list(batch.hydrolink_rows_tiled(rows, method='closest', buffer_m=1500, session=FixtureSession()))
+    individual = list(batch.hydrolink_rows(rows, method='closest', buffer_m=1500, session=FixtureSession()))
+    assert [(h.status, h.message) for h in tiled] == [(h.status, h.message) for h in individual]
+    assert [h.name_match_in_buffer for h in tiled[:-1]] == [h.name_match_in_buffer for h in individual[:-1]]
+
+    # features outside of a point buffer are not evaluated for that point
+    hydrolink = batch.build_point(rows[0], buffer_m=100)
+    selected = batch.features_within_buffer(session.data['features'], hydrolink)
+    assert 0 < len(selected) < len(session.data['features'])
+
+
+@pytest.mark.parametrize('distance_mode', ['albers', 'geodesic'])
+def test_features_within_buffer(distance_mode):
+    """Features selected with array operations on the tile's lines are those within the buffer measured for each path."""
+    features = load_flowlines_json()['features']
+    lines = batch.tile_lines(features)
+    for buffer_m in [10, 100, 500, 1500]:
+        for i in range(5):
+            hydrolink = batch.build_point(Row(i, 42.7284 + i * 0.001, -84.5026 - i * 0.001, 4269, 'Red Cedar River'), buffer_m=buffer_m,
+                                          distance_mode=distance_mode)
+            expected = [feature for feature in features
+                        if any(utils.point_to_line_meters(path, hydrolink.input_point, distance_mode=distance_mode)[1] <= buffer_m
+                               for path in feature['geometry']['paths'])]
+            assert batch.features_within_buffer(features, hydrolink, lines=lines) == expected
+    assert batch.features_within_buffer([], hydrolink) == []
@@ -0,0 +1,95 @@
+# !/usr/bin/env python
+
+"""Tests for `cache` module."""
+
+import json
+from hydrolink import cache
+from hydrolink import nhd_hr
+from tests.conftest import FixtureSession
+
+
+def test_normalize_url():
+    """Equivalent urls share a key."""
+    url_1 = 'HTTPS://Watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?f=JSON&geometry=-84.5,42.7'
+    url_2 = 'https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?geometry=-84.5,42.7&f=JSON'
+    assert cache.normalize_url(url_1) == cache.normalize_url(url_2)
+
+
+def test_response_cache(tmp_path):
+    """Verify hits, misses, expiry, eviction and persistence."""
+    path = str(tmp_path / 'cache.sqlite')
+    test_cache = cache.ResponseCache(path, ttl_seconds=None, max_bytes=None)
+    assert test_cache.get('https://example.com/query?a=1') is None
+    test_cache.set('https://example.com/query?a=1', {'features': [1, 2, 3]})
+    test_cache.set('https://example.com/query?a=2', {'error': {'code': 500}})
+    assert test_cache.get('https://example.com/query?a=1') == {'features': [1, 2, 3]}
+    assert test_cache.get('https://example.com/query?a=2') is None
+    assert test_cache.stats()['hits'] == 1 and test_cache.stats()['misses'] == 2
+    test_cache.close()
+
+    # responses persist on disk, expire after ttl
+    test_cache = cache.ResponseCache(path, ttl_seconds=None, max_bytes=None)
+    assert test_cache.get('https://example.com/query?a=1') == {'features': [1, 2, 3]}
+    test_cache.ttl_seconds = -1
+    assert test_cache.get('https://example.com/query?a=1') is None
+    assert test_cache.stats()['entries'] == 0
+
+    # least recently used responses are evicted when cache exceeds max_bytes
+    test_cache = cache.ResponseCache(':memory:', ttl_seconds=None, max_bytes=None)
+    for i in range(3):
+        test_cache.set(f'https://example.com/query?a={i}', {'features': list(range(100))})
+    test_cache.get('https://example.com/query?a=0')
+    test_cache.max_bytes = test_cache.total_bytes - 1
+    test_cache.set('https://example.com/query?a=3', {'features': list(range(100))})
+    assert test_cache.get('https://example.com/query?a=1') is None
+    assert test_cache.get('https://example.com/query?a=0') is not None
+    assert test_cache.stats()['evictions'] == 2 and test_cache.total_bytes <= test_cache.max_bytes
+
+
+def test_cache_hydrolink():
+    """Second HydroLink of the same point is answered from cache."""
+    session = FixtureSession()
+    test_cache = cache.ResponseCache(':memory:')
+    for i in range(2):
+        hydrolink = nhd_hr.HighResPoint(2, 42.7284, -84.5026, water_name='Red Cedar River', session=session, cache=test_cache)
+        hydrolink.hydrolink_method(outfile_name=None)
+        assert hydrolink.hydrolink_flowline['nhdhr flowline gnis name'] == 'Red Cedar River'
+    assert len(session.urls) == 1
+    assert test_cache.stats()['hits'] == 1
+
+
+def test_flowline_cache():
+    """Flowlines are held once per identifier as float arrays and least recently used flowlines are removed by size."""
+    with open('tests/flowlines_json.json') as f:
+        features = json.load(f)['features']
+    flowline_cache = cache.FlowlineCache()
+    flowlines = flowline_cache.flowlines(features)
+    assert flowlines[0].vertices.dtype == float
+    assert flowlines[0].vertices.flags['C_CONTIGUOUS']
+    assert flowlines[0].vertices.tolist() == features[0]['geometry']['paths'][0]
+    assert flowline_cache.flowlines(features)[0] is flowlines[0]
+    assert flowline_cache.stats()['hits'] == len(features)
+    assert flowline_cache.stats()['entries'] == len(features)
+
+    # cache holding about two flowlines keeps the most recently used
+    max_bytes = cache.flowline_bytes(flowlines[-1]) + cache.flowline_bytes(flowlines[-2])
+    small_cache = cache.FlowlineCache(max_bytes=max_bytes)
+    small_cache.flowlines(features)
+    assert small_cache.stats()['bytes'] <= max_bytes
+    assert small_cache.stats()['evictions'] == len(features) - small_cache.stats()['entries']
+    assert small_cache.get(cache.flowline_key(features[-1]['attributes'])) is not None
+    assert small_cache.get(cache.flowline_key(features[0]['attributes'])) is None
+
+
+def test_flowline_cache_hydrolink():
+    """HydroLinks are the same with flowlines held in a FlowlineCache."""
+    with open('tests/flowlines_json.json') as f:
+        flowlines_json = json.load(f)
+    results = []
+    for flowline_cache in [None, cache.FlowlineCache()]:
+        hydrolink = nhd_hr.HighResPoint(1, 42.7284, -84.5026, water_name='Red Cedar River', flowline_cache=flowline_cache)
+        hydrolink.set_flowlines(flowlines_json)
+        hydrolink.hydrolink_flowlines()
+        hydrolink.select_closest_flowline_w_name_match()
+        results.append((hydrolink.hydrolink_flowline, hydrolink.closest_confluence_meters))
+    assert results[0] == results[1]
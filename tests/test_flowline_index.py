@@ -0,0 +1,89 @@
+# !/usr/bin/env python
+
+"""Tests for `flowline_index` module."""
+
+import pytest
+from hydrolink import backends
+from hydrolink import flowline_index
+from hydrolink import nhd_hr
+
+
+def hydrolink_point(lat, lon, backend, buffer_m=1000):
+    """HydroLink point to the closest flowline without writing output."""
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, buffer_m=buffer_m, backend=backend)
+    hydrolink.hydrolink_method(method='closest', outfile_name=None)
+    return hydrolink
+
+
+def test_parse_buffer_query():
+    """Buffered point queries are parsed, other queries are not."""
+    hydrolink = nhd_hr.HighResPoint(1, 42.7284, -84.5026, buffer_m=500)
+    hydrolink.build_nhd_query()
+    key, lon, lat, distance = flowline_index.parse_buffer_query(hydrolink.flowline_query)
+    assert (lon, lat, distance) == (-84.5026, 42.7284, 500.0)
+    assert key[0] == '/arcgis/rest/services/HEM/NHDHigh/MapServer/1/query'
+    assert 'geometry' not in dict(key[1])
+    assert flowline_index.parse_buffer_query(hydrolink.waterbody_query) is None
+
+
+@pytest.mark.parametrize('cell_size', [flowline_index.CELL_SIZE, 300.0])
+def test_flowline_index(monkeypatch, cell_size):
+    """Queries covered by fetched buffers are answered from the index with the same HydroLink, also when buffers span cells."""
+    monkeypatch.setattr(flowline_index, 'CELL_SIZE', cell_size)
+    fixture = backends.FixtureBackend.from_file('tests/flowlines_json.json')
+    index = flowline_index.FlowlineIndex(fixture)
+
+    first = hydrolink_point(42.7284, -84.5026, index, buffer_m=2000)
+    assert len(fixture.requests) == 1
+    assert index.stats() == {'hits': 0, 'misses': 1, 'flowlines': 6, 'evictions': 0}
+
+    # buffer of nearby point is within the first buffer
+    nearby = hydrolink_point(42.7290, -84.5030, index)
+    assert len(fixture.requests) == 1
+    assert index.stats()['hits'] == 1
+    direct = hydrolink_point(42.7290, -84.5030, backends.FixtureBackend.from_file('tests/flowlines_json.json'))
+    assert nearby.hydrolink_flowline['nhdhr flowline permanent identifier'] == direct.hydrolink_flowline['nhdhr flowline permanent identifier']
+    assert nearby.hydrolink_flowline['nhdhr flowline measure'] == direct.hydrolink_flowline['nhdhr flowline measure']
+    assert first.hydrolink_flowline['nhdhr flowline permanent identifier'] == direct.hydrolink_flowline['nhdhr flowline permanent identifier']
+
+    # buffer extending past fetched buffers is requested, flowlines are not duplicated
+    hydrolink_point(42.7284, -84.4800, index)
+    assert len(fixture.requests) == 2
+    assert index.stats() == {'hits': 1, 'misses': 2, 'flowlines': 6, 'evictions': 0}
+
+
+def test_flowline_index_skips_incomplete_responses():
+    """Truncated and error responses are not added to the index."""
+    hydrolink = nhd_hr.HighResPoint(1, 42.7284, -84.5026)
+    hydrolink.build_nhd_query()
+    index = flowline_index.FlowlineIndex(backends.FixtureBackend())
+    index.add(hydrolink.flowline_query, {'features': [{'attributes': {'permanent_identifier': '1'}, 'geometry': {'paths': [[[0, 0], [1, 1]]]}}],
+                                         'exceededTransferLimit': True})
+    index.add(hydrolink.flowline_query, {'error': {'code': 500}})
+    assert index.layers == {} and len(index.cells) == 0
+    assert index.lookup(hydrolink.flowline_query) is None
+
+
+def point_query(lat, lon, buffer_m=1000):
+    """Buffered flowline query of a point."""
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, buffer_m=buffer_m)
+    hydrolink.build_nhd_query()
+    return hydrolink.flowline_query
+
+
+def flowline_response(ids, lat, lon):
+    """Response of flowlines through a point."""
+    return {'features': [{'attributes': {'permanent_identifier': i}, 'geometry': {'paths': [[[lon - 0.001, lat, 0], [lon + 0.001, lat, 1]]]}}
+                         for i in ids]}
+
+
+def test_flowline_index_eviction():
+    """Least recently used cells and their flowlines are removed when the index holds more than max_flowlines."""
+    index = flowline_index.FlowlineIndex(backends.FixtureBackend(), max_flowlines=2)
+    index.add(point_query(42.7284, -84.5026), flowline_response(['1', '2'], 42.7284, -84.5026))
+    assert [f['attributes']['permanent_identifier'] for f in index.lookup(point_query(42.7284, -84.5026, 500))['features']] == ['1', '2']
+
+    index.add(point_query(44.0, -90.0), flowline_response(['3'], 44.0, -90.0))
+    assert index.stats()['flowlines'] == 1 and index.stats()['evictions'] >= 1
+    assert index.lookup(point_query(42.7284, -84.5026, 500)) is None
+    assert len(index.lookup(point_query(44.0, -90.0, 500))['features']) == 1
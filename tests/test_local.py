@@ -0,0 +1,84 @@
+# !/usr/bin/env python
+
+"""Tests for `local` module."""
+
+import json
+import geopandas as gpd
+import pytest
+import shapely
+from hydrolink import local
+from hydrolink import nhd_hr
+
+lon, lat = -84.5026, 42.7284
+
+
+def flowlines_gdf():
+    """Build flowlines GeoDataFrame with M values from tests/flowlines_json.json (1500 m buffer of lon, lat)."""
+    with open('tests/flowlines_json.json') as f:
+        flowlines_json = json.load(f)
+    records = [dict(f['attributes'], ftype=460, wbarea_permanent_identifier=None) for f in flowlines_json['features']]
+    geometry = [shapely.from_wkt('LINESTRING M (' + ', '.join(' '.join(str(c) for c in x) for x in f['geometry']['paths'][0]) + ')')
+                for f in flowlines_json['features']]
+    gdf = gpd.GeoDataFrame(records, geometry=geometry, crs='epsg:4269')
+    # identify flowlines of a waterbody around the Red Cedar River
+    gdf.loc[gdf['gnis_name'] == 'Red Cedar River', 'wbarea_permanent_identifier'] = 'wb1'
+    return gdf, flowlines_json
+
+
+def waterbodies_gdf():
+    """Build waterbody GeoDataFrame with a single polygon around lon, lat."""
+    return gpd.GeoDataFrame({'permanent_identifier': ['wb1'], 'gnis_name': ['Test Lake'], 'ftype': [390], 'reachcode': ['04050004000001']},
+                            geometry=[shapely.box(lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01)], crs='epsg:4269')
+
+
+def test_local_flowline_query():
+    """Buffered flowline query returns features shaped like the service response, with M values."""
+    gdf, flowlines_json = flowlines_gdf()
+    local_nhd = local.LocalNHD(gdf)
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, buffer_m=1500, backend=local_nhd)
+    hydrolink.build_nhd_query(query=['hem_flowline'])
+    results = local_nhd.request_json(hydrolink.flowline_query)
+
+    service_ids = sorted(f['attributes']['permanent_identifier'] for f in flowlines_json['features'])
+    local_ids = sorted(f['attributes']['permanent_identifier'] for f in results['features'])
+    assert local_ids == service_ids
+    feature = results['features'][0]
+    assert list(feature['attributes'].keys()) == ['gnis_name', 'lengthkm', 'permanent_identifier', 'reachcode']
+    assert len(feature['geometry']['paths'][0][0]) == 3
+
+    # smaller buffer returns fewer flowlines
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, buffer_m=100, backend=local_nhd)
+    hydrolink.build_nhd_query(query=['hem_flowline'])
+    assert 0 < len(local_nhd.request_json(hydrolink.flowline_query)['features']) < len(service_ids)
+
+    # envelope queries return flowlines intersecting envelope
+    results = local_nhd.request_json(nhd_hr.build_envelope_query(lon - 1, lat - 1, lon + 1, lat + 1))
+    assert len(results['features']) == len(service_ids)
+
+
+def test_local_hydrolink():
+    """HydroLink with local data, including waterbody queries."""
+    gdf, flowlines_json = flowlines_gdf()
+    local_nhd = local.LocalNHD(gdf, waterbodies=waterbodies_gdf())
+
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, water_name='Red Cedar River', buffer_m=1500, backend=local_nhd)
+    hydrolink.hydrolink_method(outfile_name=None)
+    assert hydrolink.status == 1
+    assert hydrolink.hydrolink_flowline['nhdhr flowline gnis name'] == 'Red Cedar River'
+
+    hydrolink = nhd_hr.HighResPoint(1, lat, lon, buffer_m=1500, backend=local_nhd)
+    hydrolink.hydrolink_method(method='closest', hydro_type='waterbody', outfile_name=None)
+    assert hydrolink.hydrolink_waterbody['nhdhr waterbody permanent identifier'] == 'wb1'
+    assert all(f['attributes']['gnis_name'] == 'Red Cedar River' for f in hydrolink.flowlines_json['features'])
+
+
+def test_read_geopackage(tmp_path):
+    """GeoPackage layers are read directly, flowlines without M values are rejected."""
+    gdf, flowlines_json = flowlines_gdf()
+    path = str(tmp_path / 'nhd.gpkg')
+    gpd.GeoDataFrame(gdf.drop(columns='geometry'), geometry=shapely.force_2d(gdf.geometry.values), crs='epsg:4269').to_file(path, layer='NHDFlowline', driver='GPKG')
+    read_gdf = local.read_geopackage(path)
+    assert list(read_gdf['permanent_identifier']) == list(gdf['permanent_identifier'])
+    assert read_gdf.geometry.values[0].equals(shapely.force_2d(gdf.geometry.values[0]))
+    with pytest.raises(ValueError):
+        local.LocalNHD(path)
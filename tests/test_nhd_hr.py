@@ -3,6 +3,7 @@
 """Tests for `utils` package."""
 
 import pytest
+from hydrolink import backends
 from hydrolink import nhd_hr
 import requests
 import validators
@@ -109,3 +110,18 @@ def test_addressing():
             # hl_reach_meas = hr_xy['features'][0]['attributes']
             meas = hr_xy['features'][0]['attributes']['MEASURE']
         assert nhdhr_meas == meas
+
+
+def test_distance_mode():
+    """Unsupported distance modes set status to 0, geodesic HydroLinks match albers HydroLinks."""
+    bad_mode = nhd_hr.HighResPoint(ident, good_lat, good_lon, distance_mode='planar')
+    assert bad_mode.status == 0
+    assert bad_mode.message == 'distance_mode planar not supported, options include albers and geodesic.'
+
+    fixture = backends.FixtureBackend.from_file('tests/flowlines_json.json')
+    hydrolinks = {}
+    for mode in ['albers', 'geodesic']:
+        hydrolinks[mode] = nhd_hr.HighResPoint(ident, good_lat, good_lon, water_name='Red Cedar River', backend=fixture, distance_mode=mode)
+        hydrolinks[mode].hydrolink_method(outfile_name=None)
+    assert hydrolinks['albers'].hydrolink_flowline['nhdhr flowline permanent identifier'] == hydrolinks['geodesic'].hydrolink_flowline['nhdhr flowline permanent identifier']
+    assert hydrolinks['geodesic'].closest_confluence_meters == pytest.approx(hydrolinks['albers'].closest_confluence_meters, rel=0.01)
@@ -2,7 +2,9 @@
 
 """Tests for `nhd_mr` package."""
 
+import json
 import pytest
+from hydrolink import backends
 from hydrolink import nhd_mr
 import validators
 
@@ -59,3 +61,33 @@ def test_input_coordinates():
         # bad lon should set status to 0 (fail)
         us_bounds_test = nhd_mr.MedResPoint(ident, good_lat, bad_lon, buffer_m=buffer)
         assert us_bounds_test.status == 0 and us_bounds_test.message == m
+
+
+def test_combine_nonnetwork():
+    """Network and nonnetwork flowlines are combined, fallback queries nonnetwork only when no network flowlines are returned."""
+    with open('tests/flowlines_json.json') as f:
+        features = json.load(f)['features']
+    fixture = backends.FixtureBackend(responses={nhd_mr.NETWORK_FLOWLINE_URL: {'features': features[:4]},
+                                                 nhd_mr.NONNETWORK_FLOWLINE_URL: {'features': features[4:]}})
+
+    combined = nhd_mr.MedResPoint(ident, good_lat, good_lon, backend=fixture, combine_nonnetwork=True)
+    combined.build_nhd_query(query=['network_flow'])
+    combined.query_flowlines()
+    assert len(combined.flowlines_json['features']) == len(features)
+    assert len(fixture.requests) == 2
+
+    fallback = nhd_mr.MedResPoint(ident, good_lat, good_lon, backend=fixture)
+    fallback.build_nhd_query(query=['network_flow'])
+    fallback.query_flowlines()
+    assert len(fallback.flowlines_json['features']) == 4
+    assert len(fixture.requests) == 3
+
+    assert nhd_mr.combine_flowlines({'error': {'code': 500}}, {'features': []}) == {'error': {'code': 500}}
+    # failed nonnetwork query falls back to network flowlines
+    assert nhd_mr.combine_flowlines({'features': features[:4]}, {'error': {'code': 500}}) == {'features': features[:4]}
+    failed = backends.FixtureBackend(responses={nhd_mr.NETWORK_FLOWLINE_URL: {'features': features[:4]},
+                                                nhd_mr.NONNETWORK_FLOWLINE_URL: {'error': {'code': 500}}})
+    fallback = nhd_mr.MedResPoint(ident, good_lat, good_lon, backend=failed, combine_nonnetwork=True)
+    fallback.build_nhd_query(query=['network_flow'])
+    fallback.query_flowlines()
+    assert len(fallback.flowlines_json['features']) == 4 and fallback.status == 1
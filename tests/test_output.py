@@ -0,0 +1,112 @@
+# !/usr/bin/env python
+
+"""Tests for `output` module."""
+
+import csv
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from hydrolink import backends
+from hydrolink import nhd_hr
+from hydrolink import output
+import pytest
+
+
+def read_rows(path):
+    """Read rows of CSV output file."""
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_csv_writer(tmp_path):
+    """Rows are buffered and written in batches, with the header written once."""
+    path = str(tmp_path / 'output.csv')
+    with output.CSVWriter(path, ['source id', 'hydrolink message'], batch_size=3) as writer:
+        writer.write({'source id': 1})
+        writer.write({'source id': 2})
+        assert read_rows(path) == []
+        writer.write({'source id': 3})
+        assert len(read_rows(path)) == 3
+        writer.write({'source id': 4})
+    assert [row['source id'] for row in read_rows(path)] == ['1', '2', '3', '4']
+
+    # existing file is appended without a second header
+    with output.CSVWriter(path, ['source id', 'hydrolink message']) as writer:
+        writer.write({'source id': 5, 'hydrolink message': 'appended'})
+    rows = read_rows(path)
+    assert len(rows) == 5 and rows[-1] == {'source id': '5', 'hydrolink message': 'appended'}
+
+
+def test_csv_writer_threads(tmp_path):
+    """Rows written from worker threads are all written whole."""
+    path = str(tmp_path / 'output.csv')
+    with output.CSVWriter(path, ['source id', 'hydrolink message'], batch_size=7) as writer:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: writer.write({'source id': i, 'hydrolink message': 'x' * 100}), range(1000)))
+    rows = read_rows(path)
+    assert sorted(int(row['source id']) for row in rows) == list(range(1000))
+    assert all(row['hydrolink message'] == 'x' * 100 for row in rows)
+
+
+def test_write_hydrolink(tmp_path):
+    """Output written with a shared writer matches output written one row at a time."""
+    # response with only the fields requested from the service
+    with open('tests/flowlines_json.json') as f:
+        flowlines_json = json.load(f)
+    for feature in flowlines_json['features']:
+        feature['attributes'] = {k: v for k, v in feature['attributes'].items() if k in nhd_hr.HEM_FLOWLINE_FIELDS.split(',')}
+    fixture = backends.FixtureBackend(default_response=flowlines_json)
+    hydrolinks = [nhd_hr.HighResPoint(1, 42.7284, -84.5026, water_name='Red Cedar River', backend=fixture),
+                  nhd_hr.HighResPoint(2, 0, 0)]
+    per_row = str(tmp_path / 'per_row.csv')
+    for hydrolink in hydrolinks:
+        hydrolink.hydrolink_method(outfile_name=per_row)
+
+    shared = str(tmp_path / 'shared.csv')
+    with output.CSVWriter(shared, output.FIELD_NAMES['nhdhr']) as writer:
+        for hydrolink in hydrolinks:
+            hydrolink.write_hydrolink(writer=writer)
+    assert read_rows(shared) == read_rows(per_row)
+    assert list(read_rows(shared)[0]) == output.FIELD_NAMES['nhdhr']
+    assert read_rows(shared)[0]['nhdhr flowline permanent identifier'] != ''
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_arrow_writers(tmp_path, output_format):
+    """Rows are written as typed record batches, with the same schema whichever fields rows include."""
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet
+    path = str(tmp_path / f'output.{output_format}')
+    rows = [{'source id': 1, 'source lat nad83': 42.7284, 'closest flowline order': 1.0, 'nhdplusv2 comid': 12345,
+             'meters from flowline': math.nan, 'hydrolink message': ''},
+            {'source id': 'a', 'source lat nad83': 0, 'hydrolink message': 'failed'},
+            {'source id': 3, 'nhdplusv2 waterbody ftype': 'LakePond', 'nhdplusv2 terminal flag': 0}]
+    with output.open_writer(path, nhd_version='nhdplusv2', output_format=output_format, batch_size=2) as writer:
+        for row in rows:
+            writer.write(row)
+
+    if output_format == 'parquet':
+        metadata = pyarrow.parquet.ParquetFile(path).metadata
+        assert metadata.num_row_groups == 2
+        table = pyarrow.parquet.read_table(path)
+    else:
+        table = pyarrow.ipc.open_file(path).read_all()
+    assert table.schema == output.arrow_schema('nhdplusv2')
+    assert table.column_names == output.FIELD_NAMES['nhdplusv2']
+    assert table.schema.field('nhdplusv2 comid').type == pyarrow.int64()
+    assert table.schema.field('nhdplusv2 flowline measure').type == pyarrow.float64()
+    assert table.schema.field('nhdplusv2 flowline reachcode').type == pyarrow.string()
+    records = table.to_pylist()
+    assert [r['source id'] for r in records] == ['1', 'a', '3']
+    assert records[0]['closest flowline order'] == 1 and records[0]['meters from flowline'] is None
+    assert records[1]['source lat nad83'] == 0.0 and records[1]['nhdplusv2 comid'] is None
+    assert records[2]['nhdplusv2 waterbody ftype'] == 'LakePond' and records[2]['nhdplusv2 terminal flag'] == 0
+
+
+def test_open_writer(tmp_path):
+    """Unsupported formats are rejected, csv output is written with the fields of the NHD version."""
+    with pytest.raises(ValueError):
+        output.open_writer(str(tmp_path / 'output.txt'), output_format='txt')
+    with output.open_writer(str(tmp_path / 'output.csv'), nhd_version='nhdplusv2') as writer:
+        assert isinstance(writer, output.CSVWriter) and writer.field_names == output.FIELD_NAMES['nhdplusv2']
@@ -0,0 +1,173 @@
+# !/usr/bin/env python
+
+"""Tests for `selection` module."""
+
+import json
+import math
+import random
+import pandas as pd
+import pytest
+from hydrolink import nhd_hr
+from hydrolink import selection
+from hydrolink import utils
+
+
+def pandas_selection(flowlines_data, method, similarity_cutoff=0.6):
+    """Selection with utils.df_for_selection, as made before the selection module, returns (position in flowlines_data, order, tie)."""
+    df = utils.df_for_selection([dict(f, position=i) for i, f in enumerate(flowlines_data)])
+    if method == 'name_match':
+        df_1 = df.loc[df['flowline name similarity'] == 1.0]
+        df_similarity = df.loc[df['flowline name similarity'] >= similarity_cutoff]
+        df = df_1 if df_1.shape[0] > 0 else df_similarity if df_similarity.shape[0] > 0 else df
+    df = df.nsmallest(1, 'meters from flowline', keep='all')
+    if df.shape[0] > 1:
+        return None, None, True
+    return int(df['position'].iloc[0]), int(df['closest flowline order'].iloc[0]), False
+
+
+def expected_record(flowlines_data, position, order):
+    """Selected record with the documented types, see selection.selection_record."""
+    fields = dict.fromkeys(field for record in flowlines_data for field in record)
+    record = {}
+    for field in fields:
+        value = flowlines_data[position].get(field)
+        if field in selection.FLOAT_FIELDS:
+            value = math.nan if value is None else float(value)
+        record[selection.RENAME_COLUMNS['nhdhr'].get(field, field)] = value
+    record['closest flowline order'] = order
+    return record
+
+
+def same_record(a, b):
+    """Compare records treating NaN values as equal."""
+    assert list(a) == list(b)
+    for key in a:
+        if isinstance(a[key], float) and math.isnan(a[key]):
+            assert isinstance(b[key], float) and math.isnan(b[key])
+        else:
+            assert a[key] == b[key] and type(a[key]) == type(b[key])
+
+
+def random_flowlines(rng):
+    """Random candidate flowline records shaped like utils.build_flowlines_details output."""
+    flowlines_data = []
+    for i in range(rng.randint(1, 12)):
+        similarity = rng.choice([0, 0.5, 0.65, 0.8, 1.0])
+        record = {'gnis_name': rng.choice([None, 'Red Cedar River', 'Cedar Creek']),
+                  'lengthkm': rng.choice([1, 0.5, None]),
+                  'permanent_identifier': str(i),
+                  'reachcode': '04050004000126',
+                  'flowline name similarity message': 'message',
+                  'flowline name similarity': similarity,
+                  'meters from flowline': float(rng.choice([5, 10, 10.5, 20, 40, 60])),
+                  'nhdhr flowline measure': rng.choice([10.5, None])
+                  }
+        if similarity > 0:
+            record['cleaned source water name'] = 'red cedar river'
+        flowlines_data.append(record)
+    return flowlines_data
+
+
+@pytest.mark.parametrize('method', ['closest', 'name_match'])
+def test_select_flowline(method):
+    """Selections match those made with pandas DataFrames."""
+    rng = random.Random(3)
+    for _ in range(300):
+        flowlines_data = random_flowlines(rng)
+        # exact name matches are selected, tested in test_select_exact_match
+        if method == 'name_match' and sum(f['flowline name similarity'] == 1.0 for f in flowlines_data) == 1:
+            continue
+        result = selection.select_flowline(flowlines_data, method=method)
+        position, order, tie = pandas_selection(flowlines_data, method)
+        assert result.tie == tie
+        assert result.total_count == len(flowlines_data)
+        assert result.name_match_count == sum(f['flowline name similarity'] >= 0.6 for f in flowlines_data)
+        if not tie:
+            same_record(result.flowline, expected_record(flowlines_data, position, order))
+
+
+def test_selection_record_types():
+    """Float fields are floats with NaN for missing values, other missing values are None."""
+    flowlines_data = [{'gnis_name': None, 'lengthkm': None, 'comid': 5, 'flowline name similarity': 0, 'meters from flowline': 5.0},
+                      {'gnis_name': 'Red Cedar River', 'lengthkm': 1, 'flowline name similarity': 1.0, 'meters from flowline': 50.0,
+                       'cleaned source water name': 'red cedar river'}]
+    flowline = selection.select_flowline(flowlines_data, 'nhdplusv2', method='closest').flowline
+    assert flowline['nhdplusv2 flowline gnis name'] is None and flowline['cleaned source water name'] is None
+    assert math.isnan(flowline['nhdplusv2 flowline length km'])
+    assert flowline['nhdplusv2 comid'] == 5 and flowline['flowline name similarity'] == 0.0
+    flowline = selection.select_flowline(flowlines_data, 'nhdplusv2').flowline
+    assert flowline['nhdplusv2 flowline length km'] == 1.0 and isinstance(flowline['nhdplusv2 flowline length km'], float)
+    assert flowline['nhdplusv2 comid'] is None
+
+
+def test_select_exact_match():
+    """The only flowline with an exact name match is selected even when another flowline is closer."""
+    flowlines_data = [{'gnis_name': 'Cedar Creek', 'flowline name similarity': 0.7, 'meters from flowline': 5.0},
+                      {'gnis_name': 'Red Cedar River', 'flowline name similarity': 1.0, 'meters from flowline': 50.0}]
+    result = selection.select_flowline(flowlines_data, 'nhdplusv2')
+    assert result.flowline == {'nhdplusv2 flowline gnis name': 'Red Cedar River', 'flowline name similarity': 1.0,
+                               'meters from flowline': 50.0, 'closest flowline order': 2}
+    assert selection.select_flowline(flowlines_data, method='closest').flowline['nhdhr flowline gnis name'] == 'Cedar Creek'
+
+
+@pytest.mark.parametrize('method', ['closest', 'name_match'])
+def test_select_flowlines(method):
+    """Selections of many points from one table match selections of each point."""
+    rng = random.Random(5)
+    points = {}
+    for i in range(100):
+        flowlines_data = random_flowlines(rng)
+        if i % 10 == 0:
+            flowlines_data.append(dict(flowlines_data[0]))
+        points[f'point {i}'] = flowlines_data
+
+    candidates = pd.DataFrame([dict(f, **{'source id': source_id}) for source_id, flowlines_data in points.items() for f in flowlines_data])
+    selections = selection.select_flowlines(candidates, method=method).set_index('source id')
+    assert len(selections) == len(points)
+    for source_id, flowlines_data in points.items():
+        expected = selection.select_flowline(flowlines_data, method=method)
+        result = selections.loc[source_id]
+        assert result['tie'] == expected.tie
+        assert result['total count flowlines in buffer'] == expected.total_count
+        assert result['name match count'] == expected.name_match_count
+        if expected.tie:
+            assert pd.isna(result['nhdhr flowline permanent identifier'])
+        else:
+            assert result['nhdhr flowline permanent identifier'] == expected.flowline['nhdhr flowline permanent identifier']
+            assert result['closest flowline order'] == expected.flowline['closest flowline order']
+            assert result['meters from flowline'] == expected.flowline['meters from flowline']
+
+
+@pytest.mark.parametrize('method', ['closest', 'name_match'])
+def test_select_many(method):
+    """Selections of many points made together are those of select_flowline for each point."""
+    rng = random.Random(7)
+    points = [random_flowlines(rng) for _ in range(200)] + [[]]
+    for expected, result in zip([selection.select_flowline(p, method=method) for p in points], selection.select_many(points, method=method)):
+        assert result[1:] == expected[1:]
+        if expected.flowline is None:
+            assert result.flowline is None
+        else:
+            same_record(result.flowline, expected.flowline)
+    assert selection.select_many([], method=method) == []
+
+
+def test_candidates_table():
+    """Candidates of HydroLink objects are collected in one table and selected as by the objects."""
+    with open('tests/flowlines_json.json') as f:
+        flowlines_json = json.load(f)
+    hydrolinks = []
+    for i, water_name in enumerate(['Red Cedar River', None, 'Cedar']):
+        hydrolink = nhd_hr.HighResPoint(i, 42.7284 + i * 0.001, -84.5026, water_name=water_name)
+        hydrolink.set_flowlines(flowlines_json)
+        hydrolink.hydrolink_flowlines()
+        hydrolinks.append(hydrolink)
+    candidates = selection.candidates_table(hydrolinks)
+    assert len(candidates) == 3 * len(flowlines_json['features'])
+
+    selections = selection.select_flowlines(candidates).set_index('source id')
+    for hydrolink in hydrolinks:
+        hydrolink.select_closest_flowline_w_name_match()
+        result = selections.loc[hydrolink.source_id]
+        assert result['nhdhr flowline permanent identifier'] == hydrolink.hydrolink_flowline['nhdhr flowline permanent identifier']
+        assert result['nhdhr flowline measure'] == hydrolink.hydrolink_flowline['nhdhr flowline measure']
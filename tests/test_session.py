@@ -0,0 +1,34 @@
+# !/usr/bin/env python
+
+"""Tests for `session` module."""
+
+import requests
+from hydrolink import session
+from hydrolink import nhd_hr
+from hydrolink import nhd_mr
+
+
+def test_build_session():
+    """Verify adapters are mounted per host with configured pool size and timeout."""
+    host_config = {'https://watersgeo.epa.gov': {'pool_maxsize': 4, 'timeout': 5}}
+    test_session = session.build_session(pool_maxsize=2, timeout=30, host_config=host_config)
+    assert isinstance(test_session, requests.Session)
+
+    adapter = test_session.get_adapter('https://watersgeo.epa.gov/arcgis/rest/services/NHDPlus/NHDPlus/MapServer/2/query?')
+    assert isinstance(adapter, session.TimeoutHTTPAdapter)
+    assert adapter.timeout == 5 and adapter._pool_maxsize == 4
+
+    adapter = test_session.get_adapter('https://example.com/query?')
+    assert adapter.timeout == 30 and adapter._pool_maxsize == 2
+
+
+def test_shared_session():
+    """Verify HydroLink classes use the shared session unless one is supplied."""
+    session.set_session(None)
+    shared = session.get_session()
+    assert session.get_session() is shared
+    assert nhd_hr.HighResPoint(2, 42.7284, -84.5026).session is shared
+    assert nhd_mr.MedResPoint(2, 42.7284, -84.5026).session is shared
+
+    own_session = session.build_session()
+    assert nhd_hr.HighResPoint(2, 42.7284, -84.5026, session=own_session).session is own_session
@@ -0,0 +1,109 @@
+# !/usr/bin/env python
+
+"""Tests for `throttle` module."""
+
+import pytest
+import requests
+from hydrolink import backends
+from hydrolink import throttle
+from tests.conftest import FixtureResponse, FixtureSession
+
+
+class FakeClock:
+    """Clock advanced by sleep calls."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket():
+    """Requests beyond the burst wait for tokens at the configured rate."""
+    clock = FakeClock()
+    bucket = throttle.TokenBucket(rate=2.0, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_adaptive_limiter():
+    """Limit grows after successful requests, halves on failures and slow requests, within its range."""
+    limiter = throttle.AdaptiveLimiter(initial=4, minimum=1, maximum=6)
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.limit == 6
+
+    limiter.acquire()
+    limiter.release(success=False)
+    assert limiter.limit == 3
+
+    limiter.acquire()
+    limiter.release(latency=5.0)
+    assert limiter.limit == 1.5
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(success=False)
+    assert limiter.limit == 1 and limiter.in_flight == 0
+
+
+def test_adaptive_limiter_mixed_latency():
+    """A stable mix of fast and slow requests does not decrease the limit, a sustained climb in latency does."""
+    limiter = throttle.AdaptiveLimiter(initial=4, minimum=1, maximum=16)
+    # e.g. fast waterbody point queries and cached responses with slow flowline buffer queries
+    for _ in range(50):
+        for latency in [0.02] * 8 + [1.0, 0.5]:
+            limiter.acquire()
+            limiter.release(latency=latency)
+    assert limiter.limit == 16
+
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(latency=5.0)
+    assert limiter.limit < 4
+
+
+def test_throttle_retries():
+    """Throttled, failed and timed out requests are retried, honoring Retry-After."""
+    clock = FakeClock()
+    session = FixtureSession([FixtureResponse(status_code=429, headers={'Retry-After': '2'}),
+                              requests.Timeout('timed out'),
+                              FixtureResponse({'error': {'code': 503, 'message': 'busy'}}),
+                              FixtureResponse({'features': [1]})])
+    test_throttle = throttle.Throttle(sleep=clock.sleep)
+    assert test_throttle.request_json('https://watersgeo.epa.gov/query?', session) == {'features': [1]}
+    assert len(session.urls) == 4 and clock.sleeps[0] == 2.0
+    assert test_throttle.stats()['retried'] == 3
+    assert test_throttle.stats()['limits']['watersgeo.epa.gov'] == 2
+
+    session = FixtureSession([FixtureResponse(status_code=500)] * 3)
+    with pytest.raises(throttle.RetryableError):
+        throttle.Throttle(retries=2, sleep=clock.sleep).request_json('https://watersgeo.epa.gov/query?', session)
+
+
+def test_throttle_releases_failed_requests():
+    """Requests failing with errors that are not retried do not reduce the requests that can be in flight."""
+    session = FixtureSession([FixtureResponse(ValueError('response is not JSON'), status_code=403)] * 5 + [requests.exceptions.ChunkedEncodingError('dropped')] + [FixtureResponse({'features': [1]})])
+    test_throttle = throttle.Throttle(max_concurrency=2, sleep=lambda seconds: None)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            test_throttle.request_json('https://example.com/query?', session)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        test_throttle.request_json('https://example.com/query?', session)
+    assert test_throttle.host('https://example.com/query?')[1].in_flight == 0
+    assert test_throttle.request_json('https://example.com/query?', session) == {'features': [1]}
+
+
+def test_rest_backend_throttle():
+    """RestBackend requests through its throttle."""
+    session = FixtureSession([FixtureResponse(status_code=502), FixtureResponse({'features': [1]})])
+    backend = backends.RestBackend(session=session, throttle=throttle.Throttle(sleep=lambda seconds: None))
+    assert backend.request_json('https://hydromaintenance.nationalmap.gov/query?') == {'features': [1]}
+    assert len(session.urls) == 2
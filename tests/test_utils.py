@@ -2,21 +2,32 @@
 
 """Tests for `utils` package."""
 
+import difflib
 import pytest
 from shapely.geometry import Point
 from hydrolink import utils
 import json
+import numpy as np
+import pandas as pd
 
 
 def test_crs_to_nad83():
-    """Placeholder for test if conversions are occuring correctly.
+    """Test conversions of 3857 and 5070 coordinates to 4269, single points and arrays give the same result."""
+    lon, lat = -84.5026, 42.7284
+    for crs in [3857, 5070]:
+        x, y = utils.get_transformer('epsg:4269', f'epsg:{crs}').transform(lon, lat)
+        assert utils.crs_to_nad83(Point(x, y), crs) == pytest.approx((lon, lat), abs=1e-6)
+        lons, lats = utils.coordinates_to_nad83([x, x], [y, y], crs)
+        assert list(lons) == [utils.crs_to_nad83(Point(x, y), crs)[0]] * 2
+        assert list(lats) == [utils.crs_to_nad83(Point(x, y), crs)[1]] * 2
 
-    test if conversions are occuring correctly
-    4326 to 4269
-    3857 to 4269
-    5070 to 4269
-    """
-    pass
+
+def test_in_us_bounds():
+    """Test US bounding box check on arrays, including missing, 0 and positive lon values."""
+    lons = [-84.5, 0.0, 84.5, float('nan'), -66.1]
+    lats = [42.7, 0.0, 42.7, 42.7, 18.4]
+    assert list(utils.in_us_bounds(lons, lats)) == [True, False, False, False, True]
+    assert utils.in_us_bounds(-84.5, 42.7)
 
 
 def test_clean_water_name():
@@ -40,6 +51,23 @@ def test_clean_water_name():
     assert utils.clean_water_name('unt Grand Rv.') == 'unnamed tributary grand river'
 
 
+def test_water_name_cleaner():
+    """Test user supplied abbreviation rules and cleaning many names at once."""
+    assert utils.clean_water_name('Grand St St') == 'grand stream stream'
+    assert utils.clean_water_names(['Grand St', 'Grand Crk', 'Grand St']) == ['grand stream', 'grand crk', 'grand stream']
+    assert utils.clean_water_names(['Grand St', 'Grand Crk'], rules={'crk': 'creek'}) == ['grand stream', 'grand creek']
+    # missing names are not given the cleaned name of another row
+    assert utils.clean_water_names(['Grand St', None, 'Red Rv']) == ['grand stream', None, 'red river']
+    assert utils.clean_water_names(pd.Series(['Grand St', np.nan, 'Red Rv', None])) == ['grand stream', None, 'red river', None]
+
+    utils.set_abbreviations({'crk': 'creek', 'st': 'street'})
+    try:
+        assert utils.clean_water_name('Grand Crk St') == 'grand creek street'
+    finally:
+        utils.set_abbreviations()
+    assert utils.clean_water_name('Grand Crk St') == 'grand crk stream'
+
+
 def test_gnis_name_similarity():
     """Test function utils.gnis_name_similarity.  Ensure logic and match ratio correctly assigned."""
     gnis_name = 'Red Cedar River'
@@ -75,6 +103,71 @@ def test_gnis_name_similarity():
             assert 'flowline name similarity' not in name_similarity
 
 
+class CountingMatcher(utils.DifflibMatcher):
+    """Difflib matcher counting calls to ratios."""
+
+    def __init__(self):
+        self.calls = []
+
+    def ratios(self, names, other):
+        self.calls.append(list(names))
+        return super().ratios(names, other)
+
+
+def test_name_matchers():
+    """Candidate names are scored in one call of the name matcher, with the same messages as gnis_name_similarity."""
+    matcher = CountingMatcher()
+    utils.set_name_matcher(matcher)
+    try:
+        gnis_names = ['Red Cedar River', None, 'Cedar Creek', 'Red Cedar Lake', 'Cedar Creek']
+        names_similarity = utils.gnis_names_similarity(gnis_names, 'Red Cedar Rv.')
+        assert matcher.calls == [['red cedar river', 'cedar creek', 'red cedar lake']]
+        assert names_similarity == [utils.gnis_name_similarity(gnis_name, 'Red Cedar Rv.') for gnis_name in gnis_names]
+        assert len(matcher.calls) == 1
+        assert names_similarity[3]['flowline name similarity'] == utils.DifflibMatcher().ratio('red cedar lake', 'red cedar river')
+    finally:
+        utils.set_name_matcher()
+    assert [utils.similarity_message(r) for r in [0.8, 0.75, 0.6, 0.59]] == ['most likely match, based on fuzzy match'] * 2 + \
+        ['likely match, based on fuzzy match', 'likely not a match, based on fuzzy match']
+
+
+def test_rapidfuzz_matcher():
+    """Names are scored in one call with rapidfuzz when installed."""
+    pytest.importorskip('rapidfuzz')
+    matcher = utils.RapidfuzzMatcher()
+    names = ['red cedar', 'red cedar lake', 'grand river']
+    assert matcher.ratios(names, 'red cedar river') == [matcher.ratio(name, 'red cedar river') for name in names]
+    assert matcher.ratio('red cedar', 'red cedar river') == 0.75
+    assert matcher.ratios([], 'red cedar river') == []
+
+
+def test_default_name_matcher():
+    """Names are scored with difflib by default, whether or not rapidfuzz is installed."""
+    utils.set_name_matcher()
+    assert isinstance(utils.name_matcher, utils.DifflibMatcher)
+    for gnis_name, source_water_name in [('Grand Stream', 'Red Cedar River'), ('Grand Stream', 'Tributary Red Cedar'),
+                                         ('Red Cedar Lake', 'Red Cedar River')]:
+        cleaned_water_name = utils.clean_water_name(source_water_name)
+        ratio = difflib.SequenceMatcher(lambda x: x == " ", gnis_name.lower(), cleaned_water_name).ratio()
+        assert utils.name_similarity_ratio(gnis_name.lower(), cleaned_water_name) == ratio
+        if 'tributary' not in cleaned_water_name:
+            assert utils.gnis_name_similarity(gnis_name, source_water_name)['flowline name similarity'] == ratio
+
+
+def test_name_caches():
+    """Cleaned names and similarity ratios are memoized with the same results."""
+    utils.clear_name_caches()
+    first = utils.gnis_name_similarity('Grand Stream', 'Grand St.')
+    assert utils.name_cache_stats()['clean_water_name']['misses'] == 1
+    assert utils.gnis_name_similarity('Grand Stream', 'Grand St.') == first
+    stats = utils.name_cache_stats()
+    assert stats['clean_water_name']['hits'] == 1
+    assert stats['name_similarity_ratio'] == {'hits': 1, 'misses': 1, 'entries': 1, 'hit_rate': 0.5}
+    # returned dictionaries are not shared
+    first['flowline name similarity'] = 0
+    assert utils.gnis_name_similarity('Grand Stream', 'Grand St.')['flowline name similarity'] == 1.0
+
+
 def test_build_distance_line():
     """Test build_distance_line function.
 
@@ -97,6 +190,36 @@ def test_build_distance_line():
     assert arcmap_length_m_lt1 <= len <= arcmap_length_m_gt1
 
 
+def test_distances_meters():
+    """Vectorized distances match build_distance_line and reuse one transformer."""
+    points_1 = [Point(-72.522365, 41.485054), Point(-84.5026, 42.7284), Point(-149.9, 61.2)]
+    points_2 = [Point(-72.529494, 41.464437), Point(-84.51, 42.73), Point(-149.8, 61.21)]
+    distances = utils.distances_meters([p.x for p in points_1], [p.y for p in points_1], [p.x for p in points_2], [p.y for p in points_2])
+    for distance, point_1, point_2 in zip(distances, points_1, points_2):
+        assert distance == utils.build_distance_line(point_1, point_2)
+    assert utils.get_transformer('epsg:4269', 'epsg:5070') is utils.get_transformer('epsg:4269', 'epsg:5070')
+
+
+def test_geodesic_distances():
+    """Geodesic distances agree with projected distances in CONUS and invalid modes are rejected."""
+    point1 = Point(-72.522365, 41.485054)
+    point2 = Point(-72.529494, 41.464437)
+    arcmap_length_m = 2381.955938
+    geodesic_length_m = utils.build_distance_line(point1, point2, distance_mode='geodesic')
+    assert arcmap_length_m * 0.99 <= geodesic_length_m <= arcmap_length_m * 1.01
+
+    with pytest.raises(ValueError):
+        utils.distances_meters([0], [0], [1], [1], mode='planar')
+
+
+def test_confluence_points():
+    """Nodes shared by three or more flowlines are confluences, optionally within a snapping tolerance."""
+    nodes = [(-84.5, 42.7), (-84.5, 42.7), 'POINT (-84.5 42.7)', (-84.6, 42.8), (-84.6, 42.8), (-84.6000000001, 42.8)]
+    assert utils.confluence_points(nodes) == [(-84.5, 42.7)]
+    assert sorted(utils.confluence_points(nodes, tolerance=1e-7)) == [(-84.6, 42.8), (-84.5, 42.7)]
+    assert utils.closest_confluence(nodes[3:], Point(-84.5, 42.7)) is None
+
+
 def test_build_flowline_details():
     """Test build flowline details.
 
@@ -123,4 +246,15 @@ def test_build_flowline_details():
 
     closest_confluence_meters = utils.closest_confluence(all_flowline_terminal_node_points, input_point, flowline_geo)
     assert closest_confluence_meters == 595.535732278204
+
+    # evaluating all flowlines at once matches distances and measures calculated for each flowline
+    bulk_data, bulk_terminal_node_points, bulk_flowline_geo = utils.build_flowlines_details(flowlines_json['features'], input_point, 'nhdhr', 'Red Cedar River')
+    for flowline_data, flowline_attributes in zip(flowlines_json['features'], bulk_data):
+        flowline_geo = flowline_data['geometry']['paths'][0]
+        snap_point, snap_distance_meters = utils.point_to_line_meters(flowline_geo, input_point)
+        assert flowline_attributes['meters from flowline'] == snap_distance_meters
+        assert flowline_attributes['nhdhr flowline measure'] == utils.nhd_flowline_measure(flowline_geo, [x[2] for x in flowline_geo], snap_point)
+    assert sorted(bulk_terminal_node_points) == sorted(all_flowline_terminal_node_points)
+    assert utils.closest_confluence(bulk_terminal_node_points, input_point) == 595.535732278204
+    assert bulk_flowline_geo == flowline_geo
     # assert flowlines_data == flowlines_data_test